@@ -0,0 +1,25 @@
+"""Formato de payload por dispositivo
+
+Revision ID: 95be0e6b5897
+Revises: 40283723d5ef
+Create Date: 2026-10-18 16:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '95be0e6b5897'
+down_revision: Union[str, Sequence[str], None] = '40283723d5ef'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE devices ADD COLUMN IF NOT EXISTS payload_format VARCHAR DEFAULT 'json'")
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE devices DROP COLUMN IF EXISTS payload_format")
@@ -0,0 +1,27 @@
+"""Compresion del historian por tag
+
+Revision ID: c3f1a9d27e44
+Revises: 95be0e6b5897
+Create Date: 2026-10-18 17:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f1a9d27e44'
+down_revision: Union[str, Sequence[str], None] = '95be0e6b5897'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE device_tags ADD COLUMN IF NOT EXISTS compression_deviation FLOAT")
+    op.execute("ALTER TABLE device_tags ADD COLUMN IF NOT EXISTS exception_deviation FLOAT")
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE device_tags DROP COLUMN IF EXISTS exception_deviation")
+    op.execute("ALTER TABLE device_tags DROP COLUMN IF EXISTS compression_deviation")
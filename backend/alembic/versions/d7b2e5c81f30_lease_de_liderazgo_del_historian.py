@@ -0,0 +1,32 @@
+"""Lease de liderazgo del historian
+
+Revision ID: d7b2e5c81f30
+Revises: c3f1a9d27e44
+Create Date: 2026-10-18 18:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7b2e5c81f30'
+down_revision: Union[str, Sequence[str], None] = 'c3f1a9d27e44'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS service_leases (
+            name VARCHAR PRIMARY KEY,
+            holder VARCHAR,
+            expires_at FLOAT NOT NULL DEFAULT 0,
+            acquired_at FLOAT
+        )
+    """)
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS service_leases")
@@ -13,6 +13,71 @@ class Settings(BaseSettings):
     db_host: str | None = None
     db_name: str | None = None
     db_port: str = "5432"
+
+    # Ingesta MQTT (conexiones multiplexadas hacia AWS IoT)
+    mqtt_pool_size: int = 1              # Nº fijo de clientes MQTT compartidos por todos los equipos
+    mqtt_subscribe_rate: float = 20.0    # Paquetes SUBSCRIBE/s en total (x8 filtros; AWS IoT: 200 suscripciones/s por cuenta)
+    mqtt_subscribe_inflight: int = 4     # SUBSCRIBE sin SUBACK por conexión
+    ingest_workers: int = 4              # Workers que parsean, persisten y evalúan alertas
+    ingest_queue_size: int = 10000       # Capacidad total de la cola entre callback y workers
+    ingest_overflow_policy: str = "block"  # block | drop_oldest | spill
+    ingest_spill_dir: str = "./spool/ingest"
+    ingest_max_clock_skew_s: int = 7 * 86400  # ts del equipo a más de esto de la recepción se reemplaza por la hora del servidor
+
+    # Escritura de históricos por lotes (group commit)
+    telemetry_batch_size: int = 5000       # Filas por lote antes de forzar el volcado
+    telemetry_flush_interval_ms: int = 250  # Edad máxima de una fila en el buffer
+    telemetry_spool_enabled: bool = True    # WAL local cuando la base falla o se atrasa (se reproduce al volver)
+    telemetry_spool_dir: str = "./spool/telemetry"
+    telemetry_spool_segment_mb: int = 64    # Tamaño de cada segmento del spool
+    telemetry_spool_max_mb: int = 4096      # Tope en disco (~1 MB/s a 5000 filas/s: 30 min ≈ 1.8 GB); luego se descarta lo más viejo
+    telemetry_spool_fsync_s: float = 1.0    # fsync agrupado: como mucho uno por intervalo
+    telemetry_spool_lag_s: float = 10.0     # Filas que esperaron más que esto en memoria van directo al spool
+    telemetry_spool_retry_s: float = 5.0    # Tras un error de la base, cada cuánto se vuelve a intentar
+    alert_flush_interval_ms: int = 500      # Cada cuánto se persisten altas/cierres de alertas
+    alert_flush_max_retries: int = 600      # Reintentos de una transición ante errores transitorios (~5 min a 500 ms)
+    alert_max_pending: int = 100000         # Tope de la cola de persistencia de alertas
+    alarm_vector_threshold: int = 64        # Tags por payload a partir de los cuales se evalúa con NumPy
+
+    # Envío en vivo por WebSocket
+    ws_max_rate_hz: float = 5.0     # Envíos máximos por segundo por equipo/rama (último valor)
+    ws_send_queue_size: int = 32    # Frames pendientes por socket antes de desalojarlo
+    ws_send_timeout_s: float = 5.0  # Tiempo máximo de un send antes de considerar el socket colgado
+
+    # Bus del vivo entre procesos (uvicorn con varios workers)
+    live_bus_backend: str = "local"       # local | redis | postgres | unix
+    live_bus_url: str = ""                # redis://host:6379/0 | DSN de Postgres (vacío: la base de la app) | ruta del socket UNIX
+    live_bus_channel: str = "synteck_live"
+    live_bus_interest_s: float = 5.0      # Cada cuánto cada worker anuncia los equipos con sockets abiertos
+    live_bus_state_timeout_s: float = 1.0 # Espera máxima del estado (últimos valores) pedido al worker que ingesta
+    ingest_enabled: bool = True           # False: el worker solo sirve WebSockets; la ingesta corre en otro proceso
+
+    # Liderazgo de la ingesta 24/7 entre workers/réplicas (lease en service_leases)
+    leader_election_enabled: bool = True  # False: cada proceso ingesta por su cuenta (un solo worker)
+    leader_lease_ttl_s: float = 10.0      # Sin heartbeat durante este tiempo, un standby toma el liderazgo
+    leader_heartbeat_s: float = 2.0       # Cada cuánto el líder renueva (y los standby intentan tomar) el lease
+
+    # Compresión del historian (por tag: DeviceTag.compression_deviation)
+    historian_compression_max_interval: int = 3600  # Segundos máximos sin archivar un punto por serie
+    historian_reconcile_interval_s: float = 60.0    # Diff periódico de history_enabled/is_active contra la base (0 = solo eventos)
+
+    # Registro de bridges: gracia antes de retirar la suscripción de un equipo sin holds
+    bridge_viewer_grace_s: float = 5.0    # Tras cerrar el último dashboard (recargas no re-suscriben)
+    bridge_recorder_grace_s: float = 0.0  # Tras quitar la grabación 24/7 (0 = inmediato)
+
+    # Deduplicación de re-entregas QoS 1
+    ingest_dedup_enabled: bool = True
+    ingest_dedup_seq_field: str = "seq"      # Nº de secuencia del equipo (sin seq: hash de tópico + payload si trae ts; sin ts no se deduplica)
+    ingest_dedup_window: int = 64            # Huellas recordadas por equipo
+    ingest_dedup_window_seconds: int = 600   # Antigüedad máxima de una huella (seq o hash de payload con ts)
+    ingest_dedup_max_devices: int = 10000    # Ventanas por equipo en memoria (LRU)
+
+    # Logging
+    log_level: str = "INFO"          # Nivel raíz
+    log_levels: str = ""             # Por subsistema: "app.services.mqtt_bridge=DEBUG,app.router=WARNING"
+    log_format: str = "text"         # text | json (una línea JSON por evento)
+    log_sample_every: int = 100      # Logs DEBUG del camino caliente: 1 de cada N mensajes por equipo
+    sql_echo: bool = False           # Consultas SQL de SQLAlchemy (conmutable en /monitor/logging)
     
     # Esta configuración le dice a Pydantic que busque un archivo .env
     model_config = SettingsConfigDict(
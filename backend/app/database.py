@@ -1,4 +1,5 @@
 import os
+import logging
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -7,14 +8,16 @@ from sqlalchemy.orm import sessionmaker
 # De lo contrario, crea el archivo local synteck.db
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
 # Si tenemos credenciales de DB en las settings, construimos la URL de Postgres
 if settings.db_user and settings.db_host:
     SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.db_user}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_name}"
-    print(f"✅ USANDO BASE DE DATOS: PostgreSQL ({settings.db_host})")
+    logger.info(f"✅ USANDO BASE DE DATOS: PostgreSQL ({settings.db_host})")
 else:
     # Fallback a SQLite local si no hay variables definidas
     SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./synteck.db")
-    print("⚠️ USANDO BASE DE DATOS: SQLite Local")
+    logger.warning("⚠️ USANDO BASE DE DATOS: SQLite Local")
 
 # check_same_thread es solo necesario para SQLite
 connect_args = {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
@@ -22,7 +25,8 @@ connect_args = {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswit
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
     connect_args=connect_args,
-    echo=True # Esto imprimirá en tu consola todas las consultas SQL que haga SQLAlchemy
+    # Sin echo: las consultas SQL se activan con SQL_ECHO o en caliente desde /monitor/logging
+    echo=False
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
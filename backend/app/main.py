@@ -1,9 +1,15 @@
 import os
 import asyncio
+import logging
 from dotenv import load_dotenv
 
 load_dotenv() # Load environment variables from .env file
 
+# Logging antes de importar routers/servicios (cola no bloqueante + niveles por subsistema)
+from app.utils.logging_config import setup_logging, shutdown_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.database import engine
@@ -50,17 +56,70 @@ async def startup_event():
     else:
         print("🔓 SEGURIDAD: HTTP / Localhost")
     
+    # --- BUS DEL VIVO (reparte la ingesta a los sockets de todos los workers) ---
+    from app.config import settings
+    from app.services.live_bus import live_bus
+    from app.services.websocket_manager import ws_manager
+    live_bus.start(
+        asyncio.get_running_loop(), ws_manager,
+        on_interest=monitor.on_remote_interest if settings.ingest_enabled else None,
+        ingesting=monitor.ingest_active
+    )
+    logger.info(f"📡 BUS EN VIVO: {live_bus.name} | INGESTA: {'sí' if settings.ingest_enabled else 'no (solo WebSockets)'}")
+
     # --- INICIAR HISTORIAN (GRABACIÓN 24/7) ---
     from app.services.historian import historian
-    asyncio.create_task(historian.start_all_enabled())
+    from app.services.telemetry_writer import telemetry_writer
+    telemetry_writer.start()
+    # Registro de equipos en memoria (metadata para la ingesta)
+    from app.services.device_registry import device_registry
+    from app.services.alarm_rules import alarm_rules
+    from app.services.alert_state import alert_state
+    device_registry.load_all()
+    alarm_rules.load_all()
+    from app.services.compression import historian_compressor
+    historian_compressor.load_all()
+    alert_state.load_from_db()
+    alert_state.start()
+    # --- LIDERAZGO: solo un proceso (el líder) corre el historian 24/7 y los bridges ---
+    if settings.ingest_enabled:
+        from app.services.leader import historian_leader
+        loop = asyncio.get_running_loop()
+        # La primera elección consulta la base: fuera del event loop
+        await loop.run_in_executor(None, lambda: historian_leader.start(
+            on_elected=lambda: loop.call_soon_threadsafe(monitor.start_ingest_role),
+            on_demoted=lambda: loop.call_soon_threadsafe(monitor.stop_ingest_role)
+        ))
+        # Altas/bajas de grabación 24/7 en caliente (eventos del registro + diff periódico)
+        from app.services.historian_reconciler import historian_reconciler
+        historian_reconciler.start(loop)
+        role = "líder" if historian_leader.is_leader else "standby"
+        logger.info(f"👑 HISTORIAN: {role} ({historian_leader.holder})")
+        if historian_leader.enabled and live_bus.name == "local":
+            logger.warning("ℹ️ Bus local: si se corren varios workers, solo el líder tendrá datos en vivo (ver LIVE_BUS_BACKEND)")
     
     print("="*50 + "\n")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     print("🛑 Apagando Servidor...")
-    from app.services.historian import historian
-    historian.stop_all()
+    from app.services.historian_reconciler import historian_reconciler
+    historian_reconciler.stop()
+    from app.services.bridge_registry import bridge_registry
+    from app.services.mqtt_bridge import ingest_service
+    from app.services.telemetry_writer import telemetry_writer
+    bridge_registry.stop_all()
+    ingest_service.stop()
+    # El lease se suelta después de detener la ingesta: el standby toma el relevo sin solaparse
+    from app.services.leader import historian_leader
+    historian_leader.stop()
+    from app.services.live_bus import live_bus
+    await live_bus.stop()
+    # Al final: el pipeline ya entregó sus filas, ahora se vacía el buffer
+    telemetry_writer.stop()
+    from app.services.alert_state import alert_state
+    alert_state.stop()
+    shutdown_logging()
 
 app.add_middleware(
     CORSMiddleware,
@@ -161,6 +161,9 @@ class Device(Base):
 
     history_enabled = Column(Boolean, default=False) # Feature Toggle
 
+    # Formato del payload MQTT: json | msgpack | cbor | auto (detección por contenido)
+    payload_format = Column(String, default="json")
+
 
     # Config específica (ej. Modbus TCP/RTU)
     modbus_config = Column(JSON, nullable=True)
@@ -288,6 +291,10 @@ class DeviceTag(Base):
     # Parámetros de Calidad de Alarmas (Configurables por Partner)
     hysteresis = Column(Float, default=0.0)         # Banda muerta para el retorno al rango normal
     alert_delay = Column(Integer, default=0)        # Segundos que debe persistir el error para disparar alerta
+
+    # Compresión del historian (None = se guarda cada muestra)
+    compression_deviation = Column(Float, nullable=True)  # Error máximo de reconstrucción (excepción + swinging door)
+    exception_deviation = Column(Float, nullable=True)    # Banda muerta de excepción (None = compression_deviation / 4; tope / 2)
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -342,4 +349,18 @@ class TelemetryLog(Base):
     data = Column(JSON, nullable=False)
     
     # Rama de donde viene (subtópico)
-    path = Column(String, nullable=True)
\ No newline at end of file
+    path = Column(String, nullable=True)
+
+
+class ServiceLease(Base):
+    """
+    Lease de liderazgo entre procesos/réplicas (p. ej. el historian 24/7).
+    Un solo `holder` vigente por `name`; se renueva con heartbeat y se
+    considera libre cuando `expires_at` (epoch) quedó en el pasado.
+    """
+    __tablename__ = "service_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=True)
+    expires_at = Column(Float, nullable=False, default=0)
+    acquired_at = Column(Float, nullable=True)
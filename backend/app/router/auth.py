@@ -17,8 +17,11 @@ from ..auth import (
 )
 from ..utils.mailer import send_recovery_email
 import uuid
+import logging
 from datetime import timedelta
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 
@@ -122,7 +125,7 @@ def refresh_token(data: schemas.RefreshTokenRequest, db: Session = Depends(get_d
 
     if not db_token:
         # Log para depuración en consola
-        print(f"DEBUG: Intento de refresh fallido con token: {data.refresh_token[:10]}...")
+        logger.debug(f"Intento de refresh fallido con token: {data.refresh_token[:10]}...")
         raise HTTPException(status_code=401, detail="Refresh token inválido o expirado")
 
     # 2. Buscar usuario primero para asegurar que la respuesta sea completa
@@ -273,11 +276,9 @@ def logout(data: schemas.RefreshTokenRequest, db: Session = Depends(get_db)):
         db.commit()
         
         # LOG DE ÉXITO: Muestra el ID del usuario y los primeros caracteres del token
-        print(f"\n[AUTH] 🚪 Logout exitoso: Usuario ID {db_token.user_id}")
-        print(f"[AUTH] 🛡️ Token invalidado: {data.refresh_token[:10]}...\n")
+        logger.info(f"[AUTH] 🚪 Logout exitoso: Usuario ID {db_token.user_id} | 🛡️ Token invalidado: {data.refresh_token[:10]}...")
     else:
         # LOG DE ADVERTENCIA: Alguien intentó cerrar sesión con un token que no existe
-        print(f"\n[AUTH] ⚠️ Intento de logout con token inexistente o inválido.")
-        print(f"[AUTH] Token recibido: {data.refresh_token[:10]}...\n")
+        logger.warning(f"[AUTH] ⚠️ Intento de logout con token inexistente o inválido: {data.refresh_token[:10]}...")
 
     return {"detail": "Sesión cerrada exitosamente."}
\ No newline at end of file
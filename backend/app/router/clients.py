@@ -7,6 +7,11 @@ from .. import models, schemas, database
 from ..auth import get_current_user, pwd_context, hash_password
 from sqlalchemy.orm import joinedload
 from ..utils.mailer import send_invitation_email  # Asegúrate de que esta sea la ruta real
+from ..services.device_registry import device_registry
+import logging
+
+logger = logging.getLogger(__name__)
+
 router = APIRouter(
     prefix="/clients",
     tags=["Clients"]
@@ -47,7 +52,7 @@ def read_client(
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    print(f"🔍 [DEBUG] Buscando info base del Cliente ID: {client_id}")
+    logger.debug(f"🔍 Buscando info base del Cliente ID: {client_id}")
     
     # 1. Buscamos el cliente
     query = db.query(models.Client).filter(models.Client.id == client_id)
@@ -66,10 +71,10 @@ def read_client(
     db_client = query.first()
 
     if not db_client:
-        print(f"❌ [DEBUG] Cliente {client_id} no encontrado o sin acceso")
+        logger.debug(f"❌ Cliente {client_id} no encontrado o sin acceso")
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
         
-    print(f"✅ [DEBUG] Enviando info de: {db_client.name}")
+    logger.debug(f"✅ Enviando info de: {db_client.name}")
     return db_client
 
 @router.get("/{client_id}/users", response_model=List[schemas.UserOut])
@@ -136,7 +141,7 @@ async def create_client_user( # <--- Agregamos 'async'
 
     except Exception as e:
         db.rollback()
-        print(f"🔥 Error en el proceso: {str(e)}")
+        logger.error(f"🔥 Error en el proceso: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     
     
@@ -237,7 +242,7 @@ def update_client_module(
 
     # 3. SIDE EFFECT: Propagar a dispositivos (Backward Compatibility)
     if module_in.module_code == 'history':
-        print(f"🔄 [SYNC] Sincronizando módulo History para cliente {client.name}")
+        logger.info(f"🔄 [SYNC] Sincronizando módulo History para cliente {client.name}")
         
         # Buscar todas las plantas del cliente
         plants = db.query(models.Plant).filter(models.Plant.client_id == client_id).all()
@@ -250,6 +255,8 @@ def update_client_module(
             dev.history_enabled = module_in.is_active
         
         db.commit()
-        print(f"✅ [SYNC] {len(devices)} equipos actualizados a history_enabled={module_in.is_active}")
+        # Registro en memoria: la ingesta usa el flag nuevo y el historian reconcilia en caliente
+        device_registry.refresh(db, client_id=client_id)
+        logger.info(f"✅ [SYNC] {len(devices)} equipos actualizados a history_enabled={module_in.is_active}")
 
     return db_module
\ No newline at end of file
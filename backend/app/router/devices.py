@@ -8,8 +8,10 @@ import json
 from app.database import get_db  # <--- Esta es la que falta
 import logging
 from ..config import settings
-# Configuración básica de logging si no la tienes en tu app.main
-logging.basicConfig(level=logging.INFO)
+from ..services.device_registry import device_registry
+from ..services.alarm_rules import alarm_rules
+from ..services.compression import historian_compressor
+# La configuración de handlers/niveles vive en app.utils.logging_config
 logger = logging.getLogger(__name__)
 
 AWS_ROOT_CA = """-----BEGIN CERTIFICATE-----
@@ -62,7 +64,7 @@ def get_all_partner_devices(
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    print(f"📡 [DEBUG] Buscando todos los dispositivos para Partner ID: {current_user.partner_id}")
+    logger.debug(f"📡 Buscando todos los dispositivos para Partner ID: {current_user.partner_id}")
     
     # Esta query atraviesa: Device -> Plant -> Client -> Partner
     devices = db.query(models.Device)\
@@ -71,7 +73,7 @@ def get_all_partner_devices(
         .filter(models.Client.partner_id == current_user.partner_id)\
         .all()
 
-    print(f"✅ [DEBUG] Se encontraron {len(devices)} dispositivos")
+    logger.debug(f"✅ Se encontraron {len(devices)} dispositivos")
     return devices
 
 
@@ -81,7 +83,7 @@ def create_device(
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    print(f"🚀 [DEBUG] Recibida solicitud para crear: {device.name}")
+    logger.debug(f"🚀 Recibida solicitud para crear: {device.name}")
     
     # 1. Validar seguridad: ¿La planta pertenece al Partner del usuario?
     # Usamos device.plant_id que viene en el JSON
@@ -91,7 +93,7 @@ def create_device(
     ).first()
 
     if not plant:
-        print(f"❌ [DEBUG] Acceso denegado o planta {device.plant_id} inexistente")
+        logger.debug(f"❌ Acceso denegado o planta {device.plant_id} inexistente")
         raise HTTPException(status_code=403, detail="No tienes permisos para esta planta")
 
     # 2. Crear el objeto con los datos del esquema
@@ -102,8 +104,9 @@ def create_device(
     db.add(db_device)
     db.commit()
     db.refresh(db_device)
+    device_registry.refresh(db, device_id=db_device.id)
     
-    print(f"✅ [DEBUG] Equipo {db_device.id} vinculado con éxito")
+    logger.info(f"✅ Equipo {db_device.id} vinculado con éxito")
     return db_device
 
 
@@ -114,50 +117,38 @@ def get_devices_by_plant(
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    print("\n" + "="*50)
-    print(f"🚀 [ENTRADA] Request a /devices/plant/{plant_id}")
-    print(f"👤 [USER] Email: {current_user.email} | Partner ID: {current_user.partner_id}")
-    print("="*50)
+    logger.debug(f"🚀 [ENTRADA] /devices/plant/{plant_id} | 👤 {current_user.email} | Partner ID: {current_user.partner_id}")
 
     try:
-        # Paso 1: Ver si la planta existe siquiera en la DB
-        raw_plant = db.query(models.Plant).filter(models.Plant.id == plant_id).first()
-        if not raw_plant:
-            print(f"❓ [DB] La planta con ID {plant_id} NO EXISTE en la tabla 'plants'.")
-        else:
-            print(f"🏠 [DB] Planta encontrada: {raw_plant.name} (Client ID: {raw_plant.client_id})")
-
-        # Paso 2: Verificación con el JOIN y el Partner
-        print(f"🔒 [AUTH] Verificando si pertenece al Partner: {current_user.partner_id}...")
-        
+        # Paso 1: Verificación con el JOIN y el Partner
         query = db.query(models.Plant).join(models.Client).filter(
             models.Plant.id == plant_id,
             models.Client.partner_id == current_user.partner_id
         )
-        
-        # Imprimir el SQL generado para depurar
-        print(f"📑 [SQL] Query generado: {query}")
-        
         plant = query.first()
 
         if not plant:
-            print(f"❌ [DENIED] Acceso denegado o relación rota.")
-            print(f"REVISAR: ¿El cliente de la planta {plant_id} tiene partner_id = {current_user.partner_id}?")
+            # Diagnóstico (consulta extra) solo con DEBUG activo
+            if logger.isEnabledFor(logging.DEBUG):
+                raw_plant = db.query(models.Plant).filter(models.Plant.id == plant_id).first()
+                logger.debug(
+                    f"❌ [DENIED] Planta {plant_id} "
+                    + (f"pertenece al Client ID {raw_plant.client_id}" if raw_plant else "NO EXISTE")
+                    + f"; partner del usuario: {current_user.partner_id} | 📑 [SQL] {query}"
+                )
             # Aquí es donde se dispara el 404 que ves
             raise HTTPException(status_code=404, detail="Planta no encontrada o sin acceso")
 
-        # Paso 3: Buscar dispositivos
-        print(f"✅ [SUCCESS] Acceso concedido a la planta: {plant.name}")
+        # Paso 2: Buscar dispositivos
         devices = db.query(models.Device).filter(models.Device.plant_id == plant_id).all()
-        
-        print(f"📦 [RESULT] Dispositivos en DB: {len(devices)}")
-        for d in devices:
-            print(f"   - ID: {d.id} | Name: {d.name} | UID: {d.aws_iot_uid}")
+        logger.debug(f"📦 [RESULT] Planta {plant.name}: {len(devices)} dispositivos")
 
         return devices
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"💥 [ERROR CRITICO] {str(e)}")
+        logger.error(f"💥 [ERROR CRITICO] {str(e)}")
         raise e
     
 @router.post("/{device_id}/provision", response_model=schemas.ProvisionResponse)
@@ -235,6 +226,7 @@ async def provision_device(
         device.thing_arn = iot_data.get('thingArn')
         device.is_active = True
         db.commit()
+        device_registry.refresh(db, device_id=device.id)
         
         return {
             "status": "success",
@@ -332,6 +324,9 @@ async def register_device_tag(
 
     db.commit()
     db.refresh(db_tag)
+    # Recompilar las reglas de alarma del equipo
+    alarm_rules.refresh_device(device.id, db)
+    historian_compressor.refresh_device(device.id, db)
     return db_tag
 
 @router.get("/{device_id}/tags", response_model=List[schemas.TagRegistration])
@@ -371,7 +366,9 @@ async def get_device_tags(
             "min_value": tag.min_value,
             "max_value": tag.max_value,
             "label_0": tag.label_0,
-            "label_1": tag.label_1
+            "label_1": tag.label_1,
+            "compression_deviation": tag.compression_deviation,
+            "exception_deviation": tag.exception_deviation
         })
 
     logger.info(f"✅ Se recuperaron {len(tags_list)} tags para el equipo {device.aws_iot_uid}")
@@ -406,6 +403,8 @@ async def delete_device_tag(
 
     db.delete(db_tag)
     db.commit()
+    alarm_rules.refresh_device(device_id, db)
+    historian_compressor.refresh_device(device_id, db)
     
     logger.info(f"🗑️ Tag {mqtt_key} eliminado del equipo {device_id}")
 @router.put("/{device_id}", response_model=schemas.DeviceOut)
@@ -415,7 +414,7 @@ def update_device(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    print(f"🔄 [DEBUG] Actualizando dispositivo {device_id}")
+    logger.debug(f"🔄 Actualizando dispositivo {device_id}")
     
     # 1. Buscar y verificar propiedad
     device = db.query(models.Device).join(models.Plant).join(models.Client).filter(
@@ -433,6 +432,7 @@ def update_device(
 
     db.commit()
     db.refresh(device)
+    device_registry.refresh(db, device_id=device.id)
     
-    print(f"✅ [DEBUG] Dispositivo {device_id} actualizado. History Enabled: {device.history_enabled}")
+    logger.info(f"✅ Dispositivo {device_id} actualizado. History Enabled: {device.history_enabled}")
     return device
\ No newline at end of file
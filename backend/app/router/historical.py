@@ -11,6 +11,11 @@ import csv
 import pandas as pd
 import pytz
 from typing import Optional
+import logging
+from app.services.compression import historian_compressor, interpolate, bucket_average
+from app.services.alarm_rules import normalize_path
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/historical", tags=["Historical Data"])
 
@@ -29,7 +34,7 @@ def get_device_history(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    print(f"📡 [Historical] Petición recibida: {device_uid} | Rango: {time_range} | Start: {start} | End: {end}")
+    logger.debug(f"📡 [Historical] Petición recibida: {device_uid} | Rango: {time_range} | Start: {start} | End: {end}")
     # 1. Validar que el dispositivo existe y el usuario tiene acceso
     # Traemos el timezone del cliente a través de la relación Device -> Plant -> Client
     device = db.query(models.Device).filter(models.Device.aws_iot_uid == device_uid).first()
@@ -104,7 +109,7 @@ def get_device_history(
         """
         
         try:
-            print(f"📊 [Timestream] Executing: {sql}")
+            logger.debug(f"📊 [Timestream] Executing: {sql}")
             response = query_client.query(QueryString=sql)
             raw_rows = response.get('Rows', [])
             processed_data = {}
@@ -136,12 +141,12 @@ def get_device_history(
             
             final_list = list(processed_data.values())
         except Exception as e:
-            print(f"AWS Error: {e}")
+            logger.error(f"AWS Error: {e}")
             final_list = []
 
     else:
         # --- LÓGICA LOCAL (SQLITE) ---
-        print(f"🏠 [Historical] Usando Fallback Local (SQLite) para {device_uid}")
+        logger.debug(f"🏠 [Historical] Usando Fallback Local (SQLite) para {device_uid}")
         
         query = db.query(models.TelemetryLog).filter(models.TelemetryLog.device_uid == device_uid)
         
@@ -159,6 +164,12 @@ def get_device_history(
             query = query.filter(models.TelemetryLog.timestamp >= threshold)
         
         logs = query.order_by(models.TelemetryLog.timestamp.asc()).all()
+
+        # Tags con compresión (deadband + swinging door): solo hay filas donde se
+        # archivó un punto, así que su tendencia se reconstruye por interpolación.
+        # Cada serie es de una rama: la misma llave en otro subtopic es otra serie
+        compressed_keys = historian_compressor.configured_keys(device.id)
+        series = {}
         
         # Agrupación por intervalo dinámico para evitar saturar el navegador (SQLite Fallback)
         bucket_minutes = 1
@@ -189,9 +200,15 @@ def get_device_history(
                 aggregated_rows[time_key] = {"time": time_key, "_counts": {}}
             
             if isinstance(log.data, dict):
+                path = normalize_path(log.path) if compressed_keys else None
                 for k, v in log.data.items():
                     all_measure_names.add(k)
-                    if isinstance(v, (int, float)):
+                    if (path, k) in compressed_keys and isinstance(v, (int, float)):
+                        ts_utc = log.timestamp if log.timestamp.tzinfo else log.timestamp.replace(tzinfo=pytz.UTC)
+                        points = series.setdefault((path, k), ([], []))
+                        points[0].append(ts_utc.timestamp())
+                        points[1].append(v)
+                    elif isinstance(v, (int, float)):
                         current_val = aggregated_rows[time_key].get(k, 0)
                         aggregated_rows[time_key][k] = current_val + v
                         aggregated_rows[time_key]["_counts"][k] = aggregated_rows[time_key]["_counts"].get(k, 0) + 1
@@ -208,6 +225,41 @@ def get_device_history(
                     row[k] = row[k] / counts[k]
             final_list.append(row)
 
+        # El tramo final de cada serie comprimida aún no se archiva: se toma de memoria
+        for series_key, tail in historian_compressor.pending_points(device_uid).items():
+            if series_key in series:
+                times, values = series[series_key]
+                for point_ts, point_v in sorted(tail):
+                    if point_ts > times[-1]:
+                        times.append(point_ts)
+                        values.append(point_v)
+
+        # Reconstrucción de tags comprimidos: valor interpolado en cada fila
+        # (data cruda) o promedio ponderado en el tiempo del bucket
+        bucket_seconds = bucket_minutes * 60 if bucket_minutes > 1 else 0
+        row_times = [
+            datetime.strptime(row["time"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=pytz.UTC).timestamp()
+            for row in final_list
+        ] if series else []
+        for row, row_ts in zip(final_list, row_times):
+            # La misma llave en varias ramas se promedia, como los valores crudos
+            sums = {}
+            for (path, k), (times, values) in series.items():
+                if bucket_seconds:
+                    value = bucket_average(times, values, row_ts, row_ts + bucket_seconds)
+                else:
+                    # Las filas crudas van truncadas al segundo
+                    value = interpolate(times, values, row_ts, tolerance=1.0)
+                if value is not None:
+                    total, count = sums.get(k, (0.0, 0))
+                    sums[k] = (total + value, count + 1)
+            for k, (total, count) in sums.items():
+                raw = row.get(k)
+                if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+                    # Promedio crudo de una rama sin compresión con la misma llave
+                    total, count = total + raw, count + 1
+                row[k] = total / count
+
     # --- REDONDEO GLOBAL (Para todos los formatos) ---
     for item in final_list:
         for key, value in item.items():
@@ -1,17 +1,243 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session, joinedload
 from app.database import get_db
-from app import models
-from app.services.mqtt_bridge import start_mqtt_bridge
+from app import models, auth, schemas
+from app.services.mqtt_bridge import ingest_service
+from app.services.bridge_registry import bridge_registry, VIEWER
 from app.services.websocket_manager import ws_manager
+from app.services.device_registry import device_registry
+from app.services.last_values import last_values
+from app.services.live_bus import live_bus
+from app.services.leader import historian_leader
+from app.services.alarm_rules import alarm_rules
+from app.services.alert_state import alert_state
+from app.services.compression import historian_compressor
+from app.services.telemetry_writer import telemetry_writer
+from app.config import settings
+from app.utils import logging_config
 import asyncio
+import json
+import logging
 
 from app.services.historian import historian
+from app.services.historian_reconciler import historian_reconciler
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/monitor", tags=["Real-time Monitoring"])
 
-# Estructura: { "device_uid": {"client": mqtt_obj, "ref_count": int, "stop_task": Task} }
-active_bridges = {}
+def _require_super_admin(user):
+    """Endpoints de operación (internos de la ingesta, logging): solo super admin (sin partner ni cliente)."""
+    if user.partner_id is not None or user.client_id is not None:
+        raise HTTPException(status_code=403, detail="Solo super administradores")
+
+@router.get("/ingest/stats")
+def get_ingest_stats(current_user: models.User = Depends(auth.get_current_user)):
+    """Estado del pipeline de ingesta: conexiones, profundidad de cola y descartes. Solo super admin."""
+    _require_super_admin(current_user)
+    return {
+        **ingest_service.stats(),
+        "leader": {**historian_leader.stats(), "lease": historian_leader.current()},
+        "historian": historian_reconciler.stats(),
+        "bridges": bridge_registry.stats()
+    }
+
+@router.get("/bridges")
+def get_bridges(current_user: models.User = Depends(auth.get_current_user)):
+    """Suscripciones por equipo del registro de bridges (oyentes, grabación, gracia). Solo super admin."""
+    _require_super_admin(current_user)
+    return bridge_registry.snapshot()
+
+@router.get("/ingest/readiness")
+def get_ingest_readiness(response: Response, current_user: models.User = Depends(auth.get_current_user)):
+    """Progreso del arranque de la ingesta; 503 mientras el líder tenga equipos sin SUBACK."""
+    readiness = ingest_service.readiness()
+    readiness["role"] = "leader" if ingest_active() else "standby"
+    if readiness["role"] == "leader" and not readiness["ready"]:
+        response.status_code = 503
+    return readiness
+
+def _fetch_state(device_uids):
+    """
+    Fuera del worker que ingesta `last_values` solo tiene lo que llegó por el
+    bus: se pide el estado vigente al que ingesta antes de armar el snapshot.
+    """
+    if device_uids and not ingest_active():
+        live_bus.fetch_state(device_uids)
+
+def _device_snapshot(record):
+    values, updated_at = last_values.get(record.aws_iot_uid)
+    return {
+        "device_uid": record.aws_iot_uid,
+        "device_id": record.id,
+        "name": record.name,
+        "plant_id": record.plant_id,
+        "updated_at": updated_at,
+        "values": values
+    }
+
+def _can_read(record, user):
+    """Mismo alcance que el resto de endpoints: super admin todo; si no, equipos del partner (o del cliente)."""
+    if user.partner_id is None and user.client_id is None:
+        return True
+    if user.partner_id is not None and record.partner_id == user.partner_id:
+        return True
+    return user.client_id is not None and record.client_id == user.client_id
+
+@router.get("/snapshot")
+def get_devices_snapshot(
+    device_uids: str = Query(..., description="UIDs separados por coma"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Valores actuales (último valor, ts de servidor y rama) de una lista de equipos."""
+    records = []
+    for uid in dict.fromkeys(u.strip() for u in device_uids.split(",") if u.strip()):
+        record = device_registry.get_or_load(uid, db)
+        if record is not None and _can_read(record, current_user):
+            records.append(record)
+    _fetch_state([r.aws_iot_uid for r in records])
+    return {"devices": [_device_snapshot(r) for r in records]}
+
+@router.get("/snapshot/plant/{plant_id}")
+def get_plant_snapshot(
+    plant_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Valores actuales de todos los equipos de una planta."""
+    if not device_registry.loaded:
+        device_registry.load_all(db)
+    records = [r for r in device_registry.all() if r.plant_id == plant_id and _can_read(r, current_user)]
+    if not records:
+        raise HTTPException(status_code=404, detail="Planta no encontrada o sin acceso")
+    _fetch_state([r.aws_iot_uid for r in records])
+    return {"plant_id": plant_id, "devices": [_device_snapshot(r) for r in records]}
+
+@router.get("/logging")
+def get_logging_config(current_user: models.User = Depends(auth.get_current_user)):
+    """Niveles de log efectivos y estado del SQL echo."""
+    return {"sql_echo": logging_config.sql_echo_enabled(), "levels": logging_config.current_levels()}
+
+@router.put("/logging")
+def update_logging_config(
+    config_in: schemas.LoggingConfigUpdate,
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Cambia niveles por subsistema y el SQL echo en caliente (sin reiniciar). Solo super admin."""
+    _require_super_admin(current_user)
+    for name, level in (config_in.levels or {}).items():
+        if not isinstance(logging.getLevelName(level.upper()), int):
+            raise HTTPException(status_code=400, detail=f"Nivel de log inválido: {level}")
+    for name, level in (config_in.levels or {}).items():
+        logging_config.set_level(name, level)
+    if config_in.sql_echo is not None:
+        logging_config.set_sql_echo(config_in.sql_echo)
+    logger.info(f"🔧 Logging actualizado por {current_user.email}: {config_in.model_dump(exclude_none=True)}")
+    return get_logging_config(current_user)
+
+def _acquire_bridge(device_uid, partner_id, client_id, plant_id, db=None):
+    """Suma un oyente a la suscripción del equipo (la levanta si no existe)."""
+    device_info = device_registry.get_or_load(device_uid, db)
+    if device_info is not None:
+        spec = device_info.bridge_spec()
+    else:
+        # Equipo fuera del registro: ids de la URL y metadata por defecto
+        spec = {
+            "partner_id": partner_id, "client_id": client_id, "plant_id": plant_id,
+            "device_id": device_uid,
+            "metadata": {
+                "partner_name": "Partner",
+                "client_name": "Client",
+                "plant_name": "Plant",
+                "device_name": device_uid
+            }
+        }
+    bridge_registry.acquire(spec, VIEWER)
+
+def _release_bridge(device_uid):
+    """Resta un oyente; sin oyentes ni grabación la suscripción se retira tras la gracia."""
+    bridge_registry.release(device_uid, VIEWER)
+
+def _acquire_known_bridge(device_uid):
+    """Como `_acquire_bridge`, con partner/cliente/planta desde el registro."""
+    record = device_registry.get_or_load(device_uid)
+    if record is None:
+        logger.warning(f"⚠️ [Monitor] Equipo desconocido: {device_uid}")
+        return
+    _acquire_bridge(device_uid, record.partner_id, record.client_id, record.plant_id)
+
+def ingest_active():
+    """¿Este proceso corre los bridges MQTT? (ingesta habilitada y líder del historian)"""
+    return settings.ingest_enabled and historian_leader.is_leader
+
+def on_remote_interest(device_uid, watching):
+    """
+    Otro worker (sin ingesta) abrió o cerró sockets de un equipo: el líder
+    mantiene el bridge mientras dure el interés anunciado en el bus.
+    """
+    if not ingest_active():
+        return  # Al ser elegido se sincroniza con `live_bus.watched`
+    if watching:
+        _acquire_known_bridge(device_uid)
+    else:
+        _release_bridge(device_uid)
+
+# Apagado del pool en curso tras perder el liderazgo (se espera antes de volver a ingestar)
+_stopping = None
+
+def _reload_ingest_caches():
+    """
+    Mientras ingestaba otro worker cambiaron alertas (aperturas, cierres,
+    acks), reglas y compresión en la base: este proceso las tenía desde su
+    arranque. Corre en el threadpool.
+    """
+    alert_state.load_from_db()
+    alarm_rules.load_all()
+    historian_compressor.load_all()
+
+def start_ingest_role():
+    """Este proceso ganó el liderazgo (se llama en el event loop)."""
+    asyncio.create_task(_start_ingest_role())
+
+async def _start_ingest_role():
+    """
+    Cachés recargadas desde la base, historian 24/7 y bridges para los
+    sockets ya abiertos (locales, uno por socket, y de otros workers).
+    """
+    if _stopping is not None:
+        await _stopping
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, _reload_ingest_caches)
+    except Exception as e:
+        logger.error(f"❌ [Monitor] No se pudieron recargar alertas/reglas/compresión al asumir la ingesta: {e}")
+    if not ingest_active():
+        return  # Se perdió el liderazgo mientras se recargaba
+    # El spool local de históricos es del proceso que ingesta
+    telemetry_writer.enable_spool()
+    asyncio.create_task(historian.start_all_enabled())
+    for device_uid, conns in list(ws_manager.active_connections.items()):
+        for _ in conns:
+            _acquire_known_bridge(device_uid)
+    for device_uid in getattr(live_bus, "watched", ()):
+        _acquire_known_bridge(device_uid)
+
+def stop_ingest_role():
+    """Se perdió el liderazgo: se suelta todo para no ingestar en paralelo con el nuevo líder."""
+    global _stopping
+    bridge_registry.stop_all()
+    _stopping = asyncio.create_task(_stop_ingest_service())
+
+async def _stop_ingest_service():
+    # `ingest_service.stop()` bloquea (join de pacers, clientes y pipeline): fuera del event loop
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, ingest_service.stop)
+    except Exception as e:
+        logger.error(f"❌ [Monitor] Error deteniendo la ingesta: {e}")
+    # Las filas drenadas ya están en el escritor: el spool queda libre para el nuevo líder
+    telemetry_writer.disable_spool()
+    # Los sockets locales siguen recibiendo el vivo del nuevo líder por el bus
+    live_bus.announce_interest()
 
 @router.websocket("/ws/{partner_id}/{client_id}/{plant_id}/{device_uid}")
 async def websocket_endpoint(
@@ -21,65 +247,50 @@ async def websocket_endpoint(
 ):
     await ws_manager.connect(websocket, device_uid)
     
-    # 1. VERIFICAR SI EL HISTORIAN YA TIENE ESTE BRIDGE CORRIENDO
-    if device_uid in historian.active_bridges:
-        print(f"🔗 [Monitor] Usando bridge permanente del Historian para {device_uid}")
-        # No sumamos ref_count para evitar colisiones con la lógica de apagado,
-        # simplemente dejamos que el WS se conecte al manager.
-    
-    elif device_uid not in active_bridges:
-        print(f"🚀 Iniciando Bridge Maestro (Temporal): {device_uid}")
-        
-        # Búsqueda de metadata (Join profundo)
-        device_info = db.query(models.Device).options(
-            joinedload(models.Device.plant).joinedload(models.Plant.client).joinedload(models.Client.partner)
-        ).filter(models.Device.aws_iot_uid == device_uid).first()
-        
-        metadata = {
-            "partner_name": device_info.plant.client.partner.name if device_info else "Partner",
-            "client_name": device_info.plant.client.name if device_info else "Client",
-            "plant_name": device_info.plant.name if device_info else "Plant",
-            "device_name": device_info.name if device_info else device_uid
-        }
-
-        mqtt_client = start_mqtt_bridge(
-            ws_manager=ws_manager,
-            partner_id=partner_id, client_id=client_id, 
-            plant_id=plant_id, device_id=device_uid,
-            metadata=metadata
-        )
-        active_bridges[device_uid] = {"client": mqtt_client, "ref_count": 1, "stop_task": None}
+    if ingest_active():
+        _acquire_bridge(device_uid, partner_id, client_id, plant_id, db)
     else:
-        # SI EL BRIDGE ESTABA POR MORIR (en periodo de gracia), CANCELAMOS EL CIERRE
-        if active_bridges[device_uid]["stop_task"]:
-            active_bridges[device_uid]["stop_task"].cancel()
-            active_bridges[device_uid]["stop_task"] = None
-            print(f"🛡️ Apagado cancelado: Usuario regresó a {device_uid}")
-        
-        active_bridges[device_uid]["ref_count"] += 1
-        print(f"♻️ Bridge reutilizado. Oyentes: {active_bridges[device_uid]['ref_count']}")
+        # Este worker solo sirve sockets: el proceso que ingesta (líder) se entera por el bus
+        live_bus.announce_interest()
 
     try:
         while True:
-            await websocket.receive_text()
+            # Mensajes del cliente:
+            #   {"action": "subscribe", "paths": [...], "keys": [...], "delta": true}
+            #   {"action": "unsubscribe"}  -> vuelve a recibir todo el equipo (sin delta)
+            #   {"action": "resync"}       -> nuevo snapshot tras un hueco en `seq`
+            raw = await websocket.receive_text()
+            try:
+                command = json.loads(raw)
+            except ValueError:
+                logger.debug(f"⚠️ [WS] Mensaje no JSON ignorado en {device_uid}")
+                continue
+            if not isinstance(command, dict):
+                continue
+            action = command.get("action")
+            if action in ("subscribe", "unsubscribe"):
+                paths = command.get("paths") if action == "subscribe" else None
+                keys = command.get("keys") if action == "subscribe" else None
+                if not isinstance(paths, (list, type(None))) or not isinstance(keys, (list, type(None))):
+                    continue
+                delta = bool(command.get("delta")) if action == "subscribe" else False
+                if delta and not ingest_active():
+                    # El snapshot inicial sale de `last_values`: se trae el estado del que ingesta
+                    await live_bus.request_state([device_uid])
+                ws_manager.subscribe(websocket, device_uid, paths, keys, delta=delta)
+                logger.debug(f"🎯 [WS] Suscripción en {device_uid}: paths={paths} keys={keys} delta={delta}")
+            elif action == "resync":
+                if not ingest_active():
+                    await live_bus.request_state([device_uid])
+                ws_manager.resync(websocket, device_uid)
     except WebSocketDisconnect:
+        pass
+    except RuntimeError as e:
+        # Socket cerrado por el servidor (desalojo) entre dos receive_text
+        logger.debug(f"🔌 [WS] Socket cerrado en {device_uid}: {e}")
+    finally:
         ws_manager.disconnect(websocket, device_uid)
-        
-        # 2. SOLO APAGAR SI NO ES UN BRIDGE DEL HISTORIAN
-        if device_uid in active_bridges:
-            active_bridges[device_uid]["ref_count"] -= 1
-            
-            # Si ya no hay nadie, iniciamos el conteo regresivo para apagar
-            if active_bridges[device_uid]["ref_count"] <= 0:
-                print(f"⏳ Iniciando periodo de gracia (5s) para {device_uid}...")
-                
-                async def delayed_stop(uid):
-                    await asyncio.sleep(5) 
-                    if uid in active_bridges:
-                        print(f"🛑 Tiempo agotado. Matando Bridge Temporal de {uid}")
-                        active_bridges[uid]["client"].stop()
-                        del active_bridges[uid]
-
-                active_bridges[device_uid]["stop_task"] = asyncio.create_task(delayed_stop(device_uid))
-            else:
-                print(f"📉 Quedan {active_bridges[device_uid]['ref_count']} oyentes en {device_uid}")
\ No newline at end of file
+        if ingest_active():
+            _release_bridge(device_uid)
+        else:
+            live_bus.announce_interest()
@@ -5,11 +5,16 @@ import uuid # Usaremos UUID para tokens temporales rápidos
 from .. import models, schemas, database
 from ..auth import get_current_user
 from ..utils.mailer import send_invitation_email
+from ..services.device_registry import device_registry
 from fastapi import BackgroundTasks
 from datetime import datetime, timedelta
 import json
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import joinedload
+import logging
+
+logger = logging.getLogger(__name__)
+
 router = APIRouter(
     prefix="/partners",
     tags=["Partners"]
@@ -29,14 +34,10 @@ def read_partners(
     query = db.query(models.Partner).options(joinedload(models.Partner.user))
     partners = query.offset(skip).limit(limit).all()
 
-    # 2. Convertimos a formato JSON-compatible para el print
-    # Esto simula exactamente lo que FastAPI enviará al frontend
-    debug_data = jsonable_encoder(partners)
-    
-    print("\n" + "="*50)
-    print("DEBUG: JSON QUE SE ENVIARÁ AL FRONTEND")
-    print(json.dumps(debug_data, indent=4))
-    print("="*50 + "\n")
+    # 2. Solo con DEBUG activo: JSON que se enviará al frontend
+    # (la serialización extra no se paga en producción)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"JSON QUE SE ENVIARÁ AL FRONTEND: {json.dumps(jsonable_encoder(partners))}")
 
     return partners
 
@@ -100,9 +101,7 @@ def create_partner(
 
     except Exception as e:
             db.rollback()
-            print("---------- ERROR REAL ----------")
-            print(e) # Esto imprimirá el error exacto en tu terminal negra
-            print("--------------------------------")
+            logger.exception(f"ERROR REAL: {e}")
             raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -144,6 +143,8 @@ def update_partner(
     
     db.commit()
     db.refresh(db_partner)
+    # El nombre del partner forma parte del tópico MQTT de sus equipos
+    device_registry.refresh(db, partner_id=db_partner.id)
     return db_partner
 
 @router.get("/me/profile", response_model=schemas.PartnerOut)
@@ -189,6 +190,8 @@ def update_my_partner_profile(
     
     db.commit()
     db.refresh(db_partner)
+    # El nombre del partner forma parte del tópico MQTT de sus equipos
+    device_registry.refresh(db, partner_id=db_partner.id)
     return db_partner
 
 
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Optional, Literal
 from datetime import datetime
 from pydantic import BaseModel, EmailStr, model_validator,ConfigDict
 from typing import Optional, Dict, Any
@@ -245,6 +245,7 @@ class DeviceBase(BaseModel):
     protocol: Optional[str] = None
     modbus_config: Optional[Dict[str, Any]] = None
     history_enabled: Optional[bool] = False
+    payload_format: Optional[Literal["json", "msgpack", "cbor", "auto"]] = "json"  # Ver payload_codec.PAYLOAD_FORMATS
 
 
 class DeviceCreate(DeviceBase):
@@ -355,5 +356,18 @@ class TagRegistration(BaseModel):
     # Parámetros de Alerta
     hysteresis: Optional[float] = 0.0
     alert_delay: Optional[int] = 0
+
+    # Compresión del historian (deadband + swinging door)
+    compression_deviation: Optional[float] = None
+    exception_deviation: Optional[float] = None
     
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+
+# =========================
+# LOGGING (ajuste en caliente)
+# =========================
+class LoggingConfigUpdate(BaseModel):
+    sql_echo: Optional[bool] = None
+    # { "app.services.mqtt_bridge": "DEBUG", "root": "WARNING" }
+    levels: Optional[Dict[str, str]] = None
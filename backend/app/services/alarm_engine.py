@@ -0,0 +1,136 @@
+import time
+from datetime import datetime
+import numpy as np
+from app.config import settings
+from app.services.alarm_rules import alarm_rules
+from app.services.alert_state import alert_state
+
+
+class AlarmEngine:
+    """
+    Evaluación de alarmas por mensaje (Triggering Engine v2).
+
+    Las comparaciones de límites se hacen en modo escalar para ramas
+    chicas y en una sola pasada NumPy (máscaras de fuera de rango, retorno
+    a normalidad y severidad) cuando el payload trae al menos
+    `vector_threshold` tags con regla. Las transiciones de estado (delay,
+    alta y cierre de alertas) son las mismas en ambos caminos.
+    """
+    def __init__(self, vector_threshold=64):
+        self.vector_threshold = vector_threshold
+
+    def evaluate(self, device_id, path, telemetry, now=None):
+        block = alarm_rules.block_for(device_id, path)
+        if not len(block):
+            return
+        now = now if now is not None else time.time()
+        if len(block) >= self.vector_threshold and len(telemetry) >= self.vector_threshold:
+            self.evaluate_vector(device_id, block, telemetry, now)
+        else:
+            self.evaluate_scalar(device_id, block, telemetry, now)
+
+    # --- CAMINO ESCALAR ---
+    def evaluate_scalar(self, device_id, block, telemetry, now):
+        for tag, val in block.match(telemetry):
+            # 1. EVALUAR ESTADO FÍSICO (¿Está fuera de rango?)
+            out_of_max = tag.max_value is not None and val > tag.max_value
+            out_of_min = tag.min_value is not None and val < tag.min_value
+
+            # 2. EVALUAR RETORNO A NORMALIDAD (Aplicando Histeresis)
+            h = tag.hysteresis
+            is_back_to_normal = False
+            if tag.max_value is not None and val <= (tag.max_value - h):
+                is_back_to_normal = True
+            elif tag.min_value is not None and val >= (tag.min_value + h):
+                is_back_to_normal = True
+            elif tag.max_value is None and tag.min_value is None:
+                is_back_to_normal = True
+
+            critical = (out_of_max and val > (tag.max_value * 1.2)) or \
+                (not out_of_max and out_of_min and val < (tag.min_value * 0.8))
+
+            self._apply(device_id, tag, val, out_of_max or out_of_min, out_of_max,
+                        is_back_to_normal, critical, now)
+
+    # --- CAMINO VECTORIZADO ---
+    def evaluate_vector(self, device_id, block, telemetry, now):
+        pos = block.pos
+        idx = []
+        vals = []
+        for key, val in telemetry.items():
+            i = pos.get(key)
+            if i is not None and isinstance(val, (int, float)):
+                idx.append(i)
+                vals.append(val)
+        if not idx:
+            return
+
+        # Valores alineados con las reglas; NaN = tag ausente en este payload
+        v = np.full(len(block), np.nan)
+        v[idx] = vals
+        present = ~np.isnan(v)
+
+        with np.errstate(invalid="ignore"):
+            out_max = block.has_max & (v > block.max_v)
+            out_min = block.has_min & (v < block.min_v)
+            out = out_max | out_min
+            back = present & (
+                (block.has_max & (v <= block.max_v - block.hyst))
+                | (block.has_min & (v >= block.min_v + block.hyst))
+                | (~block.has_max & ~block.has_min)
+            )
+            critical = (out_max & (v > block.max_v * 1.2)) | (~out_max & out_min & (v < block.min_v * 0.8))
+
+        ordered = block.ordered
+
+        # Fuera de rango: inicio/continuación del breach o disparo de alerta
+        for i in np.flatnonzero(out):
+            tag = ordered[i]
+            self._apply(device_id, tag, telemetry[tag.mqtt_key], True, bool(out_max[i]),
+                        bool(back[i]), bool(critical[i]), now)
+
+        # En rango: solo importan los tags que ya tenían estado (breach o alerta)
+        tag_pos = block.tag_pos
+        for tag_id in list(alert_state.stateful_tags(device_id)):
+            i = tag_pos.get(tag_id)
+            if i is None or not present[i] or out[i]:
+                continue
+            tag = ordered[i]
+            self._apply(device_id, tag, telemetry[tag.mqtt_key], False, False,
+                        bool(back[i]), False, now)
+
+    # --- TRANSICIONES ---
+    def _apply(self, device_id, tag, val, is_physically_out, out_of_max, is_back_to_normal, critical, now):
+        # ¿Alerta activa? (estado en memoria, reconstruido de la tabla al arrancar)
+        has_active_alert = alert_state.has_active(tag.tag_id)
+
+        if is_physically_out:
+            # Si no hay alerta activa, verificar delay
+            if not has_active_alert:
+                started = alert_state.start_breach(device_id, tag.tag_id, now)
+                elapsed = now - started
+
+                if elapsed >= tag.alert_delay:
+                    # DISPARAR ALERTA
+                    alert_state.open_alert(
+                        tag.tag_id,
+                        device_id=device_id,
+                        severity="CRITICAL" if critical else "WARNING",
+                        title=f"Límite Excedido: {tag.label}",
+                        message=f"Valor fuera de rango por {int(elapsed)}s. Detectado: {val} {tag.unit or ''}",
+                        value_detected=val,
+                        limit_value=tag.max_value if out_of_max else tag.min_value,
+                        breach_started_at=datetime.fromtimestamp(started)
+                    )
+        else:
+            # Si está en rango normal o en zona de histeresis
+            # Limpiar el tracker de tiempo si el valor ya no es "erróneo"
+            alert_state.end_breach(tag.tag_id)
+
+            # REVISAR SI DEBEMOS CERRAR ALERTA (Solo si superó la histeresis)
+            if is_back_to_normal and has_active_alert:
+                alert_state.clear_alert(tag.tag_id)
+
+
+# Instancia única del evaluador
+alarm_engine = AlarmEngine(vector_threshold=settings.alarm_vector_threshold)
@@ -0,0 +1,144 @@
+import threading
+import numpy as np
+from app.database import SessionLocal
+from app import models
+
+ROOT_PATH = "root"
+
+
+def normalize_path(path):
+    """El tópico sin sub-rama llega como '' pero el portal lo registra como 'root'."""
+    path = (path or "").strip("/")
+    return path or ROOT_PATH
+
+
+class AlarmRule:
+    """Límites compilados de un DeviceTag (solo tags con min y/o max)."""
+    __slots__ = (
+        "tag_id", "device_id", "path", "mqtt_key", "min_value", "max_value",
+        "hysteresis", "alert_delay", "label", "unit"
+    )
+
+    def __init__(self, tag):
+        self.tag_id = tag.id
+        self.device_id = tag.device_id
+        self.path = normalize_path(tag.path)
+        self.mqtt_key = tag.mqtt_key
+        self.min_value = tag.min_value
+        self.max_value = tag.max_value
+        self.hysteresis = tag.hysteresis or 0.0
+        self.alert_delay = tag.alert_delay or 0
+        self.label = tag.display_name or tag.mqtt_key
+        self.unit = tag.unit
+
+
+class RuleBlock:
+    """
+    Reglas de una rama de un equipo: diccionario `mqtt_key -> AlarmRule`
+    más los mismos límites en arreglos NumPy contiguos (por posición) para
+    la evaluación vectorizada de payloads grandes.
+    """
+    __slots__ = (
+        "rules", "ordered", "pos", "tag_pos", "tag_ids",
+        "min_v", "max_v", "hyst", "has_min", "has_max"
+    )
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.ordered = list(rules.values())
+        self.pos = {rule.mqtt_key: i for i, rule in enumerate(self.ordered)}
+        self.tag_pos = {rule.tag_id: i for i, rule in enumerate(self.ordered)}
+        self.tag_ids = np.array([r.tag_id for r in self.ordered], dtype=np.int64)
+        self.min_v = np.array([np.nan if r.min_value is None else r.min_value for r in self.ordered], dtype=np.float64)
+        self.max_v = np.array([np.nan if r.max_value is None else r.max_value for r in self.ordered], dtype=np.float64)
+        self.hyst = np.array([r.hysteresis for r in self.ordered], dtype=np.float64)
+        self.has_min = ~np.isnan(self.min_v)
+        self.has_max = ~np.isnan(self.max_v)
+
+    def __len__(self):
+        return len(self.ordered)
+
+    def match(self, telemetry):
+        """Pares (regla, valor) para las llaves del payload que tienen regla."""
+        rules = self.rules
+        if len(telemetry) <= len(rules):
+            matched = [(rules[k], v) for k, v in telemetry.items() if k in rules]
+        else:
+            matched = [(rule, telemetry[k]) for k, rule in rules.items() if k in telemetry]
+        return [(rule, val) for rule, val in matched if isinstance(val, (int, float))]
+
+
+EMPTY_BLOCK = RuleBlock({})
+
+
+class AlarmRuleCache:
+    """
+    Caché de reglas de alarma indexada por equipo y `(rama, mqtt_key)`.
+
+    { device_id: { "caldera/sensor1": RuleBlock({"temperatura": AlarmRule}) } }
+
+    Así cada mensaje solo evalúa los tags presentes en su payload y las
+    llaves repetidas en ramas distintas no colisionan.
+    """
+    def __init__(self):
+        self.rules = {}
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def _query(self, db):
+        return db.query(models.DeviceTag).filter(
+            (models.DeviceTag.min_value.isnot(None)) | (models.DeviceTag.max_value.isnot(None))
+        )
+
+    @staticmethod
+    def _index(tags):
+        index = {}
+        for tag in tags:
+            rule = AlarmRule(tag)
+            index.setdefault(rule.device_id, {}).setdefault(rule.path, {})[rule.mqtt_key] = rule
+        return {
+            device_id: {path: RuleBlock(rules) for path, rules in paths.items()}
+            for device_id, paths in index.items()
+        }
+
+    def _with_session(self, db, fn):
+        if db is not None:
+            return fn(db)
+        db = SessionLocal()
+        try:
+            return fn(db)
+        finally:
+            db.close()
+
+    # --- CARGA ---
+    def load_all(self, db=None):
+        def _load(session):
+            index = self._index(self._query(session).all())
+            with self._lock:
+                self.rules = index
+                self.loaded = True
+        self._with_session(db, _load)
+
+    def refresh_device(self, device_id, db=None):
+        """Recompila las reglas de un equipo (alta/edición/borrado de tags)."""
+        def _refresh(session):
+            tags = self._query(session).filter(models.DeviceTag.device_id == device_id).all()
+            index = self._index(tags)
+            with self._lock:
+                self.rules[device_id] = index.get(device_id, {})
+        self._with_session(db, _refresh)
+
+    # --- LECTURA ---
+    def block_for(self, device_id, path):
+        """RuleBlock de una rama del equipo (vacío si no tiene reglas)."""
+        if not self.loaded:
+            self.load_all()
+        return self.rules.get(device_id, {}).get(normalize_path(path), EMPTY_BLOCK)
+
+    def match(self, device_id, path, telemetry):
+        """Pares (regla, valor) para las llaves del payload que tienen regla."""
+        return self.block_for(device_id, path).match(telemetry)
+
+
+# Instancia única de la caché de reglas
+alarm_rules = AlarmRuleCache()
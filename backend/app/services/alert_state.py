@@ -0,0 +1,289 @@
+import logging
+import threading
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError, DataError
+from app.database import SessionLocal
+from app import models
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ("ACTIVE", "ACKNOWLEDGED")
+
+# Errores que no se arreglan reintentando (p. ej. FK a un tag ya borrado)
+PERMANENT_ERRORS = (IntegrityError, DataError)
+
+
+class ActiveAlert:
+    """Alerta abierta de un tag. `alert_id` es None hasta que se persiste."""
+    __slots__ = ("alert_id", "fields", "attempts")
+
+    def __init__(self, alert_id=None, fields=None):
+        self.alert_id = alert_id
+        self.fields = fields
+        self.attempts = 0   # Volcados fallidos de sus altas/cierres
+
+
+class AlertStateStore:
+    """
+    Estado de alarmas en memoria con persistencia diferida (write-behind).
+
+    - `breach_start`: {tag_id: epoch} inicio del cruce de umbral aún sin alerta.
+    - `active`: {tag_id: ActiveAlert} alertas ACTIVE/ACKNOWLEDGED.
+    - `by_device`: {device_id: set(tag_id)} tags con estado (breach o alerta),
+      para que el evaluador vectorizado solo revise esos.
+
+    La evaluación solo lee/escribe estos diccionarios; las altas y cierres
+    se encolan y un hilo los persiste en lote cada `flush_interval`.
+    Al arrancar, `active` se reconstruye desde la tabla `alerts`.
+
+    Si el lote falla por un error permanente se persiste de a una
+    transición para aislar la inválida, que se descarta. Ante errores
+    transitorios (base caída) el lote se reintenta hasta `max_retries`
+    veces; la cola nunca pasa de `max_pending` (se descarta lo más viejo).
+    """
+    def __init__(self, flush_interval=0.5, max_retries=600, max_pending=100000):
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.breach_start = {}
+        self.active = {}
+        self.by_device = {}
+        self._tag_device = {}
+        self.loaded = False
+        self._ops = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        # Contadores
+        self.opened = 0
+        self.cleared = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.dropped_ops = 0
+
+    # --- CARGA ---
+    def load_from_db(self, db=None):
+        """Reconstruye las alertas abiertas desde la tabla `alerts`."""
+        session = db or SessionLocal()
+        try:
+            rows = session.query(models.Alert.device_id, models.Alert.tag_id, models.Alert.id).filter(
+                models.Alert.status.in_(OPEN_STATUSES)
+            ).order_by(models.Alert.id).all()
+        finally:
+            if db is None:
+                session.close()
+        self.active = {}
+        self.breach_start = {}
+        self.by_device = {}
+        self._tag_device = {}
+        for device_id, tag_id, alert_id in rows:
+            self.active[tag_id] = ActiveAlert(alert_id)
+            self._track(device_id, tag_id)
+        self.loaded = True
+
+    # --- ÍNDICE POR EQUIPO ---
+    def _track(self, device_id, tag_id):
+        self._tag_device[tag_id] = device_id
+        self.by_device.setdefault(device_id, set()).add(tag_id)
+
+    def _untrack(self, tag_id):
+        if tag_id in self.active or tag_id in self.breach_start:
+            return
+        device_id = self._tag_device.pop(tag_id, None)
+        tags = self.by_device.get(device_id)
+        if tags is not None:
+            tags.discard(tag_id)
+            if not tags:
+                del self.by_device[device_id]
+
+    def stateful_tags(self, device_id):
+        """Tags del equipo con breach en curso o alerta abierta."""
+        if not self.loaded:
+            self.load_from_db()
+        return self.by_device.get(device_id, ())
+
+    # --- TRANSICIONES (workers de ingesta) ---
+    def has_active(self, tag_id):
+        if not self.loaded:
+            self.load_from_db()
+        return tag_id in self.active
+
+    def start_breach(self, device_id, tag_id, now):
+        """Marca el inicio del cruce (si no había) y devuelve su epoch."""
+        started = self.breach_start.get(tag_id)
+        if started is None:
+            started = self.breach_start[tag_id] = now
+            self._track(device_id, tag_id)
+        return started
+
+    def end_breach(self, tag_id):
+        if self.breach_start.pop(tag_id, None) is not None:
+            self._untrack(tag_id)
+
+    def open_alert(self, tag_id, **fields):
+        """Registra una alerta nueva; se inserta en el próximo volcado."""
+        entry = ActiveAlert(fields=dict(fields, tag_id=tag_id))
+        self.active[tag_id] = entry
+        self.breach_start.pop(tag_id, None)
+        self._track(fields["device_id"], tag_id)
+        self._enqueue(("open", tag_id, entry))
+        self.opened += 1
+
+    def clear_alert(self, tag_id):
+        entry = self.active.pop(tag_id, None)
+        if entry is not None:
+            self._untrack(tag_id)
+            self._enqueue(("clear", tag_id, entry))
+            self.cleared += 1
+
+    def _enqueue(self, op):
+        with self._cond:
+            self._ops.append(op)
+            self._trim()
+        if not self._running:
+            self.start()
+
+    # --- CICLO DE VIDA ---
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="alert-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running:
+                    self._cond.wait(self.flush_interval)
+                running = self._running
+            self.flush()
+            if not running:
+                return
+
+    # --- PERSISTENCIA ---
+    def flush(self):
+        """Persiste en una sola transacción las transiciones pendientes."""
+        with self._cond:
+            ops, self._ops = self._ops, []
+        if not ops:
+            return
+        try:
+            self._persist(ops)
+            self.flushes += 1
+        except PERMANENT_ERRORS as db_err:
+            self.flush_errors += 1
+            logger.warning(f"⚠️ [DB ERROR] Lote de alertas rechazado, se persiste de a una: {db_err}")
+            self._persist_each(ops)
+        except Exception as db_err:
+            self.flush_errors += 1
+            logger.error(f"❌ [DB ERROR] No se pudieron guardar las alertas: {db_err}")
+            self._requeue(ops)
+
+    def _persist(self, ops):
+        db = SessionLocal()
+        try:
+            created = {}   # id(entry) -> (entry, models.Alert)
+            clear_ids = []
+            for kind, tag_id, entry in ops:
+                if kind == "open":
+                    alert = models.Alert(**entry.fields)
+                    db.add(alert)
+                    created[id(entry)] = (entry, alert)
+                elif entry.alert_id is not None:
+                    clear_ids.append(entry.alert_id)
+                elif id(entry) in created:
+                    # Abierta y cerrada dentro del mismo lote
+                    created[id(entry)][1].status = "CLEARED"
+
+            if clear_ids:
+                db.execute(
+                    update(models.Alert)
+                    .where(models.Alert.id.in_(clear_ids), models.Alert.status.in_(OPEN_STATUSES))
+                    .values(status="CLEARED")
+                )
+            db.flush()
+            new_ids = [(entry, alert.id) for entry, alert in created.values()]
+            db.commit()
+            for entry, alert_id in new_ids:
+                entry.alert_id = alert_id
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _persist_each(self, ops):
+        """Una transacción por transición: la inválida se descarta, el resto se guarda en orden."""
+        for i, op in enumerate(ops):
+            try:
+                self._persist([op])
+            except PERMANENT_ERRORS as db_err:
+                self._drop([op], db_err)
+            except Exception as db_err:
+                logger.error(f"❌ [DB ERROR] No se pudieron guardar las alertas: {db_err}")
+                self._requeue(ops[i:])
+                return
+        self.flushes += 1
+
+    def _requeue(self, ops):
+        """Reintentar en el próximo ciclo conservando el orden (con tope de reintentos)."""
+        keep, expired = [], []
+        for op in ops:
+            entry = op[2]
+            entry.attempts += 1
+            (expired if entry.attempts > self.max_retries else keep).append(op)
+        if expired:
+            self._drop(expired, f"{self.max_retries} reintentos agotados")
+        with self._cond:
+            self._ops = keep + self._ops
+            self._trim()
+
+    def _drop(self, ops, reason):
+        self.dropped_ops += len(ops)
+        for kind, tag_id, entry in ops:
+            logger.error(f"❌ [Alerts] Se descarta '{kind}' del tag {tag_id} ({reason}): {entry.fields or entry.alert_id}")
+
+    def _trim(self):
+        """Tope de la cola (con `_cond` tomado): se descartan las transiciones más viejas."""
+        overflow = len(self._ops) - self.max_pending
+        if overflow > 0:
+            del self._ops[:overflow]
+            self.dropped_ops += overflow
+            logger.error(f"❌ [Alerts] Cola de persistencia llena: {overflow} transición(es) descartadas")
+
+    # --- MÉTRICAS ---
+    def stats(self):
+        with self._cond:
+            pending = len(self._ops)
+        return {
+            "active": len(self.active),
+            "breaching": len(self.breach_start),
+            "pending_writes": pending,
+            "opened": self.opened,
+            "cleared": self.cleared,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "dropped_ops": self.dropped_ops
+        }
+
+
+# Instancia única del estado de alarmas
+alert_state = AlertStateStore(
+    flush_interval=settings.alert_flush_interval_ms / 1000,
+    max_retries=settings.alert_flush_max_retries,
+    max_pending=settings.alert_max_pending
+)
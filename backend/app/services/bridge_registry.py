@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from app.config import settings
+from app.services.mqtt_bridge import ingest_service
+from app.services.websocket_manager import ws_manager
+
+logger = logging.getLogger(__name__)
+
+VIEWER = "viewer"      # Sockets de dashboards (locales o anunciados por otros workers)
+RECORDER = "recorder"  # Grabación 24/7 del historian
+
+
+class BridgeEntry:
+    """Suscripción de un equipo en el pool de ingesta y quiénes la sostienen."""
+    __slots__ = ("device_uid", "subscription", "viewers", "recorder", "stop_handle", "created_at")
+
+    def __init__(self, device_uid):
+        self.device_uid = device_uid
+        self.subscription = None
+        self.viewers = 0
+        self.recorder = False
+        self.stop_handle = None
+        self.created_at = time.time()
+
+    @property
+    def idle(self):
+        return self.viewers <= 0 and not self.recorder
+
+
+class BridgeRegistry:
+    """
+    Dueño único de las suscripciones por equipo del pool de ingesta.
+
+    Monitor e historian ya no llevan cada uno su diccionario de bridges:
+    piden y sueltan "holds" aquí. Los viewers se cuentan (uno por socket o
+    por interés remoto) y el historian es un flag de grabación. La ruta
+    MQTT se crea con el primer hold y se retira cuando no queda ninguno,
+    tras el periodo de gracia del tipo que soltó el último (los dashboards
+    que se recargan reutilizan la ruta sin UNSUBSCRIBE/SUBSCRIBE).
+
+    Corre solo en el event loop (los cambios desde hilos llegan con
+    `call_soon_threadsafe`), así que no necesita locks.
+    """
+    def __init__(self, viewer_grace=5.0, recorder_grace=0.0):
+        self.grace = {VIEWER: viewer_grace, RECORDER: recorder_grace}
+        # { "device_uid": BridgeEntry }
+        self.entries = {}
+        self.subscribes = 0
+        self.unsubscribes = 0
+        self.reused = 0
+        self.grace_saves = 0
+
+    # --- HOLDS ---
+    def acquire(self, spec, kind):
+        """Suma un hold sobre el equipo de `spec` (lo suscribe si hace falta)."""
+        self.acquire_many([spec], kind)
+
+    def acquire_many(self, specs, kind):
+        """
+        Suma un hold por equipo; los que no tenían ruta se suscriben en un
+        solo lote. Devuelve cuántos holds se sumaron (un equipo que ya
+        grababa no suma otro hold de grabación).
+        """
+        new_specs, added = [], 0
+        for spec in specs:
+            device_uid = str(spec["device_id"])
+            entry = self.entries.get(device_uid)
+            if entry is None:
+                entry = self.entries[device_uid] = BridgeEntry(device_uid)
+                new_specs.append(spec)
+            elif kind != RECORDER or not entry.recorder:
+                self.reused += 1
+            if self._hold(entry, kind):
+                added += 1
+
+        if new_specs:
+            ingest_service.start(ws_manager)
+            for spec, subscription in zip(new_specs, ingest_service.subscribe_devices(new_specs)):
+                self.entries[str(spec["device_id"])].subscription = subscription
+            self.subscribes += len(new_specs)
+        return added
+
+    def _hold(self, entry, kind):
+        if entry.stop_handle is not None:
+            # El equipo estaba en periodo de gracia: se conserva la ruta
+            entry.stop_handle.cancel()
+            entry.stop_handle = None
+            self.grace_saves += 1
+            logger.debug(f"🛡️ [Bridges] Apagado cancelado: {entry.device_uid} vuelve a tener oyentes")
+        if kind == RECORDER:
+            if entry.recorder:
+                return False
+            entry.recorder = True
+        else:
+            entry.viewers += 1
+        return True
+
+    def release(self, device_uid, kind):
+        """Resta un hold; sin holds la ruta se retira tras la gracia de `kind`."""
+        entry = self.entries.get(device_uid)
+        if entry is None:
+            return
+        if kind == RECORDER:
+            if not entry.recorder:
+                return
+            entry.recorder = False
+        else:
+            if entry.viewers <= 0:
+                return
+            entry.viewers -= 1
+        if not entry.idle:
+            logger.debug(f"📉 [Bridges] {device_uid}: {entry.viewers} oyente(s), grabación={entry.recorder}")
+            return
+
+        grace = self.grace.get(kind, 0.0)
+        if grace > 0:
+            if entry.stop_handle is None:
+                logger.debug(f"⏳ [Bridges] Periodo de gracia ({grace:g}s) para {device_uid}")
+                entry.stop_handle = asyncio.get_running_loop().call_later(grace, self._expire, device_uid)
+        else:
+            self._stop(device_uid)
+
+    def _expire(self, device_uid):
+        entry = self.entries.get(device_uid)
+        if entry is None:
+            return
+        entry.stop_handle = None
+        if entry.idle:
+            logger.info(f"🛑 [Bridges] Sin oyentes: se retira la suscripción de {device_uid}")
+            self._stop(device_uid)
+
+    def _stop(self, device_uid):
+        entry = self.entries.pop(device_uid, None)
+        if entry is None:
+            return
+        if entry.stop_handle is not None:
+            entry.stop_handle.cancel()
+        if entry.subscription is not None:
+            entry.subscription.stop()
+            self.unsubscribes += 1
+
+    def resubscribe(self, spec):
+        """El tópico del equipo cambió (renombre): nueva ruta conservando los holds."""
+        device_uid = str(spec["device_id"])
+        entry = self.entries.get(device_uid)
+        if entry is None:
+            return
+        if entry.subscription is not None:
+            entry.subscription.stop()
+            self.unsubscribes += 1
+        ingest_service.start(ws_manager)
+        entry.subscription = ingest_service.subscribe_devices([spec])[0]
+        self.subscribes += 1
+
+    def stop_all(self):
+        """Retira todas las rutas (apagado o pérdida del liderazgo)."""
+        for device_uid in list(self.entries):
+            logger.debug(f"🛑 [Bridges] Deteniendo bridge: {device_uid}")
+            self._stop(device_uid)
+
+    # --- CONSULTAS ---
+    def is_recording(self, device_uid):
+        entry = self.entries.get(device_uid)
+        return entry is not None and entry.recorder
+
+    def recording(self):
+        """UIDs con grabación 24/7 activa."""
+        return [uid for uid, entry in self.entries.items() if entry.recorder]
+
+    def snapshot(self):
+        """Estado por equipo para el endpoint de administración."""
+        now = time.time()
+        bridges = []
+        for uid, entry in self.entries.items():
+            route = ingest_service.routes.get(uid)
+            bridges.append({
+                "device_uid": uid,
+                "viewers": entry.viewers,
+                "recorder": entry.recorder,
+                "pending_stop": entry.stop_handle is not None,
+                "route_state": route.state if route is not None else None,
+                "topic_filter": route.topic_filter if route is not None else None,
+                "age_s": round(now - entry.created_at, 1)
+            })
+        return {**self.stats(), "bridges": bridges}
+
+    def stats(self):
+        entries = self.entries.values()
+        return {
+            "devices": len(self.entries),
+            "viewers": sum(entry.viewers for entry in entries),
+            "recording": sum(1 for entry in entries if entry.recorder),
+            "pending_stop": sum(1 for entry in entries if entry.stop_handle is not None),
+            "subscribes": self.subscribes,
+            "unsubscribes": self.unsubscribes,
+            "reused": self.reused,
+            "grace_saves": self.grace_saves,
+            "grace_s": self.grace
+        }
+
+
+# Instancia única del registro de bridges
+bridge_registry = BridgeRegistry(
+    viewer_grace=settings.bridge_viewer_grace_s,
+    recorder_grace=settings.bridge_recorder_grace_s
+)
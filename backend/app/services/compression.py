@@ -0,0 +1,275 @@
+import math
+import threading
+import numpy as np
+from app.database import SessionLocal
+from app import models
+from app.config import settings
+from app.services.alarm_rules import normalize_path
+
+
+class TagCompressor:
+    """
+    Compresión de una serie numérica: banda muerta de excepción seguida de
+    swinging-door trending (SDT).
+
+    - Excepción: un valor que no se aleja más de `exc_deviation` del último
+      valor que pasó el filtro se descarta (salvo que pase `max_interval`).
+    - SDT: entre el último punto archivado y el punto "retenido" se mantiene
+      una puerta de ancho ±`door`. Mientras la recta archivado→nuevo pase a
+      ±`door` de todos los valores intermedios, el punto retenido no se
+      guarda; cuando la puerta se cierra sobre el nuevo valor se archiva el
+      retenido.
+
+    `deviation` es el error máximo de reconstrucción total: un valor
+    descartado por la banda muerta puede quedar hasta `door + 2·exc_deviation`
+    de la interpolación lineal, así que la puerta usa lo que la excepción
+    deja libre (`door = deviation - 2·exc_deviation`). Por defecto la
+    excepción es `deviation/4` (mitad del error para cada etapa) y nunca
+    pasa de `deviation/2`.
+    `offer()` devuelve los puntos `(ts, valor)` a archivar (0, 1 o 2).
+    """
+    __slots__ = (
+        "cfg", "deviation", "exc_deviation", "door", "max_interval",
+        "archived", "held", "slope_max", "slope_min",
+        "last_exc", "last_seen"
+    )
+
+    def __init__(self, deviation, exc_deviation=None, max_interval=3600):
+        self.configure(deviation, exc_deviation, max_interval)
+        self.archived = None    # (ts, v) último punto guardado
+        self.held = None        # (ts, v) candidato pendiente
+        self.slope_max = math.inf
+        self.slope_min = -math.inf
+        self.last_exc = None    # (ts, v) último punto que pasó la excepción
+        self.last_seen = None   # (ts, v) último valor recibido (pasara o no)
+
+    def configure(self, deviation, exc_deviation=None, max_interval=3600):
+        self.cfg = (deviation, exc_deviation)
+        self.deviation = deviation
+        self.exc_deviation = deviation / 4.0 if exc_deviation is None else min(exc_deviation, deviation / 2.0)
+        self.door = deviation - 2.0 * self.exc_deviation
+        self.max_interval = max_interval
+
+    def offer(self, ts, value):
+        out = []
+        prev_seen, self.last_seen = self.last_seen, (ts, value)
+
+        # 1. BANDA MUERTA DE EXCEPCIÓN
+        if self.last_exc is not None:
+            if ts <= self.last_exc[0]:
+                return out  # Fuera de orden: no reescribimos la tendencia
+            if abs(value - self.last_exc[1]) <= self.exc_deviation and \
+                    ts - self.last_exc[0] < self.max_interval:
+                return out
+            # El valor previo a la excepción también entra a SDT (preserva escalones)
+            if prev_seen is not None and prev_seen[0] > self.last_exc[0]:
+                self._swing(prev_seen, out)
+        self.last_exc = (ts, value)
+        self._swing((ts, value), out)
+        return out
+
+    def _swing(self, point, out):
+        ts, value = point
+        if self.archived is None:
+            self.archived = point
+            out.append(point)
+            return
+
+        if self.held is not None:
+            a_ts, a_v = self.archived
+            dt = ts - a_ts
+            # ¿La recta archivado→nuevo pasa a ±door de todos los puntos intermedios?
+            slope = (value - a_v) / dt
+            if self.slope_min <= slope <= self.slope_max and dt < self.max_interval:
+                self.slope_max = min(self.slope_max, (value + self.door - a_v) / dt)
+                self.slope_min = max(self.slope_min, (value - self.door - a_v) / dt)
+                self.held = point
+                return
+            # La puerta se abrió: se archiva el retenido y se reinicia desde él
+            self.archived = self.held
+            out.append(self.held)
+
+        a_ts, a_v = self.archived
+        dt = ts - a_ts
+        if dt <= 0:
+            return
+        self.slope_max = (value + self.door - a_v) / dt
+        self.slope_min = (value - self.door - a_v) / dt
+        self.held = point
+
+    def pending(self):
+        """Puntos aún no archivados (retenido y último valor recibido), en orden."""
+        points = [self.held] if self.held is not None else []
+        last = self.last_seen
+        if last is not None and (not points or last[0] > points[-1][0]) and \
+                (self.archived is None or last[0] > self.archived[0]):
+            points.append(last)
+        return points
+
+    def drain(self):
+        """Archiva lo pendiente (apagado) para no perder el último tramo de la serie."""
+        points = self.pending()
+        if points:
+            self.archived = points[-1]
+            self.last_exc = points[-1]
+            self.held = None
+            self.slope_max, self.slope_min = math.inf, -math.inf
+        return points
+
+
+class HistorianCompressor:
+    """
+    Etapa de compresión del historian en el camino de ingesta.
+
+    Configuración por tag (`DeviceTag.compression_deviation` y opcional
+    `exception_deviation`) indexada como las reglas de alarma:
+    `{ device_id: { path: { mqtt_key: (deviation, exc_deviation) } } }`.
+    Los tags sin configuración se guardan tal cual; los comprimidos solo
+    aparecen en las filas donde archivan un punto, y `/historical`
+    reconstruye la tendencia por interpolación.
+    """
+    def __init__(self, max_interval=3600):
+        self.max_interval = max_interval
+        self.config = {}
+        self.state = {}   # { (device_uid, path): { mqtt_key: TagCompressor } }
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def _query(self, db):
+        return db.query(
+            models.DeviceTag.device_id,
+            models.DeviceTag.path,
+            models.DeviceTag.mqtt_key,
+            models.DeviceTag.compression_deviation,
+            models.DeviceTag.exception_deviation
+        ).filter(
+            models.DeviceTag.compression_deviation.isnot(None),
+            models.DeviceTag.compression_deviation > 0,
+            models.DeviceTag.is_active.isnot(False)
+        )
+
+    @staticmethod
+    def _index(rows):
+        index = {}
+        for row in rows:
+            paths = index.setdefault(row.device_id, {})
+            paths.setdefault(normalize_path(row.path), {})[row.mqtt_key] = (
+                row.compression_deviation, row.exception_deviation
+            )
+        return index
+
+    def _with_session(self, db, fn):
+        if db is not None:
+            return fn(db)
+        db = SessionLocal()
+        try:
+            return fn(db)
+        finally:
+            db.close()
+
+    # --- CARGA ---
+    def load_all(self, db=None):
+        def _load(session):
+            index = self._index(self._query(session).all())
+            with self._lock:
+                self.config = index
+                self.loaded = True
+        self._with_session(db, _load)
+
+    def refresh_device(self, device_id, db=None):
+        """Recarga la configuración de un equipo (alta/edición/borrado de tags)."""
+        def _refresh(session):
+            rows = self._query(session).filter(models.DeviceTag.device_id == device_id).all()
+            index = self._index(rows)
+            with self._lock:
+                self.config[device_id] = index.get(device_id, {})
+        self._with_session(db, _refresh)
+
+    def configured_keys(self, device_id):
+        """Pares `(path, mqtt_key)` comprimidos de un equipo (path normalizado)."""
+        if not self.loaded:
+            self.load_all()
+        return {(path, key) for path, keys in self.config.get(device_id, {}).items() for key in keys}
+
+    # --- CAMINO CALIENTE ---
+    def compress(self, device_id, device_uid, path, ts, telemetry):
+        """
+        Devuelve las filas `[(ts, data), ...]` a persistir para una muestra.
+        Un punto retenido que se archiva tarde sale con su propio ts (pasado).
+        """
+        if not self.loaded:
+            self.load_all()
+        keys = self.config.get(device_id, {}).get(normalize_path(path))
+        if not keys or type(telemetry) is not dict:
+            return [(ts, telemetry)]
+
+        states = self.state.setdefault((device_uid, path), {})
+        current = {}
+        late = {}
+        for key, value in telemetry.items():
+            cfg = keys.get(key)
+            if cfg is None or type(value) not in (int, float):
+                current[key] = value
+                continue
+            comp = states.get(key)
+            if comp is None:
+                comp = states[key] = TagCompressor(cfg[0], cfg[1], self.max_interval)
+            elif comp.cfg != cfg:
+                comp.configure(cfg[0], cfg[1], self.max_interval)
+            for point_ts, point_v in comp.offer(ts, value):
+                if point_ts == ts:
+                    current[key] = point_v
+                else:
+                    late.setdefault(point_ts, {})[key] = point_v
+
+        rows = sorted(late.items())
+        if current:
+            rows.append((ts, current))
+        return rows
+
+    def pending_points(self, device_uid):
+        """Cola de la tendencia aún en memoria: `{(path, mqtt_key): [(ts, v), ...]}`."""
+        points = {}
+        for (uid, path), states in list(self.state.items()):
+            if uid != device_uid:
+                continue
+            path = normalize_path(path)
+            for key, comp in list(states.items()):
+                points.setdefault((path, key), []).extend(comp.pending())
+        return points
+
+    def drain(self):
+        """Puntos pendientes de todas las series: `[(device_uid, path, ts, data), ...]`."""
+        rows = {}
+        for (device_uid, path), states in self.state.items():
+            for key, comp in states.items():
+                for point_ts, point_v in comp.drain():
+                    rows.setdefault((device_uid, path, point_ts), {})[key] = point_v
+        return [(uid, path, ts, data) for (uid, path, ts), data in rows.items()]
+
+
+# Instancia única de la etapa de compresión
+historian_compressor = HistorianCompressor(max_interval=settings.historian_compression_max_interval)
+
+
+# --- RECONSTRUCCIÓN (lectura de históricos) ---
+def interpolate(times, values, at, tolerance=0.0):
+    """Interpolación lineal de la serie archivada en `at` (None fuera de rango)."""
+    if not times or at < times[0] - tolerance or at > times[-1] + tolerance:
+        return None
+    return float(np.interp(at, times, values))
+
+
+def bucket_average(times, values, start, end):
+    """Promedio ponderado en el tiempo de la reconstrucción lineal en [start, end)."""
+    if not times:
+        return None
+    lo, hi = max(start, times[0]), min(end, times[-1])
+    if hi <= lo:
+        # Bucket en el borde de la serie: un solo punto (o ninguno) cae dentro
+        return interpolate(times, values, lo) if start <= lo < end else None
+    t = np.asarray(times)
+    inner = t[(t > lo) & (t < hi)]
+    xs = np.concatenate(([lo], inner, [hi]))
+    ys = np.interp(xs, t, values)
+    return float(np.trapezoid(ys, xs) / (hi - lo))
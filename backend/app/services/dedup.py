@@ -0,0 +1,146 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def payload_fingerprint(topic, payload_bytes):
+    """Huella corta (8 bytes) de tópico + payload crudo."""
+    h = hashlib.blake2b(topic.encode(), digest_size=8)
+    h.update(payload_bytes)
+    return h.digest()
+
+
+def has_device_timestamp(payload):
+    """¿El payload trae su propio ts (muestra única, columnar o lista de muestras)?"""
+    if type(payload) is dict:
+        return payload.get("ts") is not None or type(payload.get("samples")) is list
+    if type(payload) is list:
+        return bool(payload) and all(type(s) is dict and "ts" in s for s in payload)
+    return False
+
+
+class DedupWindow:
+    """Huellas recientes de un equipo y el último seq (y ts del equipo) por rama."""
+    __slots__ = ("fingerprints", "last_seq")
+
+    def __init__(self):
+        self.fingerprints = OrderedDict()   # { huella: vence_en }
+        self.last_seq = {}                  # { rama: (seq, ts_del_equipo) }
+
+
+class DedupFilter:
+    """
+    Descarta re-entregas QoS 1 (reconexiones a AWS IoT) antes de persistir.
+
+    Por equipo se guarda una ventana LRU de huellas recientes: el número de
+    secuencia del equipo si lo manda, o un hash de tópico + payload cuando
+    el payload trae su propio ts (el ts del equipo distingue una lectura
+    nueva de una re-entrega, así que el hash dura la misma ventana que el
+    seq y cubre re-entregas tras reconexiones largas). Sin seq ni ts no se
+    deduplica: una lectura estable repetida no es un duplicado.
+
+    Un equipo que se reinicia vuelve a contar su seq desde cero: si el seq
+    de una rama baja más que `window_size` o baja mientras el ts del equipo
+    avanza, se olvidan los seq recordados de esa rama en vez de descartar
+    las lecturas nuevas como duplicados.
+
+    La memoria es acotada en las dos dimensiones: como máximo
+    `window_size` huellas por equipo (cada una con su vencimiento) y como
+    máximo `max_devices` ventanas (se desaloja el equipo menos reciente).
+    """
+    def __init__(self, window_size=64, window_seconds=600, max_devices=10000):
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.max_devices = max_devices
+        self.windows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.seq_resets = 0
+        self.evicted_devices = 0
+        self._lock = threading.Lock()
+
+    def fingerprint(self, subtopic, topic, payload, payload_bytes, seq_field="seq"):
+        """
+        `(huella, orden)` del mensaje, o None si no se puede deduplicar.
+        `orden` es `(rama, seq, ts_del_equipo)` para seq numéricos (detección
+        de reinicios), si no None.
+        """
+        seq = payload.get(seq_field) if type(payload) is dict else None
+        if isinstance(seq, (int, str)) and not isinstance(seq, bool):
+            device_ts = payload.get("ts")
+            if not isinstance(device_ts, (int, float, str)) or isinstance(device_ts, bool):
+                device_ts = None
+            return (subtopic, seq), ((subtopic, seq, device_ts) if type(seq) is int else None)
+        if has_device_timestamp(payload):
+            # Mismo payload con el mismo ts del equipo: re-entrega
+            return payload_fingerprint(topic, payload_bytes), None
+        return None
+
+    def _restarted(self, window, order):
+        """¿El seq de la rama volvió a empezar? (reinicio del equipo, no una re-entrega)"""
+        subtopic, seq, device_ts = order
+        previous = window.last_seq.get(subtopic)
+        if previous is None or seq >= previous[0]:
+            return False
+        if previous[0] - seq > self.window_size:
+            return True
+        previous_ts = previous[1]
+        return (
+            device_ts is not None and previous_ts is not None
+            and type(device_ts) is type(previous_ts) and device_ts > previous_ts
+        )
+
+    def seen(self, device_id, fingerprint, now=None):
+        """True si la huella (de `fingerprint()`) ya se vio en la ventana (duplicado); la registra si no."""
+        now = now if now is not None else time.time()
+        key, order = fingerprint
+        with self._lock:
+            window = self.windows.get(device_id)
+            if window is None:
+                window = self.windows[device_id] = DedupWindow()
+                if len(self.windows) > self.max_devices:
+                    self.windows.popitem(last=False)
+                    self.evicted_devices += 1
+            else:
+                self.windows.move_to_end(device_id)
+            fingerprints = window.fingerprints
+
+            if order is not None and self._restarted(window, order):
+                subtopic = order[0]
+                self.seq_resets += 1
+                window.last_seq.pop(subtopic, None)
+                fingerprints = window.fingerprints = OrderedDict(
+                    (k, v) for k, v in fingerprints.items() if type(k) is not tuple or k[0] != subtopic
+                )
+
+            expires_at = fingerprints.get(key)
+            if expires_at is not None and now <= expires_at:
+                self.hits += 1
+                return True
+
+            if order is not None:
+                previous = window.last_seq.get(order[0])
+                if previous is None or order[1] >= previous[0]:
+                    window.last_seq[order[0]] = (order[1], order[2])
+            fingerprints[key] = now + self.window_seconds
+            fingerprints.move_to_end(key)
+            # Recorte por tamaño y por vencimiento (las más viejas van primero)
+            while len(fingerprints) > self.window_size:
+                fingerprints.popitem(last=False)
+            while fingerprints:
+                oldest = next(iter(fingerprints.values()))
+                if now <= oldest:
+                    break
+                fingerprints.popitem(last=False)
+            self.misses += 1
+            return False
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "seq_resets": self.seq_resets,
+            "devices": len(self.windows),
+            "evicted_devices": self.evicted_devices
+        }
@@ -0,0 +1,170 @@
+import logging
+import threading
+from app.database import SessionLocal
+from app import models
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRecord:
+    """Metadata compacta de un equipo para el camino caliente de ingesta."""
+    __slots__ = (
+        "id", "aws_iot_uid", "name", "is_active", "history_enabled",
+        "plant_id", "plant_name", "client_id", "client_name",
+        "partner_id", "partner_name", "timezone", "payload_format"
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def topic_metadata(self):
+        """Nombres usados para armar el tópico MQTT del equipo."""
+        return {
+            "partner_name": self.partner_name,
+            "client_name": self.client_name,
+            "plant_name": self.plant_name,
+            "device_name": self.name
+        }
+
+    def bridge_spec(self):
+        """Parámetros de suscripción para el servicio de ingesta."""
+        return {
+            "partner_id": self.partner_id,
+            "client_id": self.client_id,
+            "plant_id": self.plant_id,
+            "device_id": self.aws_iot_uid,
+            "metadata": self.topic_metadata()
+        }
+
+
+class DeviceRegistry:
+    """
+    Caché de proceso `aws_iot_uid -> DeviceRecord`.
+
+    Se carga en bloque al arrancar con un solo SELECT (Device ⨝ Plant ⨝
+    Client ⨝ Partner) y se actualiza puntualmente desde los endpoints que
+    modifican equipos, así la ingesta no consulta metadata por mensaje.
+
+    Los oyentes (`add_listener`) reciben `(records, full)` después de cada
+    carga: `full=True` en la recarga completa (lo que no viene ya no existe).
+    """
+    def __init__(self):
+        self.by_uid = {}
+        self.by_id = {}
+        self.loaded = False
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, fn):
+        if fn not in self.listeners:
+            self.listeners.append(fn)
+
+    def _notify(self, records, full):
+        for fn in self.listeners:
+            try:
+                fn(records, full)
+            except Exception as e:
+                logger.error(f"❌ [Registry] Error notificando cambios de equipos: {e}")
+
+    def _query(self, db):
+        return db.query(
+            models.Device.id,
+            models.Device.aws_iot_uid,
+            models.Device.name,
+            models.Device.is_active,
+            models.Device.history_enabled,
+            models.Device.plant_id,
+            models.Plant.name.label("plant_name"),
+            models.Plant.client_id,
+            models.Client.name.label("client_name"),
+            models.Client.partner_id,
+            models.Partner.name.label("partner_name"),
+            models.Client.timezone,
+            models.Device.payload_format
+        ).join(models.Plant, models.Device.plant_id == models.Plant.id)\
+         .join(models.Client, models.Plant.client_id == models.Client.id)\
+         .join(models.Partner, models.Client.partner_id == models.Partner.id)
+
+    def _store(self, rows):
+        records = [DeviceRecord(**row._asdict()) for row in rows]
+        with self._lock:
+            for record in records:
+                old = self.by_id.get(record.id)
+                if old is not None and old.aws_iot_uid != record.aws_iot_uid:
+                    self.by_uid.pop(old.aws_iot_uid, None)
+                self.by_id[record.id] = record
+                if record.aws_iot_uid:
+                    self.by_uid[record.aws_iot_uid] = record
+        return records
+
+    def _with_session(self, db, fn):
+        if db is not None:
+            return fn(db)
+        db = SessionLocal()
+        try:
+            return fn(db)
+        finally:
+            db.close()
+
+    # --- CARGA ---
+    def load_all(self, db=None):
+        """Recarga completa del registro (arranque)."""
+        def _load(session):
+            records = [DeviceRecord(**row._asdict()) for row in self._query(session).all()]
+            # Se arma aparte y se intercambia: la ingesta nunca ve el registro vacío
+            by_id = {record.id: record for record in records}
+            by_uid = {record.aws_iot_uid: record for record in records if record.aws_iot_uid}
+            with self._lock:
+                self.by_id, self.by_uid = by_id, by_uid
+            self.loaded = True
+            self._notify(records, True)
+            return records
+        return self._with_session(db, _load)
+
+    def refresh(self, db=None, device_id=None, device_uid=None, plant_id=None, client_id=None, partner_id=None):
+        """Recarga solo los equipos afectados por un cambio."""
+        def _refresh(session):
+            query = self._query(session)
+            if device_id is not None:
+                query = query.filter(models.Device.id == device_id)
+            if device_uid is not None:
+                query = query.filter(models.Device.aws_iot_uid == device_uid)
+            if plant_id is not None:
+                query = query.filter(models.Device.plant_id == plant_id)
+            if client_id is not None:
+                query = query.filter(models.Plant.client_id == client_id)
+            if partner_id is not None:
+                query = query.filter(models.Client.partner_id == partner_id)
+            records = self._store(query.all())
+            self._notify(records, False)
+            return records
+        return self._with_session(db, _refresh)
+
+    def remove(self, device_uid):
+        with self._lock:
+            record = self.by_uid.pop(device_uid, None)
+            if record is not None:
+                self.by_id.pop(record.id, None)
+
+    # --- LECTURA ---
+    def get(self, device_uid):
+        return self.by_uid.get(device_uid)
+
+    def get_by_id(self, device_id):
+        return self.by_id.get(device_id)
+
+    def get_or_load(self, device_uid, db=None):
+        """Lectura con carga perezosa para equipos aún no registrados."""
+        record = self.by_uid.get(device_uid)
+        if record is None:
+            records = self.refresh(db, device_uid=device_uid)
+            record = records[0] if records else None
+        return record
+
+    def all(self):
+        return list(self.by_id.values())
+
+
+# Instancia única del registro
+device_registry = DeviceRegistry()
@@ -1,75 +1,113 @@
-import asyncio
+import logging
 from sqlalchemy.orm import Session
-from app.database import SessionLocal
-from app import models
-from app.services.mqtt_bridge import start_mqtt_bridge
-from app.services.websocket_manager import ws_manager
+from app.services.mqtt_bridge import ingest_service, topic_filter_for
+from app.services.bridge_registry import bridge_registry, RECORDER
+from app.services.device_registry import device_registry
+
+logger = logging.getLogger(__name__)
 
 class BackgroundHistorian:
     """
-    Servicio encargado de mantener conexiones MQTT permanentes para dispositivos
-    que requieren grabación de históricos 24/7.
+    Servicio encargado de mantener suscripciones MQTT permanentes para dispositivos
+    que requieren grabación de históricos 24/7 (sobre el pool de ingesta compartido).
+    Las suscripciones son holds de grabación en `bridge_registry`, compartidas
+    con los dashboards que miran el mismo equipo.
     """
-    def __init__(self):
-        # { "device_uid": {"client": mqtt_obj, "persistence": True} }
-        self.active_bridges = {}
+    @property
+    def recording(self):
+        """UIDs con grabación 24/7 activa."""
+        return bridge_registry.recording()
 
     async def start_all_enabled(self):
         """Busca dispositivos con historial habilitado e inicia sus bridges."""
-        print("🔍 [Historian] Buscando dispositivos para historización 24/7...")
-        db = SessionLocal()
-        try:
-            # Traer dispositivos activos con historial habilitado
-            devices = db.query(models.Device).filter(
-                models.Device.history_enabled == True,
-                models.Device.is_active == True
-            ).all()
+        logger.info("🔍 [Historian] Buscando dispositivos para historización 24/7...")
+        # Carga en bloque de la metadata (un solo SELECT con joins)
+        if not device_registry.loaded:
+            device_registry.load_all()
+
+        # Dispositivos activos con historial habilitado
+        records = [record for record in device_registry.all()
+                   if record.history_enabled and record.is_active
+                   and not bridge_registry.is_recording(record.aws_iot_uid)]
+        if not records:
+            return
+        self._start_records(records)
+        logger.info(
+            f"📡 [Historian] {len(records)} equipo(s) en cola de suscripción "
+            f"(progreso en /monitor/ingest/readiness)"
+        )
 
-            for device in devices:
-                await self.start_device_bridge(device, db)
-        finally:
-            db.close()
+    def _start_records(self, records):
+        # Un solo pool de conexiones; las suscripciones nuevas viajan en lotes
+        bridge_registry.acquire_many([record.bridge_spec() for record in records], RECORDER)
 
-    async def start_device_bridge(self, device, db: Session):
+    def stop_device_bridge(self, device_uid):
+        """Detiene la grabación 24/7 de un solo equipo (los dashboards abiertos siguen en vivo)."""
+        if bridge_registry.is_recording(device_uid):
+            logger.info(f"🛑 [Historian] Deteniendo grabación permanente de: {device_uid}")
+            bridge_registry.release(device_uid, RECORDER)
+
+    def reconcile(self, records, full=False):
+        """
+        Alinea los bridges 24/7 con la configuración de `records` sin tocar
+        al resto de la flota: arranca los que pasaron a history_enabled +
+        is_active, detiene los que dejaron de estarlo y re-suscribe los que
+        cambiaron de tópico (renombre de partner/cliente/planta). Con
+        `full=True` `records` es el universo completo y también se detienen
+        los equipos que ya no existen. Corre en el event loop.
+        """
+        to_start, stopped, moved = [], 0, 0
+        for record in records:
+            uid = record.aws_iot_uid
+            if not uid:
+                continue
+            wanted = bool(record.history_enabled and record.is_active)
+            if bridge_registry.is_recording(uid):
+                if not wanted:
+                    self.stop_device_bridge(uid)
+                    stopped += 1
+                    continue
+                spec = record.bridge_spec()
+                route = ingest_service.routes.get(uid)
+                if route is not None and route.topic_filter != topic_filter_for(spec)[0]:
+                    # Los dashboards del equipo conservan su hold y pasan a la ruta nueva
+                    bridge_registry.resubscribe(spec)
+                    moved += 1
+            elif wanted:
+                to_start.append(record)
+        if full:
+            known = {record.aws_iot_uid for record in records}
+            for uid in [uid for uid in self.recording if uid not in known]:
+                self.stop_device_bridge(uid)
+                stopped += 1
+        if to_start:
+            self._start_records(to_start)
+        if to_start or stopped or moved:
+            logger.info(
+                f"🔄 [Historian] Reconciliación: +{len(to_start)} / -{stopped} equipo(s)"
+                + (f", {moved} re-suscrito(s) por cambio de tópico" if moved else "")
+            )
+        return {"started": len(to_start), "stopped": stopped, "moved": moved}
+
+    async def start_device_bridge(self, device, db: Session = None):
         """Inicia un bridge individual en modo persistente."""
-        if device.aws_iot_uid in self.active_bridges:
+        if bridge_registry.is_recording(device.aws_iot_uid):
             return
 
-        print(f"📡 [Historian] Iniciando grabación permanente para: {device.aws_iot_uid}")
-        
-        # Obtener metadata para el tópico MQTT
-        # (Snippet similar al de monitor.py para consistencia)
-        metadata = {
-            "partner_name": device.plant.client.partner.name,
-            "client_name": device.plant.client.name,
-            "plant_name": device.plant.name,
-            "device_name": device.name
-        }
-
-        mqtt_client = start_mqtt_bridge(
-            ws_manager=ws_manager,
-            partner_id=device.plant.client.partner_id,
-            client_id=device.plant.client_id,
-            plant_id=device.plant_id,
-            device_id=device.aws_iot_uid,
-            metadata=metadata
-        )
+        logger.info(f"📡 [Historian] Iniciando grabación permanente para: {device.aws_iot_uid}")
 
-        self.active_bridges[device.aws_iot_uid] = {
-            "client": mqtt_client,
-            "persistence": True
-        }
+        record = device_registry.get_or_load(device.aws_iot_uid, db)
+        bridge_registry.acquire(record.bridge_spec(), RECORDER)
 
     def is_persistent(self, device_uid):
         """Verifica si un bridge es permanente."""
-        return self.active_bridges.get(device_uid, {}).get("persistence", False)
+        return bridge_registry.is_recording(device_uid)
 
     def stop_all(self):
-        """Detiene todos los bridges al apagar el servidor."""
-        for uid, data in self.active_bridges.items():
-            print(f"🛑 [Historian] Deteniendo bridge: {uid}")
-            data["client"].stop()
-        self.active_bridges.clear()
+        """Suelta la grabación de todos los equipos (las rutas con dashboards siguen vivas)."""
+        for uid in self.recording:
+            logger.debug(f"🛑 [Historian] Deteniendo bridge: {uid}")
+            bridge_registry.release(uid, RECORDER)
 
 # Instancia única del servicio
 historian = BackgroundHistorian()
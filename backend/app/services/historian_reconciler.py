@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from app.config import settings
+from app.services.device_registry import device_registry
+from app.services.alarm_rules import alarm_rules
+from app.services.compression import historian_compressor
+from app.services.historian import historian
+from app.services.bridge_registry import bridge_registry
+from app.services.leader import historian_leader
+
+logger = logging.getLogger(__name__)
+
+
+class HistorianReconciler:
+    """
+    Mantiene los bridges 24/7 alineados con `history_enabled` / `is_active`
+    sin reiniciar la flota.
+
+    - Evento en proceso: cada `device_registry.refresh(...)` (alta, edición,
+      aprovisionamiento, renombre de partner) reconcilia solo esos equipos.
+    - Diff periódico: cada `interval` segundos se recarga el registro desde
+      la base (un SELECT) y se reconcilia todo; cubre cambios hechos por
+      otros workers/réplicas y equipos borrados. En la misma pasada se
+      recargan las reglas de alarma y la compresión (los endpoints de tags
+      de otro worker solo refrescan su propia caché).
+
+    Solo actúa en el proceso que ingesta (líder). Los cambios se aplican en
+    el event loop porque los endpoints síncronos corren en el threadpool.
+    """
+    def __init__(self, interval=60.0):
+        self.interval = interval
+        self.loop = None
+        self.runs = 0
+        self.started = 0
+        self.stopped = 0
+        self.moved = 0
+        self.last_full = None
+        self._task = None
+
+    def start(self, loop):
+        if self._task is not None:
+            return
+        self.loop = loop
+        device_registry.add_listener(self._on_registry_change)
+        if self.interval > 0:
+            self._task = loop.create_task(self._run())
+
+    def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+
+    @staticmethod
+    def _active():
+        return settings.ingest_enabled and historian_leader.is_leader
+
+    def _on_registry_change(self, records, full):
+        if self.loop is None or not self._active():
+            return
+        self.loop.call_soon_threadsafe(self._apply, records, full)
+
+    def _apply(self, records, full):
+        if not self._active():
+            return
+        try:
+            result = historian.reconcile(records, full=full)
+        except Exception as e:
+            logger.error(f"❌ [Reconciler] Error reconciliando bridges del historian: {e}")
+            return
+        self.runs += 1
+        self.started += result["started"]
+        self.stopped += result["stopped"]
+        self.moved += result["moved"]
+        if full:
+            self.last_full = time.time()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._active():
+                continue
+            try:
+                # La recarga completa notifica a `_on_registry_change` con full=True
+                await loop.run_in_executor(None, device_registry.load_all)
+            except Exception as e:
+                logger.warning(f"⚠️ [Reconciler] No se pudo recargar el registro de equipos: {e}")
+            try:
+                await loop.run_in_executor(None, alarm_rules.load_all)
+                await loop.run_in_executor(None, historian_compressor.load_all)
+            except Exception as e:
+                logger.warning(f"⚠️ [Reconciler] No se pudieron recargar reglas/compresión: {e}")
+
+    def stats(self):
+        return {
+            "bridges": bridge_registry.stats()["recording"],
+            "reconcile_runs": self.runs,
+            "started": self.started,
+            "stopped": self.stopped,
+            "moved": self.moved,
+            "last_full": self.last_full
+        }
+
+
+# Instancia única del reconciliador
+historian_reconciler = HistorianReconciler(interval=settings.historian_reconcile_interval_s)
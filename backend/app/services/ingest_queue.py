@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Políticas de desbordamiento soportadas
+OVERFLOW_BLOCK = "block"              # Backpressure: el callback MQTT espera lugar en la cola
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # Se descarta el mensaje más viejo de la cola
+OVERFLOW_SPILL = "spill"              # Se desborda a disco y se reprocesa en orden
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+_STOP = object()
+_LEN = struct.Struct(">II")
+
+
+class SpillFile:
+    """
+    Archivo de desborde append-only para un shard. Cada registro es
+    [len(meta)][len(payload)][meta json][payload]. Solo lo usa la política
+    'spill'; no es un log durable (no hace fsync).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pending = 0
+        self._read_pos = 0
+        self._lock = threading.Lock()
+
+    def append(self, item):
+        device_id, subtopic, topic, payload, recv_ts = item
+        meta = json.dumps([device_id, subtopic, topic, recv_ts]).encode("utf-8")
+        payload = bytes(payload)
+        with self._lock:
+            with open(self.path, "ab") as fh:
+                fh.write(_LEN.pack(len(meta), len(payload)))
+                fh.write(meta)
+                fh.write(payload)
+            self.pending += 1
+
+    def pop(self):
+        """Lee el siguiente registro pendiente (o None si ya no hay)."""
+        with self._lock:
+            if self.pending == 0:
+                return None
+            with open(self.path, "rb") as fh:
+                fh.seek(self._read_pos)
+                meta_len, payload_len = _LEN.unpack(fh.read(_LEN.size))
+                device_id, subtopic, topic, recv_ts = json.loads(fh.read(meta_len))
+                payload = fh.read(payload_len)
+                self._read_pos = fh.tell()
+            self.pending -= 1
+            if self.pending == 0:
+                # Todo reprocesado: truncamos para no crecer indefinidamente
+                os.remove(self.path)
+                self._read_pos = 0
+            return (device_id, subtopic, topic, payload, recv_ts)
+
+
+class IngestPipeline:
+    """
+    Cola acotada entre el callback MQTT y el procesamiento pesado.
+
+    El callback solo encola; un pool de workers hace el parseo, la
+    persistencia y las alertas. La cola se divide en un shard por worker y
+    cada equipo siempre cae en el mismo shard, así los mensajes de un
+    mismo equipo se procesan en orden (importante para alertas).
+    """
+    def __init__(self, handler, workers=4, maxsize=10000,
+                 policy=OVERFLOW_BLOCK, spill_dir="./spool/ingest"):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de desborde inválida: {policy}")
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.policy = policy
+        self.spill_dir = spill_dir
+        shard_size = max(1, maxsize // self.workers)
+        self.shards = [queue.Queue(maxsize=shard_size) for _ in range(self.workers)]
+        self.spills = [None] * self.workers
+        self.threads = []
+
+        # Contadores
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.errors = 0
+        self._counter_lock = threading.Lock()
+
+    # --- CICLO DE VIDA ---
+    def start(self):
+        if self.threads:
+            return
+        if self.policy == OVERFLOW_SPILL:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.spills = [
+                SpillFile(os.path.join(self.spill_dir, f"shard-{i}-{os.getpid()}.spill"))
+                for i in range(self.workers)
+            ]
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, args=(i,), name=f"ingest-worker-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self, timeout=10.0):
+        """Detiene los workers después de vaciar lo que ya estaba encolado."""
+        if not self.threads:
+            return
+        for shard in self.shards:
+            shard.put(_STOP)
+        for t in self.threads:
+            t.join(timeout)
+        self.threads = []
+
+    # --- ENTRADA (hilo del callback MQTT) ---
+    def submit(self, item):
+        """
+        Encola `(device_id, subtopic, topic, payload, recv_ts)`.
+        Debe ser barato: es lo único que corre en el hilo de awscrt.
+        """
+        index = zlib.crc32(item[0].encode("utf-8")) % self.workers
+        shard = self.shards[index]
+        spill = self.spills[index]
+
+        # Si el shard ya está desbordado, lo nuevo va detrás en disco para conservar el orden
+        if spill is not None and spill.pending:
+            self._spill(spill, item)
+            return
+
+        try:
+            shard.put_nowait(item)
+            self._count("enqueued")
+            return
+        except queue.Full:
+            pass
+
+        if self.policy == OVERFLOW_BLOCK:
+            shard.put(item)
+            self._count("enqueued")
+        elif self.policy == OVERFLOW_DROP_OLDEST:
+            while True:
+                try:
+                    shard.get_nowait()
+                    self._count("dropped")
+                except queue.Empty:
+                    pass
+                try:
+                    shard.put_nowait(item)
+                    self._count("enqueued")
+                    return
+                except queue.Full:
+                    continue
+        else:
+            self._spill(spill, item)
+
+    def _spill(self, spill, item):
+        try:
+            spill.append(item)
+            self._count("spilled")
+        except OSError as e:
+            logger.error(f"❌ [Ingest] No se pudo desbordar a disco: {e}")
+            self._count("dropped")
+
+    # --- WORKERS ---
+    def _worker(self, index):
+        shard = self.shards[index]
+        while True:
+            try:
+                # Con desborde activo no bloqueamos: hay trabajo en disco
+                spill = self.spills[index]
+                item = shard.get(timeout=0.05 if spill is not None and spill.pending else None)
+            except queue.Empty:
+                item = self.spills[index].pop()
+                if item is None:
+                    continue
+            if item is _STOP:
+                self._drain_spill(index)
+                return
+            self._run(item)
+
+    def _drain_spill(self, index):
+        spill = self.spills[index]
+        while spill is not None and spill.pending:
+            self._run(spill.pop())
+
+    def _run(self, item):
+        try:
+            self.handler(item)
+            self._count("processed")
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"❌ [Ingest] Error en worker: {e}")
+
+    # --- MÉTRICAS ---
+    def _count(self, name, amount=1):
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "workers": self.workers,
+            "queue_depth": sum(s.qsize() for s in self.shards),
+            "queue_capacity": sum(s.maxsize for s in self.shards),
+            "spill_pending": sum(s.pending for s in self.spills if s is not None),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "errors": self.errors,
+        }
@@ -0,0 +1,80 @@
+import threading
+
+
+class LastValueCache:
+    """
+    Último valor conocido por `(equipo, rama, llave)` con su timestamp de
+    servidor, actualizado por la ingesta. Permite a dashboards y estadísticas
+    pintar el estado actual sin abrir un WebSocket ni esperar el siguiente
+    publish.
+
+    { "device_uid": { "caldera/sensor1": { "temperatura": (25.4, 1718000000.1) } } }
+    """
+    def __init__(self):
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def update(self, device_uid, path, telemetry, ts):
+        if type(telemetry) is not dict:
+            return
+        # Cada equipo lo actualiza un solo worker; el lock solo protege el alta del equipo
+        paths = self.values.get(device_uid)
+        if paths is None:
+            with self._lock:
+                paths = self.values.setdefault(device_uid, {})
+        branch = paths.get(path)
+        if branch is None:
+            branch = paths[path] = {}
+        for key, value in telemetry.items():
+            branch[key] = (value, ts)
+
+    def get(self, device_uid):
+        """`{rama: {llave: {"value", "ts"}}}` y el ts más reciente del equipo."""
+        paths = self.values.get(device_uid, {})
+        out = {}
+        updated_at = None
+        for path, branch in list(paths.items()):
+            entries = {}
+            for key, (value, ts) in list(branch.items()):
+                entries[key] = {"value": value, "ts": ts}
+                if updated_at is None or ts > updated_at:
+                    updated_at = ts
+            out[path] = entries
+        return out, updated_at
+
+    def export(self, device_uid):
+        """Estado crudo `{rama: {llave: [valor, ts]}}` para mandarlo a otro worker por el bus."""
+        paths = self.values.get(device_uid, {})
+        return {
+            path: {key: [value, ts] for key, (value, ts) in list(branch.items())}
+            for path, branch in list(paths.items())
+        }
+
+    def merge(self, device_uid, paths):
+        """
+        Incorpora el estado exportado por otro worker (el que ingesta); solo
+        pisa las llaves que traen un ts más nuevo que el que ya había.
+        """
+        if type(paths) is not dict:
+            return
+        with self._lock:
+            current = self.values.setdefault(device_uid, {})
+        for path, entries in paths.items():
+            if type(entries) is not dict:
+                continue
+            branch = current.setdefault(path, {})
+            for key, entry in entries.items():
+                value, ts = entry
+                previous = branch.get(key)
+                if previous is None or previous[1] is None or (ts is not None and ts > previous[1]):
+                    branch[key] = (value, ts)
+
+    def stats(self):
+        return {
+            "devices": len(self.values),
+            "keys": sum(len(b) for paths in list(self.values.values()) for b in list(paths.values()))
+        }
+
+
+# Instancia única de la caché de últimos valores
+last_values = LastValueCache()
@@ -0,0 +1,211 @@
+import logging
+import os
+import socket
+import threading
+import time
+from sqlalchemy import update, or_, case
+from sqlalchemy.exc import IntegrityError
+from app.database import SessionLocal
+from app import models
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseElection:
+    """
+    Elección de líder por lease en la tabla `service_leases` (funciona igual
+    en Postgres y en SQLite, sin advisory locks).
+
+    Un hilo renueva el lease cada `heartbeat` segundos con un UPDATE
+    condicional (`holder = yo OR expires_at < ahora`): solo una réplica
+    gana la fila. Si el líder muere, su lease vence a los `ttl` segundos y
+    el siguiente heartbeat de un standby lo toma. Si la base no responde
+    el líder conserva el rol (la ingesta sigue y los históricos van al
+    spool local): nadie más puede tomar el lease mientras la base esté
+    caída, y al volver el primer heartbeat le dice si otro lo tomó, y
+    recién ahí se degrada. Un standby que vio la base caída espera un
+    `ttl` desde que la vuelve a alcanzar antes de competir: el lease
+    vencido durante el corte es del líder, que lo renueva en su siguiente
+    heartbeat. Los relojes de las réplicas deben diferir
+    bastante menos que `ttl`.
+
+    `on_elected` / `on_demoted` se invocan desde el hilo de heartbeat (el
+    primer intento corre en quien llama a `start`).
+    """
+    def __init__(self, name, ttl=10.0, heartbeat=2.0, enabled=True):
+        self.name = name
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.enabled = enabled
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = not enabled   # Sin elección, cada proceso es su propio líder
+        self.lease_until = 0.0
+        self.elections = 0
+        self.errors = 0
+        self._db_down = False
+        self._hold_until = 0.0  # Standby tras un corte: no compite hasta entonces (monotonic)
+        self.on_elected = None
+        self.on_demoted = None
+        self._running = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # --- CICLO DE VIDA ---
+    def start(self, on_elected=None, on_demoted=None):
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        if not self.enabled:
+            if on_elected is not None:
+                on_elected()
+            return
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        # Primer intento síncrono: un proceso solo arranca como líder sin esperar al heartbeat
+        self._tick()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Suelta el lease (un standby lo toma en el siguiente heartbeat)."""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout)
+        if self.is_leader:
+            # Apagado: quien llama ya detuvo la ingesta, no se dispara on_demoted
+            self.is_leader = False
+            try:
+                self._release()
+            except Exception as e:
+                logger.warning(f"⚠️ [Leader] No se pudo soltar el lease '{self.name}': {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running:
+                    self._cond.wait(self.heartbeat)
+                if not self._running:
+                    return
+            self._tick()
+
+    # --- HEARTBEAT ---
+    def _tick(self):
+        try:
+            if not self.is_leader and self._standby_hold():
+                return
+            won = self._try_acquire()
+        except Exception as e:
+            self.errors += 1
+            self._db_down = True
+            # Base caída: el rol no cambia hasta ver otro holder en la fila
+            if self.errors % 30 == 1:
+                role = "se conserva el liderazgo" if self.is_leader else "sigue en standby"
+                logger.warning(f"⚠️ [Leader] Error renovando el lease '{self.name}' ({role}): {e}")
+            return
+        self._db_down = False
+        self._set_leader(won)
+
+    def _standby_hold(self):
+        """Tras un corte el líder tiene prioridad para renovar: el standby espera un `ttl`."""
+        if self._db_down:
+            self.current()  # Lanza si la base sigue caída
+            self._db_down = False
+            self._hold_until = time.monotonic() + self.ttl
+            return True
+        return time.monotonic() < self._hold_until
+
+    def _try_acquire(self):
+        now = time.time()
+        db = SessionLocal()
+        try:
+            lease = models.ServiceLease
+            result = db.execute(
+                update(lease)
+                .where(lease.name == self.name, or_(lease.holder == self.holder, lease.expires_at < now))
+                .values(
+                    holder=self.holder,
+                    expires_at=now + self.ttl,
+                    acquired_at=case((lease.holder == self.holder, lease.acquired_at), else_=now)
+                )
+            )
+            won = result.rowcount == 1
+            if not won and db.get(lease, self.name) is None:
+                db.add(lease(name=self.name, holder=self.holder, expires_at=now + self.ttl, acquired_at=now))
+                try:
+                    db.flush()
+                    won = True
+                except IntegrityError:
+                    db.rollback()  # Otra réplica creó la fila primero
+                    return False
+            db.commit()
+        finally:
+            db.close()
+        if won:
+            self.lease_until = now + self.ttl
+        return won
+
+    def _release(self):
+        db = SessionLocal()
+        try:
+            lease = models.ServiceLease
+            db.execute(
+                update(lease)
+                .where(lease.name == self.name, lease.holder == self.holder)
+                .values(expires_at=0)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _set_leader(self, leader):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        if leader:
+            self.elections += 1
+            logger.info(f"👑 [Leader] {self.holder} es líder de '{self.name}'")
+            callback = self.on_elected
+        else:
+            logger.warning(f"🔻 [Leader] {self.holder} dejó de ser líder de '{self.name}'")
+            callback = self.on_demoted
+        if callback is not None:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"❌ [Leader] Error en el cambio de rol de '{self.name}': {e}")
+
+    def current(self):
+        """Fila actual del lease (quién es líder y hasta cuándo)."""
+        db = SessionLocal()
+        try:
+            row = db.get(models.ServiceLease, self.name)
+            if row is None:
+                return None
+            return {"holder": row.holder, "expires_at": row.expires_at, "acquired_at": row.acquired_at}
+        finally:
+            db.close()
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "holder": self.holder,
+            "is_leader": self.is_leader,
+            "lease_until": self.lease_until if self.is_leader else None,
+            "elections": self.elections,
+            "errors": self.errors
+        }
+
+
+# Lease del historian / ingesta 24/7
+historian_leader = LeaseElection(
+    "historian",
+    ttl=settings.leader_lease_ttl_s,
+    heartbeat=settings.leader_heartbeat_s,
+    enabled=settings.leader_election_enabled
+)
@@ -0,0 +1,598 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import select
+import socket
+import struct
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from app.services.last_values import last_values
+
+# Backends opcionales: se usan si están instalados
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+BACKEND_LOCAL = "local"
+BACKEND_REDIS = "redis"
+BACKEND_POSTGRES = "postgres"
+BACKEND_UNIX = "unix"
+LIVE_BUS_BACKENDS = (BACKEND_LOCAL, BACKEND_REDIS, BACKEND_POSTGRES, BACKEND_UNIX)
+
+KIND_LIVE = "live"
+KIND_INTEREST = "interest"
+KIND_STATE_REQUEST = "state?"
+KIND_STATE = "state"
+
+
+def _dumps(event) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(event)
+    return json.dumps(event, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class LocalBus:
+    """
+    Bus en proceso (un solo worker): lo que sale del conflator se entrega
+    directo al ConnectionManager, sin serializar. Es el comportamiento
+    original y el sustituto para pruebas de los buses entre procesos.
+    """
+    name = BACKEND_LOCAL
+
+    def __init__(self):
+        self.manager = None
+        self.loop = None
+        self.on_interest = None
+        self.ingesting = None
+        self.published = 0
+        self.received = 0
+
+    # --- CICLO DE VIDA ---
+    def start(self, loop, manager, on_interest=None, ingesting=None):
+        """`ingesting()` dice si este proceso corre la ingesta (y llena `last_values`)."""
+        self.loop = loop
+        self.manager = manager
+        self.on_interest = on_interest
+        self.ingesting = ingesting
+
+    async def stop(self):
+        pass
+
+    # --- ENVÍO (event loop, desde el conflator) ---
+    async def publish(self, device_id, message):
+        self.published += 1
+        await self._deliver(device_id, message)
+
+    async def _deliver(self, device_id, message):
+        self.received += 1
+        if self.manager is not None:
+            await self.manager.send_personal_message(message, device_id)
+
+    # --- INTERÉS (qué equipos tienen sockets abiertos) ---
+    def has_listeners(self, device_id):
+        """¿Vale la pena mandar al vivo este equipo? (se llama desde los workers de ingesta)"""
+        return bool(self.manager is not None and self.manager.active_connections.get(device_id))
+
+    def announce_interest(self):
+        """En un solo proceso la ingesta ya ve los sockets locales."""
+
+    # --- ESTADO (últimos valores) ---
+    async def request_state(self, device_ids, timeout=None):
+        """En un solo proceso `last_values` ya lo llena la ingesta local."""
+        return True
+
+    def fetch_state(self, device_ids, timeout=None):
+        """Versión bloqueante de `request_state` para endpoints síncronos."""
+        return True
+
+    def stats(self):
+        return {"backend": self.name, "published": self.published, "received": self.received}
+
+
+class RemoteBus(LocalBus):
+    """
+    Base de los buses entre procesos (varios workers de uvicorn). Los
+    eventos viajan como JSON por un único canal:
+
+        {"k": "live", "d": device_uid, "m": enriched_data}
+        {"k": "interest", "w": worker, "devices": [device_uid, ...]}
+        {"k": "state?", "r": request_id, "devices": [device_uid, ...]}
+        {"k": "state", "r": request_id, "d": device_uid, "s": {rama: {llave: [valor, ts]}}}
+
+    Todos los workers (también el que ingesta) reciben los "live" y los
+    entregan a sus sockets locales; los que no ingestan además actualizan
+    con ellos su `last_values`. Para los snapshots (REST y delta) un worker
+    sin ingesta pide el estado con "state?" y el que ingesta responde un
+    "state" por equipo (cada uno cabe por separado en un NOTIFY). Cada worker anuncia cada
+    `interest_interval` segundos (y al abrir un socket) los equipos que
+    está sirviendo; el anuncio caduca a las 3 rondas sin renovarse. Así la
+    ingesta solo publica equipos con oyentes y, vía `on_interest`, puede
+    levantar bridges temporales para workers que no ingestan.
+
+    Las subclases implementan `_listen()` (conecta y despacha hasta
+    perder la conexión), `_send(data)` y `_close()`.
+    """
+    def __init__(self, channel="synteck_live", interest_interval=5.0):
+        super().__init__()
+        self.channel = channel
+        self.interest_interval = interest_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.remote_interest = {}    # { worker_id: (frozenset(device_uids), visto_en) }
+        self.watched = frozenset()   # Unión vigente del interés de otros workers
+        self.connected = False
+        self.errors = 0
+        self.dropped = 0
+        self._backoff = 1.0
+        self._announce = None
+        self._tasks = []
+        self._requests = itertools.count(1)
+        self._pending_state = {}     # { request_id: (set(device_uids) sin respuesta, asyncio.Event) }
+        self.state_requests = 0
+        self.state_timeouts = 0
+
+    def start(self, loop, manager, on_interest=None, ingesting=None):
+        """Arranca las tareas de escucha y anuncio en el event loop principal (idempotente)."""
+        if self._announce is not None:
+            return
+        super().start(loop, manager, on_interest, ingesting)
+        self._announce = asyncio.Event()
+
+        def _create():
+            self._tasks = [loop.create_task(self._listen_forever()), loop.create_task(self._interest_loop())]
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            _create()
+        else:
+            loop.call_soon_threadsafe(_create)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._announce = None
+        self.connected = False
+        try:
+            await self._close()
+        except Exception as e:
+            logger.debug(f"[LiveBus] Error cerrando {self.name}: {e}")
+
+    # --- ENVÍO ---
+    async def publish(self, device_id, message):
+        try:
+            await self._send(_dumps({"k": KIND_LIVE, "d": device_id, "m": message}))
+            self.published += 1
+        except Exception as e:
+            self._error(f"publicando {device_id}", e)
+
+    def _error(self, action, exc):
+        # Con el backend caído esto se dispara a la frecuencia del vivo: solo 1 de cada 100
+        self.errors += 1
+        if self.errors % 100 == 1:
+            logger.warning(f"⚠️ [LiveBus] {self.name}: error {action}: {exc} (errores: {self.errors})")
+
+    def _drop(self, reason):
+        self.dropped += 1
+        if self.dropped % 100 == 1:
+            logger.warning(f"⚠️ [LiveBus] {self.name}: evento descartado ({reason}, total: {self.dropped})")
+
+    # --- RECEPCIÓN ---
+    async def _listen_forever(self):
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ [LiveBus] {self.name} desconectado: {e}. Reintento en {self._backoff:.0f}s")
+            self.connected = False
+            await asyncio.sleep(self._backoff)
+            self._backoff = min(self._backoff * 2, 30.0)
+
+    def _on_connected(self):
+        self.connected = True
+        self._backoff = 1.0
+        logger.info(f"🔌 [LiveBus] Conectado ({self.name}, canal '{self.channel}', worker {self.worker_id})")
+        self.announce_interest()
+
+    async def _dispatch(self, data):
+        try:
+            event = _loads(data)
+        except ValueError:
+            self.errors += 1
+            return
+        kind = event.get("k")
+        if kind == KIND_LIVE:
+            message = event.get("m")
+            if not self._is_ingesting() and type(message) is dict:
+                metadata = message.get("metadata") or {}
+                last_values.update(
+                    str(event.get("d")), metadata.get("subtopic"), message.get("telemetry"), metadata.get("server_ts")
+                )
+            await self._deliver(event.get("d"), message)
+        elif kind == KIND_INTEREST and event.get("w") != self.worker_id:
+            self.remote_interest[event.get("w")] = (frozenset(event.get("devices") or ()), time.monotonic())
+            self._refresh_interest()
+        elif kind == KIND_STATE_REQUEST:
+            if self._is_ingesting():
+                self.loop.create_task(self._reply_state(event.get("r"), event.get("devices") or ()))
+        elif kind == KIND_STATE:
+            self._on_state(event.get("r"), str(event.get("d")), event.get("s"))
+
+    # --- ESTADO (últimos valores) ---
+    def _is_ingesting(self):
+        return bool(self.ingesting is not None and self.ingesting())
+
+    async def request_state(self, device_ids, timeout=None):
+        """
+        Pide al worker que ingesta los últimos valores de `device_ids` y
+        espera las respuestas (a lo sumo `timeout`). Devuelve False si no
+        llegaron todas; lo que llegó ya quedó en `last_values`.
+        """
+        devices = {str(d) for d in device_ids}
+        if not devices or self._is_ingesting():
+            return True
+        if not self.connected:
+            return False
+        request_id = f"{self.worker_id}:{next(self._requests)}"
+        waiting = self._pending_state[request_id] = (devices, asyncio.Event())
+        self.state_requests += 1
+        try:
+            await self._send(_dumps({"k": KIND_STATE_REQUEST, "r": request_id, "devices": list(devices)}))
+            await asyncio.wait_for(waiting[1].wait(), timeout=timeout or settings.live_bus_state_timeout_s)
+            return True
+        except asyncio.TimeoutError:
+            self.state_timeouts += 1
+            logger.debug(f"⏱️ [LiveBus] Sin respuesta de estado para {len(waiting[0])} equipo(s)")
+            return False
+        except Exception as e:
+            self._error("pidiendo estado", e)
+            return False
+        finally:
+            self._pending_state.pop(request_id, None)
+
+    def fetch_state(self, device_ids, timeout=None):
+        """Versión bloqueante de `request_state` para endpoints síncronos (threadpool)."""
+        if self.loop is None or self._is_ingesting():
+            return True
+        timeout = timeout or settings.live_bus_state_timeout_s
+        try:
+            future = asyncio.run_coroutine_threadsafe(self.request_state(device_ids, timeout), self.loop)
+            return future.result(timeout + 1.0)
+        except Exception as e:
+            logger.debug(f"[LiveBus] Estado no disponible: {e}")
+            return False
+
+    async def _reply_state(self, request_id, device_ids):
+        for device_id in device_ids:
+            device_id = str(device_id)
+            try:
+                await self._send(_dumps({
+                    "k": KIND_STATE, "r": request_id, "d": device_id, "s": last_values.export(device_id)
+                }))
+            except Exception as e:
+                self._error(f"respondiendo estado de {device_id}", e)
+
+    def _on_state(self, request_id, device_id, state):
+        if not self._is_ingesting():
+            last_values.merge(device_id, state)
+        waiting = self._pending_state.get(request_id)
+        if waiting is not None:
+            waiting[0].discard(device_id)
+            if not waiting[0]:
+                waiting[1].set()
+
+    # --- INTERÉS ---
+    def has_listeners(self, device_id):
+        return super().has_listeners(device_id) or device_id in self.watched
+
+    def announce_interest(self):
+        if self.loop is not None and self._announce is not None:
+            self.loop.call_soon_threadsafe(self._announce.set)
+
+    async def _interest_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._announce.wait(), timeout=self.interest_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._announce.clear()
+            if self.connected:
+                devices = list(self.manager.active_connections) if self.manager is not None else []
+                try:
+                    await self._send(_dumps({"k": KIND_INTEREST, "w": self.worker_id, "devices": devices}))
+                except Exception as e:
+                    self._error("anunciando interés", e)
+            self._refresh_interest()
+
+    def _refresh_interest(self):
+        now = time.monotonic()
+        ttl = self.interest_interval * 3
+        for worker, (_, seen) in list(self.remote_interest.items()):
+            if now - seen > ttl:
+                del self.remote_interest[worker]
+        current = frozenset().union(*(devices for devices, _ in self.remote_interest.values()))
+        added, removed = current - self.watched, self.watched - current
+        self.watched = current
+        if self.on_interest is None:
+            return
+        for device_id in added:
+            self.on_interest(device_id, True)
+        for device_id in removed:
+            self.on_interest(device_id, False)
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "connected": self.connected,
+            "worker": self.worker_id,
+            "remote_workers": len(self.remote_interest),
+            "remote_devices": len(self.watched),
+            "state_requests": self.state_requests,
+            "state_timeouts": self.state_timeouts,
+            "errors": self.errors,
+            "dropped": self.dropped
+        }
+
+
+class RedisBus(RemoteBus):
+    """Pub/sub de Redis (`live_bus_url`, p. ej. redis://redis:6379/0)."""
+    name = BACKEND_REDIS
+
+    def __init__(self, url="", **kwargs):
+        if aioredis is None:
+            raise RuntimeError("redis no está instalado (pip install redis)")
+        super().__init__(**kwargs)
+        self.url = url or "redis://localhost:6379/0"
+        self.client = None
+
+    async def _listen(self):
+        self.client = aioredis.from_url(self.url)
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._on_connected()
+        try:
+            async for msg in pubsub.listen():
+                if msg.get("type") == "message":
+                    await self._dispatch(msg["data"])
+        finally:
+            await pubsub.aclose()
+
+    async def _send(self, data):
+        if self.client is None:
+            raise ConnectionError("sin conexión a Redis")
+        await self.client.publish(self.channel, data)
+
+    async def _close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+class PostgresBus(RemoteBus):
+    """
+    LISTEN/NOTIFY sobre la misma base (o `live_bus_url`). psycopg2 es
+    bloqueante: la escucha vive en un hilo propio y los NOTIFY salen por un
+    executor de un hilo. Postgres limita el payload a 8000 bytes; los
+    mensajes más grandes se descartan (usar filtros o Redis para equipos
+    con cientos de tags).
+    """
+    name = BACKEND_POSTGRES
+    MAX_PAYLOAD = 7999
+
+    def __init__(self, dsn="", **kwargs):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 no está instalado")
+        super().__init__(**kwargs)
+        if not dsn:
+            from app.database import SQLALCHEMY_DATABASE_URL
+            dsn = SQLALCHEMY_DATABASE_URL
+        self.dsn = dsn
+        self._send_conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="livebus-notify")
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        stop = threading.Event()
+
+        def reader():
+            conn = None
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                loop.call_soon_threadsafe(events.put_nowait, ("connected", None))
+                while not stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        loop.call_soon_threadsafe(events.put_nowait, ("data", conn.notifies.pop(0).payload))
+            except Exception as e:
+                loop.call_soon_threadsafe(events.put_nowait, ("error", e))
+            finally:
+                if conn is not None:
+                    conn.close()
+
+        threading.Thread(target=reader, name="livebus-listen", daemon=True).start()
+        try:
+            while True:
+                kind, value = await events.get()
+                if kind == "connected":
+                    self._on_connected()
+                elif kind == "error":
+                    raise value
+                else:
+                    await self._dispatch(value)
+        finally:
+            stop.set()
+
+    def _notify(self, payload):
+        if self._send_conn is None or self._send_conn.closed:
+            self._send_conn = self._connect()
+        try:
+            with self._send_conn.cursor() as cur:
+                cur.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+        except psycopg2.Error:
+            self._send_conn.close()
+            raise
+
+    async def _send(self, data):
+        if len(data) > self.MAX_PAYLOAD:
+            self._drop(f"payload de {len(data)} bytes > límite de NOTIFY")
+            return
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._notify, data.decode())
+
+    async def _close(self):
+        if self._send_conn is not None and not self._send_conn.closed:
+            self._send_conn.close()
+        self._executor.shutdown(wait=False)
+
+
+class UnixSocketBus(RemoteBus):
+    """
+    Broker local por socket UNIX para varios workers en el mismo host, sin
+    servicios externos. El worker que toma el lock `<ruta>.lock` hace de
+    broker y reenvía cada frame a todos los conectados (él incluido); si
+    muere, el SO libera el lock y otro worker lo reemplaza al reconectar.
+    Frame: longitud u32 big-endian + JSON.
+    """
+    name = BACKEND_UNIX
+    MAX_BUFFER = 4 * 1024 * 1024  # Bytes pendientes por conexión antes de descartar
+
+    def __init__(self, path="", **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or "/tmp/synteck_live.sock"
+        self.is_broker = False
+        self._lock_fd = None
+        self._server = None
+        self._peers = set()
+        self._writer = None
+
+    async def _become_broker(self):
+        if self._server is not None:
+            return
+        if self._lock_fd is None:
+            fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return  # Otro worker es el broker
+            self._lock_fd = fd
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Socket huérfano de un broker anterior
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path)
+        self.is_broker = True
+        logger.info(f"📮 [LiveBus] Este worker es el broker local en {self.path}")
+
+    async def _serve_peer(self, reader, writer):
+        self._peers.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                frame = header + await reader.readexactly(struct.unpack(">I", header)[0])
+                for peer in list(self._peers):
+                    if peer.transport.get_write_buffer_size() > self.MAX_BUFFER:
+                        self._drop("worker lento")
+                        continue
+                    peer.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # Worker desconectado (o broker apagándose)
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _listen(self):
+        await self._become_broker()
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        self._writer = writer
+        self._on_connected()
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                await self._dispatch(await reader.readexactly(struct.unpack(">I", header)[0]))
+        finally:
+            self._writer = None
+            writer.close()
+
+    async def _send(self, data):
+        writer = self._writer
+        if writer is None:
+            raise ConnectionError("sin conexión al broker")
+        if writer.transport.get_write_buffer_size() > self.MAX_BUFFER:
+            self._drop("broker lento")
+            return
+        writer.write(struct.pack(">I", len(data)) + data)
+
+    async def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+        for peer in list(self._peers):
+            peer.close()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.is_broker = False
+
+    def stats(self):
+        return {**super().stats(), "broker": self.is_broker, "peers": len(self._peers)}
+
+
+def create_live_bus(backend=None):
+    """Bus configurado en `live_bus_backend`; si el backend no está disponible cae a local."""
+    backend = (backend or settings.live_bus_backend or BACKEND_LOCAL).lower()
+    options = {"channel": settings.live_bus_channel, "interest_interval": settings.live_bus_interest_s}
+    try:
+        if backend == BACKEND_REDIS:
+            return RedisBus(settings.live_bus_url, **options)
+        if backend == BACKEND_POSTGRES:
+            return PostgresBus(settings.live_bus_url, **options)
+        if backend == BACKEND_UNIX:
+            return UnixSocketBus(settings.live_bus_url, **options)
+        if backend != BACKEND_LOCAL:
+            logger.error(f"❌ [LiveBus] Backend desconocido '{backend}' (opciones: {LIVE_BUS_BACKENDS})")
+    except RuntimeError as e:
+        logger.error(f"❌ [LiveBus] {e}; se usa el bus local (solo un worker ve el vivo)")
+    return LocalBus()
+
+
+# Instancia única del bus de envío en vivo
+live_bus = create_live_bus()
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import threading
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LiveConflator:
+    """
+    Conflación "último valor" para el envío en vivo por WebSocket.
+
+    Los workers de ingesta no agendan una corrutina por mensaje: solo dejan
+    el mensaje en un buffer por `(equipo, rama)`. Si ya había uno pendiente
+    se fusiona (las llaves nuevas pisan a las viejas, las ausentes conservan
+    su último valor). Una sola tarea en el event loop vacía el buffer como
+    máximo `max_rate_hz` veces por segundo, así el costo por ciclo es
+    O(equipos con cambios) y no O(mensajes). La salida va al bus del vivo
+    (`live_bus`), que la reparte a los sockets de este u otros workers.
+    """
+    def __init__(self, max_rate_hz=5.0):
+        self.interval = 1.0 / max_rate_hz if max_rate_hz > 0 else 0.0
+        self.pending = {}
+        self.sink = None
+        self.loop = None
+        self.offered = 0
+        self.merged = 0
+        self.sent = 0
+        self._scheduled = False
+        self._event = None
+        self._task = None
+        self._lock = threading.Lock()
+
+    # --- CICLO DE VIDA ---
+    def start(self, sink, loop):
+        """Arranca la tarea de envío en el event loop principal (idempotente)."""
+        if self._task is not None:
+            return
+        self.sink = sink
+        self.loop = loop
+        self._event = asyncio.Event()
+
+        def _create():
+            self._task = loop.create_task(self._run())
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            _create()
+        else:
+            loop.call_soon_threadsafe(_create)
+
+    def stop(self):
+        task, self._task = self._task, None
+        if task is not None and self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(task.cancel)
+        with self._lock:
+            self.pending.clear()
+            self._scheduled = False
+
+    # --- PRODUCTORES (hilos de ingesta) ---
+    def offer(self, device_id, subtopic, message):
+        key = (device_id, subtopic)
+        with self._lock:
+            self.offered += 1
+            previous = self.pending.get(key)
+            if previous is not None:
+                self.merged += 1
+                old, new = previous["telemetry"], message["telemetry"]
+                if type(old) is dict and type(new) is dict:
+                    # Copia: el dict original también viaja al historian / alarmas
+                    message = {**message, "telemetry": {**old, **new}}
+            self.pending[key] = message
+            wake = not self._scheduled
+            self._scheduled = True
+        if wake and self.loop is not None and self._event is not None:
+            self.loop.call_soon_threadsafe(self._event.set)
+
+    # --- CONSUMIDOR (event loop) ---
+    async def _run(self):
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            with self._lock:
+                batch, self.pending = self.pending, {}
+            for (device_id, _), message in batch.items():
+                try:
+                    await self.sink.publish(device_id, message)
+                    self.sent += 1
+                except Exception as e:
+                    logger.warning(f"⚠️ [Live] Error enviando a {device_id}: {e}")
+            # Tope de frecuencia: lo que llegue mientras tanto se fusiona
+            if self.interval:
+                await asyncio.sleep(self.interval)
+            with self._lock:
+                if self.pending:
+                    self._event.set()
+                else:
+                    self._scheduled = False
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "offered": self.offered,
+            "merged": self.merged,
+            "sent": self.sent
+        }
+
+
+# Instancia única del buffer de envío en vivo
+live_conflator = LiveConflator(max_rate_hz=settings.ws_max_rate_hz)
@@ -1,223 +1,487 @@
-import json
 import asyncio
+import logging
 import os
-from datetime import datetime
+import socket
+import threading
+import zlib
 from awsiot import mqtt5_client_builder
 from awscrt import mqtt5, auth
 from dotenv import load_dotenv
 import time # Importar al inicio
-from app.database import SessionLocal
-from app import models
+from app.config import settings
+from app.services.ingest_queue import IngestPipeline
+from app.services.subscribe_pacer import SubscribePacer
+from app.services.dedup import DedupFilter
+from app.services.payload_codec import decode_payload, expand_samples
+from app.services.telemetry_writer import telemetry_writer
+from app.services.compression import historian_compressor
+from app.services.live_conflator import live_conflator
+from app.services.live_bus import live_bus
+from app.services.last_values import last_values
+from app.services.device_registry import device_registry
+from app.services.alarm_engine import alarm_engine
+from app.services.alert_state import alert_state
+from app.utils.logging_config import LogSampler
 load_dotenv()
 
-def start_mqtt_bridge(ws_manager, partner_id, client_id, plant_id, device_id, metadata=None):
-    ENDPOINT = "a1uw1qi4z3nyi4-ats.iot.us-east-1.amazonaws.com"
-    
-    # 1. NOMBRES PARA LA RUTA
-    p_name = metadata.get('partner_name', partner_id) if metadata else partner_id
-    c_name = metadata.get('client_name', client_id) if metadata else client_id
-    pl_name = metadata.get('plant_name', plant_id) if metadata else plant_id
+logger = logging.getLogger(__name__)
+
+ENDPOINT = "a1uw1qi4z3nyi4-ats.iot.us-east-1.amazonaws.com"
+
+# AWS IoT Core acepta como máximo 8 filtros por paquete SUBSCRIBE/UNSUBSCRIBE
+MAX_FILTERS_PER_PACKET = 8
+
 
+ROUTE_PENDING = "pending"        # Filtro en cola o esperando SUBACK
+ROUTE_SUBSCRIBED = "subscribed"  # SUBACK con QoS concedido: el equipo ya está en vivo
+ROUTE_FAILED = "failed"          # El broker rechazó la suscripción
+
+
+def topic_filter_for(spec):
+    """Filtro MQTT del equipo y nombres de cliente/planta para enriquecer mensajes."""
+    metadata = spec.get("metadata")
+    p_name = metadata.get('partner_name', spec["partner_id"]) if metadata else spec["partner_id"]
+    c_name = metadata.get('client_name', spec["client_id"]) if metadata else spec["client_id"]
+    pl_name = metadata.get('plant_name', spec["plant_id"]) if metadata else spec["plant_id"]
     # Suscripción recursiva con '#' para capturar N sub-tópicos
-    TOPIC_FILTER = f"{p_name}/{c_name}/{pl_name}/{device_id}/#"
-    
-    try:
-        main_loop = asyncio.get_running_loop()
-    except RuntimeError:
-        main_loop = asyncio.get_event_loop()
-
-    # --- MOTOR DE PROCESAMIENTO RECURSIVO ---
-    def clean_industrial_node(node):
-        """Aplanado automático de listas [0] en cualquier profundidad"""
-        if isinstance(node, list):
-            return clean_industrial_node(node[0]) if len(node) > 0 else None
-        elif isinstance(node, dict):
-            return {k: clean_industrial_node(v) for k, v in node.items()}
-        return node
-
-    def round_values(node):
-        """Redondeo recursivo a 2 decimales para cualquier profundidad"""
-        if isinstance(node, float):
-            return round(node, 2)
-        elif isinstance(node, dict):
-            return {k: round_values(v) for k, v in node.items()}
-        elif isinstance(node, list):
-            return [round_values(i) for i in node]
-        return node
-
-    def on_publish_received(publish_packet_data):
-        try:
-            actual_topic = publish_packet_data.publish_packet.topic
-            payload_raw = publish_packet_data.publish_packet.payload.decode('utf-8')
-            payload = json.loads(payload_raw)
+    return f"{p_name}/{c_name}/{pl_name}/{spec['device_id']}/#", c_name, pl_name
+
+
+class DeviceRoute:
+    """Datos necesarios para enrutar y enriquecer los mensajes de un equipo."""
+    __slots__ = ("device_id", "topic_filter", "client_name", "plant_name", "state", "refs")
+
+    def __init__(self, device_id, topic_filter, client_name, plant_name):
+        self.device_id = device_id
+        self.topic_filter = topic_filter
+        self.client_name = client_name
+        self.plant_name = plant_name
+        self.state = ROUTE_PENDING
+        # Handles vivos sobre la ruta (monitor e historian pueden compartir equipo)
+        self.refs = 1
+
+
+class DeviceSubscription:
+    """
+    Handle devuelto a monitor/historian. Mantiene la interfaz `.stop()`
+    del antiguo cliente por equipo, pero solo suelta su referencia: la
+    suscripción del cliente compartido se retira con el último handle.
+    """
+    def __init__(self, service, device_id, route):
+        self.service = service
+        self.device_id = device_id
+        self.route = route
+        self.stopped = False
+
+    def stop(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        self.service.release_route(self.route)
+
 
-            # --- DEBUGGER: ENTRADA CRUDA ---
-            print(f"\n📥 [RECV] Tópico: {actual_topic}")
-            print(f"📦 [RAW DATA]: {payload_raw}")
+class MqttIngestService:
+    """
+    Servicio de ingesta multiplexado: un pool fijo de clientes MQTT5 contra
+    AWS IoT Core atiende a TODOS los equipos. Cada equipo se asigna a un
+    cliente del pool (hash estable del UID) y los mensajes se enrutan al
+    equipo correcto a partir del tópico.
 
-            # 2. IDENTIFICAR LA RAMA (SUB-TÓPICO)
-            topic_parts = actual_topic.split('/')
+    El callback de awscrt solo encola el paquete crudo en `pipeline`; el
+    parseo, la persistencia y las alertas corren en los workers.
+    """
+    def __init__(self, pool_size=1):
+        self.pool_size = max(1, pool_size)
+        self.clients = []
+        self.connected = []
+        self.pacers = []
+        # Progreso del arranque: cuántas rutas hay en cada estado y cuándo quedó todo suscrito
+        self.route_states = {ROUTE_PENDING: 0, ROUTE_SUBSCRIBED: 0, ROUTE_FAILED: 0}
+        self.started_at = None
+        self.ready_at = None
+        # { "device_uid": DeviceRoute }
+        self.routes = {}
+        self.ws_manager = None
+        self.main_loop = None
+        self._lock = threading.Lock()
+        # Depuración por mensaje: solo 1 de cada N por equipo (y solo si DEBUG está activo)
+        self._debug_sampler = LogSampler(settings.log_sample_every)
+        # Re-entregas QoS 1 tras reconexiones: se descartan antes de persistir
+        self.dedup = DedupFilter(
+            window_size=settings.ingest_dedup_window,
+            window_seconds=settings.ingest_dedup_window_seconds,
+            max_devices=settings.ingest_dedup_max_devices
+        ) if settings.ingest_dedup_enabled else None
+        self.pipeline = IngestPipeline(
+            handler=self._handle_item,
+            workers=settings.ingest_workers,
+            maxsize=settings.ingest_queue_size,
+            policy=settings.ingest_overflow_policy,
+            spill_dir=settings.ingest_spill_dir
+        )
+
+    # --- CICLO DE VIDA ---
+    def start(self, ws_manager=None):
+        """Crea y arranca el pool de clientes (idempotente)."""
+        with self._lock:
+            if self.clients:
+                return
+            if ws_manager is not None:
+                self.ws_manager = ws_manager
             try:
-                # Todo lo que esté después del UID es la rama del proceso
-                device_index = topic_parts.index(str(device_id))
-                subtopic_path = "/".join(topic_parts[device_index + 1:])
-            except ValueError:
-                subtopic_path = "root"
+                self.main_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.main_loop = asyncio.get_event_loop()
+            self.pipeline.start()
+            self.started_at = time.time()
+            self.ready_at = None
+            if self.ws_manager is not None:
+                # En un solo proceso el bus local entrega directo al ConnectionManager
+                if live_bus.manager is None:
+                    live_bus.start(self.main_loop, self.ws_manager)
+                live_conflator.start(live_bus, self.main_loop)
+
+            credentials_provider = auth.AwsCredentialsProvider.new_default_chain()
+            base_client_id = f"Synteck-Ingest-{socket.gethostname()}-{os.getpid()}"
+            for index in range(self.pool_size):
+                self.connected.append(False)
+                client = mqtt5_client_builder.websockets_with_default_aws_signing(
+                    endpoint=ENDPOINT,
+                    region="us-east-1",
+                    credentials_provider=credentials_provider,
+                    on_publish_received=self._on_publish_received,
+                    on_lifecycle_connection_success=self._connection_success_handler(index),
+                    on_lifecycle_disconnection=self._disconnection_handler(index),
+                    client_id=f"{base_client_id}-{index}"
+                )
+                self.clients.append(client)
+                # SUBSCRIBE a ritmo acotado: el límite de AWS IoT es por cuenta, se reparte entre conexiones
+                self.pacers.append(SubscribePacer(
+                    f"conn-{index}",
+                    send=self._subscribe_sender(index),
+                    on_result=self._subscribe_result_handler(index),
+                    rate=settings.mqtt_subscribe_rate / self.pool_size,
+                    inflight=settings.mqtt_subscribe_inflight,
+                    batch_size=MAX_FILTERS_PER_PACKET,
+                    wanted=self._route_wanted
+                ))
+
+        for pacer in self.pacers:
+            pacer.start()
+        for client in self.clients:
+            client.start()
+        logger.info(f"✅ [Ingest] Pool MQTT iniciado con {self.pool_size} conexión(es)")
+
+    def stop(self):
+        """Detiene todas las conexiones del pool."""
+        with self._lock:
+            clients, self.clients, self.connected = self.clients, [], []
+            pacers, self.pacers = self.pacers, []
+        for pacer in pacers:
+            pacer.stop()
+        for client in clients:
+            client.stop()
+        # Procesar lo que ya estaba encolado antes de cerrar
+        self.pipeline.stop()
+        live_conflator.stop()
+        # Puntos retenidos por la compresión: se archivan para no perder el último tramo
+        for device_uid, path, ts, data in historian_compressor.drain():
+            telemetry_writer.add(device_uid, data, path, ts)
+        with self._lock:
+            self.routes.clear()
+            self.route_states = {ROUTE_PENDING: 0, ROUTE_SUBSCRIBED: 0, ROUTE_FAILED: 0}
+
+    # --- SUSCRIPCIONES ---
+    def _shard(self, device_id):
+        return zlib.crc32(str(device_id).encode("utf-8")) % self.pool_size
+
+    def subscribe_devices(self, specs):
+        """
+        Registra varios equipos de una sola vez. `specs` es una lista de dicts
+        con las mismas llaves que `start_mqtt_bridge`. Los filtros nuevos se
+        envían agrupados en paquetes SUBSCRIBE.
+        """
+        pending = {}
+        handles = []
+        with self._lock:
+            for spec in specs:
+                device_id = str(spec["device_id"])
+                route = self.routes.get(device_id)
+                if route is not None:
+                    # Ruta compartida: un handle más, sin otro SUBSCRIBE
+                    route.refs += 1
+                    handles.append(DeviceSubscription(self, device_id, route))
+                    continue
+                topic_filter, c_name, pl_name = topic_filter_for({**spec, "device_id": device_id})
+                route = self.routes[device_id] = DeviceRoute(device_id, topic_filter, c_name, pl_name)
+                self.route_states[ROUTE_PENDING] += 1
+                pending.setdefault(self._shard(device_id), []).append(topic_filter)
+                handles.append(DeviceSubscription(self, device_id, route))
+
+        for index, filters in pending.items():
+            # Si el cliente aún no conecta, la cola está en pausa y al conectar se suscribe todo
+            if index < len(self.pacers):
+                self.pacers[index].enqueue(filters)
+
+        return handles
+
+    def release_route(self, route):
+        """Suelta un handle; la ruta se retira cuando ya no la usa nadie."""
+        with self._lock:
+            # Tras un stop() del pool la ruta ya no existe (o es otra): nada que soltar
+            if self.routes.get(route.device_id) is not route:
+                return
+            route.refs -= 1
+            if route.refs > 0:
+                return
+            # Se retira con el lock tomado: un subscribe concurrente crea una ruta nueva
+            del self.routes[route.device_id]
+            self.route_states[route.state] -= 1
+        self._send_unsubscribe(route)
+
+    def unsubscribe_device(self, device_id):
+        """Retira la ruta del equipo sin importar cuántos handles la comparten."""
+        device_id = str(device_id)
+        with self._lock:
+            route = self.routes.pop(device_id, None)
+            if route:
+                self.route_states[route.state] -= 1
+        if route:
+            self._send_unsubscribe(route)
+
+    def _route_wanted(self, topic_filter):
+        """¿Hay una ruta vigente con este filtro? (los pacers no suscriben bajas)"""
+        # Filtro: "<partner>/<cliente>/<planta>/<device_uid>/#"
+        route = self.routes.get(topic_filter[:-2].rsplit("/", 1)[-1])
+        return route is not None and route.topic_filter == topic_filter
+
+    def _send_unsubscribe(self, route):
+        index = self._shard(route.device_id)
+        # Si aún esperaba su turno en la cola de SUBSCRIBE, se saca de ahí
+        if index < len(self.pacers):
+            self.pacers[index].discard([route.topic_filter])
+        if index < len(self.connected) and self.connected[index]:
+            self.clients[index].unsubscribe(unsubscribe_packet=mqtt5.UnsubscribePacket(
+                topic_filters=[route.topic_filter]
+            ))
+
+    def _subscribe_sender(self, index):
+        def send(filters):
+            return self.clients[index].subscribe(subscribe_packet=mqtt5.SubscribePacket(
+                subscriptions=[mqtt5.Subscription(topic_filter=f, qos=mqtt5.QoS.AT_LEAST_ONCE) for f in filters]
+            ))
+        return send
+
+    def _set_state(self, route, state):
+        """Cambia el estado de una ruta (con `_lock` tomado)."""
+        self.route_states[route.state] -= 1
+        self.route_states[state] += 1
+        route.state = state
+
+    def _subscribe_result_handler(self, index):
+        def on_result(filters, ok_flags, error):
+            if ok_flags is None:
+                return  # Error de envío: los filtros vuelven a la cola, siguen pendientes
+            with self._lock:
+                for topic_filter, ok in zip(filters, ok_flags):
+                    # Filtro: "<partner>/<cliente>/<planta>/<device_uid>/#"
+                    route = self.routes.get(topic_filter[:-2].rsplit("/", 1)[-1])
+                    if route is None or route.topic_filter != topic_filter:
+                        continue  # Se dio de baja mientras esperaba el SUBACK
+                    if not ok:
+                        logger.error(f"❌ [Ingest] AWS IoT rechazó la suscripción de {route.device_id}")
+                    self._set_state(route, ROUTE_SUBSCRIBED if ok else ROUTE_FAILED)
+                done = self.route_states[ROUTE_PENDING] == 0 and self.ready_at is None
+                if done:
+                    self.ready_at = time.time()
+            if done:
+                logger.info(
+                    f"✅ [Ingest] Ingesta completa: {self.route_states[ROUTE_SUBSCRIBED]} equipo(s) suscritos "
+                    f"en {self.ready_at - self.started_at:.1f}s ({self.route_states[ROUTE_FAILED]} rechazados)"
+                )
+        return on_result
+
+    def _connection_success_handler(self, index):
+        def on_lifecycle_connection_success(lifecycle_connect_success_data):
+            with self._lock:
+                self.connected[index] = True
+                filters = [r.topic_filter for uid, r in self.routes.items() if self._shard(uid) == index]
+            logger.info(f"✅ [MQTT5 CONNECTED] AWS IoT Core (conexión {index}) | 📡 ESCUCHANDO {len(filters)} ÁRBOLES")
+            if index < len(self.pacers):
+                self.pacers[index].resume(filters)
+        return on_lifecycle_connection_success
+
+    def _disconnection_handler(self, index):
+        def on_lifecycle_disconnection(lifecycle_disconnect_data):
+            if index < len(self.connected):
+                self.connected[index] = False
+            if index < len(self.pacers):
+                self.pacers[index].pause()
+            # Al reconectar se vuelve a suscribir todo: sus equipos quedan pendientes hasta el SUBACK
+            with self._lock:
+                for uid, route in self.routes.items():
+                    if self._shard(uid) == index and route.state == ROUTE_SUBSCRIBED:
+                        self._set_state(route, ROUTE_PENDING)
+            logger.warning(f"⚠️ [MQTT5 DISCONNECTED] conexión {index}")
+        return on_lifecycle_disconnection
+
+    def readiness(self):
+        """Progreso de las suscripciones: listo cuando ningún equipo espera su SUBACK."""
+        with self._lock:
+            states = dict(self.route_states)
+        total = sum(states.values())
+        return {
+            "ready": states[ROUTE_PENDING] == 0,
+            "devices": total,
+            **states,
+            "progress": round((total - states[ROUTE_PENDING]) / total, 3) if total else 1.0,
+            "started_at": self.started_at,
+            "ready_at": self.ready_at,
+            "startup_seconds": round(self.ready_at - self.started_at, 2) if self.ready_at and self.started_at else None,
+            "subscribe_queues": [pacer.stats() for pacer in self.pacers]
+        }
+
+    # --- ENRUTAMIENTO ---
+    def resolve_route(self, topic):
+        """Devuelve (route, subtopic_path) a partir del tópico recibido."""
+        # Tópico esperado: partner/cliente/planta/uid/<rama...>
+        parts = topic.split('/')
+        route = self.routes.get(parts[3]) if len(parts) > 3 else None
+        if route:
+            return route, "/".join(parts[4:])
+        # Nombres con '/' embebido: buscamos el UID en cualquier posición
+        for i, part in enumerate(parts):
+            route = self.routes.get(part)
+            if route:
+                return route, "/".join(parts[i + 1:])
+        return None, None
+
+    def _on_publish_received(self, publish_packet_data):
+        """Hilo de awscrt: solo enrutar y encolar, nada de I/O."""
+        packet = publish_packet_data.publish_packet
+        route, subtopic_path = self.resolve_route(packet.topic)
+        if route is None:
+            return
+        self.pipeline.submit((route.device_id, subtopic_path, packet.topic, packet.payload, time.time()))
+
+    def _handle_item(self, item):
+        """Worker del pipeline: procesa un paquete encolado."""
+        device_id, subtopic_path, topic, payload, recv_ts = item
+        route = self.routes.get(device_id)
+        if route is None:
+            # El equipo se dio de baja mientras el mensaje esperaba en cola
+            return
+        self.process_message(route, topic, subtopic_path, payload, recv_ts)
+
+    def stats(self):
+        return {
+            "connections": self.pool_size,
+            "connected": sum(1 for c in self.connected if c),
+            "devices": len(self.routes),
+            "pipeline": self.pipeline.stats(),
+            "dedup": self.dedup.stats() if self.dedup else None,
+            "subscriptions": self.readiness(),
+            "live": live_conflator.stats(),
+            "live_bus": live_bus.stats(),
+            "websockets": self.ws_manager.stats() if self.ws_manager else None,
+            "last_values": last_values.stats(),
+            "telemetry_writer": telemetry_writer.stats(),
+            "alerts": alert_state.stats()
+        }
+
+    def process_message(self, route, actual_topic, subtopic_path, payload_bytes, recv_ts=None):
+        device_id = route.device_id
+        try:
+            # Metadata desde el registro en memoria (sin query por mensaje)
+            device = device_registry.get_or_load(str(device_id))
+
+            # Parseo directo desde los bytes del paquete (JSON, msgpack o CBOR según el equipo)
+            payload = decode_payload(payload_bytes, device.payload_format if device else None)
+
+            # Duplicados QoS 1: por nº de secuencia del equipo o por hash del mensaje con ts propio
+            if self.dedup is not None:
+                fingerprint = self.dedup.fingerprint(
+                    subtopic_path, actual_topic, payload, payload_bytes, settings.ingest_dedup_seq_field
+                )
+                if fingerprint is not None and self.dedup.seen(device_id, fingerprint, recv_ts):
+                    return
+
+            # Timestamp del Servidor (Server-side timestamping, al recibir el paquete)
+            server_ts = recv_ts or time.time()
 
             # 3. LIMPIEZA Y ENRIQUECIMIENTO
-            # Buscamos en 'd', 'values' o raíz (según lo que mande la HMI)
-            raw_industrial_values = payload.get('values', payload.get('d', payload))
-            clean_telemetry = round_values(clean_industrial_node(raw_industrial_values))
-            
-            # Timestamp del Servidor (Server-side timestamping)
-            server_ts = time.time()
-            # 4. OBJETO FINAL (EL QUE IRÁ A LA UI)
+            # Un mensaje puede traer N muestras con su propio ts (gateways con buffer);
+            # sin ts es una sola muestra con el timestamp del servidor
+            samples = expand_samples(payload, server_ts, settings.ingest_max_clock_skew_s)
+            latest_ts, clean_telemetry = samples[-1]
+
+            # 4. OBJETO FINAL (EL QUE IRÁ A LA UI): solo la muestra más reciente
             enriched_data = {
                 "telemetry": clean_telemetry,
                 "metadata": {
                     "subtopic": subtopic_path,
-                    "server_ts": server_ts,
+                    "server_ts": latest_ts,
+                    "samples": len(samples),
                     "device_id": device_id,
-                    "client": c_name,
-                    "plant": pl_name
+                    "client": route.client_name,
+                    "plant": route.plant_name
                 }
             }
 
-            # --- DEBUGGER: SALIDA PROCESADA ---
-            print(f"✨ [PROCESSED] Rama: {subtopic_path}")
-            print(f"📊 [CLEAN VALS]: {json.dumps(clean_telemetry, indent=2)}")
-            print(f"⏰ [TS]: {server_ts}")
-            print(f"--------------------------------------------------")
-
-            if ws_manager:
-                asyncio.run_coroutine_threadsafe(
-                    ws_manager.send_personal_message(enriched_data, str(device_id)), 
-                    main_loop
+            # --- DEBUGGER (muestreado; el formateo ocurre en el hilo del listener) ---
+            if logger.isEnabledFor(logging.DEBUG) and self._debug_sampler.allow(device_id):
+                logger.debug(
+                    "📥 [RECV] mensaje procesado",
+                    extra={"topic": actual_topic, "subtopic": subtopic_path, "sample_ts": latest_ts,
+                           "samples": len(samples), "telemetry": clean_telemetry}
                 )
 
+            # Último valor por (equipo, rama, llave) para los snapshots REST
+            last_values.update(str(device_id), subtopic_path, clean_telemetry, latest_ts)
+
+            # Envío en vivo conflado (último valor, frecuencia acotada); solo si hay oyentes
+            if self.ws_manager and live_bus.has_listeners(str(device_id)):
+                live_conflator.offer(str(device_id), subtopic_path, enriched_data)
+
             # --- PERSISTENCIA LOCAL (SQLite) ---
             try:
-                db = SessionLocal()
-                device = db.query(models.Device).filter(models.Device.aws_iot_uid == str(device_id)).first()
                 if not device:
-                    db.close()
                     return
 
-                if device.history_enabled:
-                    new_log = models.TelemetryLog(
-                        device_uid=str(device_id),
-                        data=clean_telemetry,
-                        path=subtopic_path
-                    )
-                    db.add(new_log)
-                    db.commit()
-
-                # --- MONITOREO DE ALERTAS AVANZADO (Triggering Engine v2) ---
-                # Inicializar trackers de tiempo si no existen (en el scope de la función de cierre)
-                if not hasattr(on_publish_received, "error_start_times"):
-                    on_publish_received.error_start_times = {} # {tag_id: start_timestamp}
-
-                tags = db.query(models.DeviceTag).filter(
-                    models.DeviceTag.device_id == device.id,
-                    (models.DeviceTag.min_value.isnot(None)) | (models.DeviceTag.max_value.isnot(None))
-                ).all()
-
-                for tag in tags:
-                    val = clean_telemetry.get(tag.mqtt_key)
-                    if not isinstance(val, (int, float)):
-                        continue
-
-                    # 1. EVALUAR ESTADO FÍSICO (¿Está fuera de rango?)
-                    out_of_max = tag.max_value is not None and val > tag.max_value
-                    out_of_min = tag.min_value is not None and val < tag.min_value
-                    
-                    is_physically_out = out_of_max or out_of_min
-                    
-                    # 2. EVALUAR RETORNO A NORMALIDAD (Aplicando Histeresis)
-                    h = tag.hysteresis or 0.0
-                    is_back_to_normal = False
-                    if tag.max_value is not None and val <= (tag.max_value - h):
-                        is_back_to_normal = True
-                    elif tag.min_value is not None and val >= (tag.min_value + h):
-                        is_back_to_normal = True
-                    elif tag.max_value is None and tag.min_value is None:
-                        is_back_to_normal = True
-
-                    # Buscar alerta activa
-                    active_alert = db.query(models.Alert).filter(
-                        models.Alert.tag_id == tag.id,
-                        models.Alert.status.in_(["ACTIVE", "ACKNOWLEDGED"])
-                    ).first()
-
-                    now = time.time()
-
-                    if is_physically_out:
-                        # Si no hay alerta activa, verificar delay
-                        if not active_alert:
-                            if tag.id not in on_publish_received.error_start_times:
-                                on_publish_received.error_start_times[tag.id] = now
-                            
-                            elapsed = now - on_publish_received.error_start_times[tag.id]
-                            delay_needed = tag.alert_delay or 0
-                            
-                            if elapsed >= delay_needed:
-                                # DISPARAR ALERTA
-                                limit_hit = tag.max_value if out_of_max else tag.min_value
-                                severity = "WARNING"
-                                if out_of_max and val > (tag.max_value * 1.2): severity = "CRITICAL"
-                                elif out_of_min and val < (tag.min_value * 0.8): severity = "CRITICAL"
-
-                                new_alert = models.Alert(
-                                    device_id=device.id,
-                                    tag_id=tag.id,
-                                    severity=severity,
-                                    title=f"Límite Excedido: {tag.display_name or tag.mqtt_key}",
-                                    message=f"Valor fuera de rango por {int(elapsed)}s. Detectado: {val} {tag.unit or ''}",
-                                    value_detected=val,
-                                    limit_value=limit_hit,
-                                    breach_started_at=datetime.fromtimestamp(on_publish_received.error_start_times[tag.id])
-                                )
-                                db.add(new_alert)
-                                db.commit()
-                                # Limpiar tracker ya que se convirtió en alerta
-                                if tag.id in on_publish_received.error_start_times:
-                                    del on_publish_received.error_start_times[tag.id]
-                    else:
-                        # Si está en rango normal o en zona de histeresis
-                        # Limpiar el tracker de tiempo si el valor ya no es "erróneo"
-                        if not is_physically_out and tag.id in on_publish_received.error_start_times:
-                            del on_publish_received.error_start_times[tag.id]
-
-                        # REVISAR SI DEBEMOS CERRAR ALERTA (Solo si superó la histeresis)
-                        if is_back_to_normal and active_alert:
-                            active_alert.status = "CLEARED"
-                            db.commit()
-
-                db.close()
+                for sample_ts, sample in samples:
+                    if device.history_enabled:
+                        # Deadband + swinging door por tag (si está configurado);
+                        # el escritor agrupa filas y las vuelca en un solo commit
+                        for row_ts, row in historian_compressor.compress(
+                                device.id, str(device_id), subtopic_path, sample_ts, sample):
+                            telemetry_writer.add(str(device_id), row, subtopic_path, row_ts)
+
+                    # --- MONITOREO DE ALERTAS AVANZADO (Triggering Engine v2) ---
+                    # Solo los tags con regla de esta rama presentes en el payload;
+                    # el estado vive en memoria y se persiste en diferido.
+                    # Cada muestra se evalúa con su propio ts para respetar los delays
+                    alarm_engine.evaluate(device.id, subtopic_path, sample, now=sample_ts)
             except Exception as db_err:
-                print(f"❌ [DB ERROR] No se pudo guardar histórico: {db_err}")
+                logger.error(f"❌ [DB ERROR] No se pudo guardar histórico: {db_err}")
 
         except Exception as e:
-            print(f"❌ [BRIDGE ERROR] Fallo al procesar mensaje: {e}")
-
-    def on_lifecycle_connection_success(lifecycle_connect_success_data):
-        print(f"\n✅ [MQTT5 CONNECTED] AWS IoT Core")
-        print(f"📡 ESCUCHANDO ÁRBOL: {TOPIC_FILTER}")
-        
-        client.subscribe(subscribe_packet=mqtt5.SubscribePacket(
-            subscriptions=[mqtt5.Subscription(topic_filter=TOPIC_FILTER, qos=mqtt5.QoS.AT_LEAST_ONCE)]
-        ))
-
-    # --- CONFIGURACIÓN CLIENTE ---
-    credentials_provider = auth.AwsCredentialsProvider.new_default_chain()
-    client = mqtt5_client_builder.websockets_with_default_aws_signing(
-        endpoint=ENDPOINT,
-        region="us-east-1",
-        credentials_provider=credentials_provider,
-        on_publish_received=on_publish_received,
-        on_lifecycle_connection_success=on_lifecycle_connection_success,
-        client_id=f"Synteck-Bridge-{device_id}"
-    )
-
-    client.start()
-    return client
\ No newline at end of file
+            logger.error(f"❌ [BRIDGE ERROR] Fallo al procesar mensaje de {actual_topic}: {e}")
+
+
+# Instancia única del servicio de ingesta
+ingest_service = MqttIngestService(pool_size=settings.mqtt_pool_size)
+
+
+def start_mqtt_bridge(ws_manager, partner_id, client_id, plant_id, device_id, metadata=None):
+    """
+    Registra el equipo en el pool de ingesta compartido. Se mantiene la firma
+    original: devuelve un handle con `.stop()` que solo retira la suscripción.
+    """
+    ingest_service.start(ws_manager)
+    return ingest_service.subscribe_devices([{
+        "partner_id": partner_id,
+        "client_id": client_id,
+        "plant_id": plant_id,
+        "device_id": device_id,
+        "metadata": metadata
+    }])[0]
@@ -0,0 +1,260 @@
+import json
+from datetime import date, datetime, time as dt_time, timezone
+from decimal import Decimal
+
+# Backends opcionales: se usan si están instalados
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+FORMAT_CBOR = "cbor"
+FORMAT_AUTO = "auto"
+PAYLOAD_FORMATS = (FORMAT_JSON, FORMAT_MSGPACK, FORMAT_CBOR, FORMAT_AUTO)
+
+
+class PayloadDecodeError(ValueError):
+    pass
+
+
+# --- DECODIFICADORES (directo desde bytes / memoryview, sin .decode('utf-8')) ---
+if orjson is not None:
+    def _decode_json(data):
+        return orjson.loads(data)
+else:
+    def _decode_json(data):
+        return json.loads(data if isinstance(data, (bytes, bytearray)) else bytes(data))
+
+
+def _decode_msgpack(data):
+    if msgpack is None:
+        raise PayloadDecodeError("msgpack no está instalado")
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+def _decode_cbor(data):
+    if cbor2 is None:
+        raise PayloadDecodeError("cbor2 no está instalado")
+    return cbor2.loads(data)
+
+
+def _decode_auto(data):
+    """Detecta el formato por el primer byte (JSON texto vs. binario)."""
+    view = memoryview(data)
+    for byte in view[:16]:
+        if byte in b" \t\r\n":
+            continue
+        if byte in b"{[":
+            return _decode_json(data)
+        break
+    # Binario: intentamos msgpack y luego CBOR
+    for decoder in (_decode_msgpack, _decode_cbor):
+        try:
+            return decoder(data)
+        except Exception:
+            continue
+    raise PayloadDecodeError("Formato de payload no reconocido")
+
+
+DECODERS = {
+    FORMAT_JSON: _decode_json,
+    FORMAT_MSGPACK: _decode_msgpack,
+    FORMAT_CBOR: _decode_cbor,
+    FORMAT_AUTO: _decode_auto,
+}
+
+
+def decode_payload(data, payload_format=FORMAT_JSON):
+    """Parsea el payload crudo con el decodificador configurado para el equipo."""
+    decoder = DECODERS.get(payload_format or FORMAT_JSON, _decode_auto)
+    return decoder(data)
+
+
+# --- NORMALIZACIÓN EN UNA SOLA PASADA ---
+def _normalize(node):
+    """Desenvuelve listas [0] y redondea floats a 2 decimales en el mismo recorrido."""
+    while type(node) is list:
+        if not node:
+            return None
+        node = node[0]
+    t = type(node)
+    if t is float:
+        return round(node, 2)
+    if t is dict:
+        return _normalize_dict(node)
+    if t is int or t is str or t is bool or node is None:
+        return node
+    return _json_safe(node)
+
+
+def _json_safe(value):
+    """
+    Escalares que msgpack/CBOR pueden traer y JSON no (bytes, fechas,
+    decimales, tags CBOR, ...) a su equivalente JSON: las filas de
+    `telemetry_logs` y el spool se serializan como JSON.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    if isinstance(value, (date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return bool(value)
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, (float, Decimal)):
+        return round(float(value), 2)
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, (tuple, set, frozenset)):
+        return _normalize(list(value))
+    if cbor2 is not None and isinstance(value, cbor2.CBORTag):
+        return _normalize(value.value)
+    return str(value)
+
+
+def _normalize_dict(node):
+    out = {}
+    for k, v in node.items():
+        if type(k) is not str:
+            # msgpack/CBOR admiten llaves no texto (strict_map_key=False)
+            k = k.decode("utf-8", "replace") if isinstance(k, (bytes, bytearray)) else str(k)
+        t = type(v)
+        if t is float:
+            out[k] = round(v, 2)
+        elif t is int or t is str or t is bool or v is None:
+            out[k] = v
+        else:
+            out[k] = _normalize(v)
+    return out
+
+
+def extract_values(payload):
+    """Buscamos en 'values', 'd' o raíz (según lo que mande la HMI)."""
+    if type(payload) is dict:
+        if 'values' in payload:
+            return payload['values']
+        if 'd' in payload:
+            return payload['d']
+    return payload
+
+
+def normalize_telemetry(payload):
+    """Extracción de llaves + aplanado + redondeo en un solo recorrido."""
+    return _normalize(extract_values(payload))
+
+
+# --- PAYLOADS MULTI-MUESTRA (gateways que acumulan N lecturas por mensaje) ---
+MAX_CLOCK_SKEW = 7 * 86400  # Segundos que un ts del equipo puede alejarse de la recepción
+
+
+def _parse_epoch(ts):
+    """Timestamp de muestra a epoch en segundos (acepta s, ms o ISO-8601)."""
+    if isinstance(ts, bool):
+        return None
+    if isinstance(ts, (int, float)):
+        # Epoch en milisegundos (> año 5138 en segundos)
+        return ts / 1000.0 if ts > 1e11 else float(ts)
+    if isinstance(ts, str):
+        try:
+            dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            return dt.timestamp()
+        except (ValueError, OverflowError, OSError):
+            return None
+    return None
+
+
+def _to_epoch(ts, recv_ts, max_skew):
+    """
+    Epoch de la muestra o `recv_ts` si no se entiende o cae fuera de
+    ±`max_skew` de la recepción (reloj del equipo sin hora, año 9999...):
+    así ningún ts revienta después en `datetime.fromtimestamp`.
+    """
+    epoch = _parse_epoch(ts)
+    # `not <=` también descarta NaN e infinito
+    if epoch is None or not abs(epoch - recv_ts) <= max_skew:
+        return recv_ts
+    return epoch
+
+
+def _sample_at(node, i):
+    """Valor de la muestra `i` en un nodo columnar (listas alineadas con 'ts')."""
+    if type(node) is list:
+        return _normalize(node[i]) if i < len(node) else None
+    if type(node) is dict:
+        return {k: _sample_at(v, i) for k, v in node.items()}
+    return _normalize(node)
+
+
+def _drop_missing(telemetry):
+    if type(telemetry) is dict:
+        return {k: v for k, v in telemetry.items() if v is not None}
+    return telemetry
+
+
+def expand_samples(payload, recv_ts, max_skew=MAX_CLOCK_SKEW):
+    """
+    Expande el payload a una lista `[(ts, telemetry), ...]` ordenada por ts.
+
+    Formatos aceptados:
+      - Lista de muestras:   [{"ts": t1, "values": {...}}, {"ts": t2, ...}]
+      - Objeto con lista:    {"samples": [{"ts": t1, "values": {...}}, ...]}
+      - Columnar:            {"ts": [t1, t2], "values": {"temp": [20.1, 20.3]}}
+      - Muestra única:       {"ts": t, "values": {...}}  (o ts junto a las llaves)
+
+    Cualquier otro payload es una sola muestra con el timestamp del
+    servidor y conserva el aplanado clásico de listas a `[0]`. Un ts
+    ilegible o a más de `max_skew` segundos de `recv_ts` se reemplaza por
+    `recv_ts`.
+    """
+    samples = None
+    if type(payload) is list and payload and all(type(s) is dict and 'ts' in s for s in payload):
+        samples = payload
+    elif type(payload) is dict and type(payload.get('samples')) is list:
+        samples = [s for s in payload['samples'] if type(s) is dict]
+
+    if samples is not None:
+        out = []
+        for sample in samples:
+            ts = _to_epoch(sample.get('ts'), recv_ts, max_skew)
+            if 'values' in sample or 'd' in sample:
+                values = sample
+            else:
+                values = {k: v for k, v in sample.items() if k != 'ts'}
+            out.append((ts, normalize_telemetry(values)))
+        out.sort(key=lambda s: s[0])
+        return out
+
+    if type(payload) is dict and type(payload.get('ts')) is list:
+        stamps = payload['ts']
+        values = extract_values({k: v for k, v in payload.items() if k != 'ts'})
+        out = []
+        for i, raw_ts in enumerate(stamps):
+            ts = _to_epoch(raw_ts, recv_ts, max_skew)
+            out.append((ts, _drop_missing(_sample_at(values, i))))
+        out.sort(key=lambda s: s[0])
+        return out
+
+    if type(payload) is dict and _parse_epoch(payload.get('ts')) is not None:
+        # Muestra única con ts del equipo: el ts no es una medición
+        values = {k: v for k, v in payload.items() if k != 'ts'}
+        return [(_to_epoch(payload['ts'], recv_ts, max_skew), normalize_telemetry(values))]
+
+    return [(recv_ts, normalize_telemetry(payload))]
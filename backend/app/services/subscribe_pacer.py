@@ -0,0 +1,144 @@
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class SubscribePacer:
+    """
+    Cola de SUBSCRIBE de una conexión del pool MQTT.
+
+    Un hilo por conexión arma paquetes de hasta `batch_size` filtros y los
+    envía a ritmo fijo (`rate` paquetes/s) con a lo sumo `inflight`
+    paquetes esperando SUBACK. Así el arranque con miles de equipos no
+    dispara el throttling de AWS IoT y cada SUBACK marca a su equipo como
+    listo (`on_result(filters, ok_flags, error)`).
+
+    `send(filters)` debe devolver un Future (awscrt) con el SUBACK. Si el
+    envío falla (no un rechazo del broker) los filtros vuelven a la cola.
+    Mientras la conexión está caída la cola se pausa.
+
+    `wanted(filter)` (opcional) dice si el filtro sigue haciendo falta: los
+    que se dieron de baja mientras esperaban turno no se envían.
+    """
+    def __init__(self, name, send, on_result, rate=20.0, inflight=4, batch_size=8, wanted=None):
+        self.name = name
+        self.send = send
+        self.on_result = on_result
+        self.wanted = wanted
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.batch_size = batch_size
+        self.pending = deque()
+        self.packets = 0
+        self.retries = 0
+        self.skipped = 0
+        self._inflight = threading.BoundedSemaphore(max(1, inflight))
+        self._cond = threading.Condition()
+        self._paused = True
+        self._running = False
+        self._thread = None
+
+    # --- CICLO DE VIDA ---
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"subscribe-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self.pending.clear()
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def resume(self, filters=()):
+        """Conexión (re)establecida: se vuelve a suscribir todo lo de esta conexión."""
+        with self._cond:
+            self.pending = deque(filters)
+            self._paused = False
+            self._cond.notify()
+
+    def pause(self):
+        with self._cond:
+            self._paused = True
+
+    def enqueue(self, filters):
+        with self._cond:
+            self.pending.extend(filters)
+            self._cond.notify()
+
+    def discard(self, filters):
+        """Saca de la cola los filtros dados de baja (los que `wanted` ya no reconoce)."""
+        filters = set(filters)
+        with self._cond:
+            if not self.pending or not filters:
+                return
+            kept = deque(f for f in self.pending if f not in filters or (self.wanted is not None and self.wanted(f)))
+            self.skipped += len(self.pending) - len(kept)
+            self.pending = kept
+
+    # --- ENVÍO ---
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and (self._paused or not self.pending):
+                    self._cond.wait()
+                if not self._running:
+                    return
+                batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+            if self.wanted is not None:
+                wanted = [f for f in batch if self.wanted(f)]
+                self.skipped += len(batch) - len(wanted)
+                batch = wanted
+                if not batch:
+                    continue
+
+            # Tope de SUBSCRIBE sin SUBACK (se revisa `_running` para no colgar el apagado)
+            while not self._inflight.acquire(timeout=1.0):
+                if not self._running:
+                    return
+            try:
+                future = self.send(batch)
+            except Exception as e:
+                self._inflight.release()
+                self._retry(batch, e)
+            else:
+                self.packets += 1
+                future.add_done_callback(lambda f, b=batch: self._done(b, f))
+
+            if self.interval:
+                with self._cond:
+                    self._cond.wait(self.interval)
+
+    def _done(self, batch, future):
+        self._inflight.release()
+        try:
+            suback = future.result()
+        except Exception as e:
+            self._retry(batch, e)
+            return
+        # Códigos < 128: QoS concedido; >= 128: rechazo del broker (p. ej. sin autorización)
+        ok = [int(code) < 128 for code in (suback.reason_codes or [])]
+        ok += [False] * (len(batch) - len(ok))
+        self.on_result(batch, ok, None)
+
+    def _retry(self, batch, error):
+        self.retries += 1
+        logger.warning(f"⚠️ [Subscribe] {self.name}: {len(batch)} filtro(s) se reintentan: {error}")
+        self.on_result(batch, None, error)
+        with self._cond:
+            if self._running:
+                self.pending.extend(batch)
+                self._cond.notify()
+
+    def stats(self):
+        return {
+            "pending": len(self.pending), "packets": self.packets,
+            "retries": self.retries, "skipped": self.skipped
+        }
@@ -0,0 +1,288 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import struct
+import time
+import zlib
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct(">II")  # [len(payload)][crc32(payload)]
+_SEGMENT = re.compile(r"^seg-(\d{12})\.wal$")
+_CURSOR = "cursor"
+_LOCK = "lock"
+
+
+class TelemetrySpool:
+    """
+    Write-ahead log local de filas de `telemetry_logs` para cuando la base
+    no responde o se atrasa.
+
+    El spool es una secuencia de segmentos append-only
+    (`seg-000000000001.wal`, ...) de hasta `segment_bytes`. Cada registro
+    es un lote completo: [len][crc32][json de filas]. El cursor de
+    reproducción (segmento, offset) se guarda en el archivo `cursor` de
+    forma atómica después de cada lote confirmado en la base; un segmento
+    leído por completo se borra. Tras un corte se relee desde el cursor
+    (entrega al menos una vez: el último lote puede repetirse).
+
+    fsync agrupado: a lo sumo uno cada `fsync_interval` segundos (y al
+    rotar o cerrar), así un corte de energía pierde como mucho ese tramo.
+    Si el spool supera `max_bytes` se descarta el segmento más viejo.
+
+    Un solo proceso a la vez: `open()` toma un flock exclusivo sobre
+    `<directorio>/lock` y falla (BlockingIOError) si otro worker ya tiene
+    el spool; el SO lo suelta si el proceso muere. Dentro del proceso lo
+    usa un solo hilo (el del telemetry writer).
+    """
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024,
+                 max_bytes=2 * 1024 * 1024 * 1024, fsync_interval=1.0):
+        self.directory = directory
+        self.segment_bytes = max(1024, segment_bytes)
+        self.max_bytes = max(self.segment_bytes, max_bytes)
+        self.fsync_interval = fsync_interval
+        self.segments = {}        # { seq: tamaño en bytes }
+        self.read_seq = None
+        self.read_pos = 0
+        self.write_seq = 0
+        self._file = None
+        self._lock_fd = None
+        self._last_fsync = 0.0
+        self._dirty = False
+
+        # Contadores
+        self.rows_spooled = 0
+        self.rows_replayed = 0
+        self.dropped_segments = 0
+        self.dropped_bytes = 0
+        self.corrupt_records = 0
+        self.rejected_rows = 0
+
+    # --- CICLO DE VIDA ---
+    def open(self):
+        """Toma el lock del directorio y recupera los segmentos y el cursor que quedaron en disco."""
+        if self._file is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, _LOCK), os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise  # Otro proceso tiene el spool
+        self._lock_fd = fd
+        try:
+            self._recover()
+        except OSError:
+            self._unlock()
+            raise
+
+    def _recover(self):
+        """Segmentos y cursor en disco (con el lock ya tomado)."""
+        self.segments = {}
+        for name in os.listdir(self.directory):
+            match = _SEGMENT.match(name)
+            if match:
+                self.segments[int(match.group(1))] = os.path.getsize(os.path.join(self.directory, name))
+        self.read_seq, self.read_pos = self._load_cursor()
+        # Nunca se escribe sobre un segmento viejo (su cola pudo quedar cortada)
+        self.write_seq = max(self.segments, default=0) + 1
+        self._open_segment()
+        if self.pending_bytes:
+            logger.warning(
+                f"💾 [Spool] {len(self.segments) - 1} segmento(s) pendientes de reproducir "
+                f"({self.pending_bytes / 1e6:.1f} MB) en {self.directory}"
+            )
+
+    def close(self):
+        if self._file is None:
+            return
+        self._sync(force=True)
+        self._file.close()
+        self._file = None
+        # Segmento activo vacío: no se deja basura en disco
+        if self.segments.get(self.write_seq) == 0:
+            self._remove(self.write_seq)
+        self._unlock()
+
+    def _unlock(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # Cerrar el descriptor suelta el flock
+            self._lock_fd = None
+
+    # --- ESCRITURA ---
+    @staticmethod
+    def _encode(row):
+        return json.dumps(
+            [row["device_uid"], row["timestamp"].timestamp(), row["data"], row["path"]],
+            separators=(",", ":")
+        )
+
+    def append(self, rows):
+        """
+        Agrega un lote al final del spool. Una fila que no se puede
+        serializar a JSON se descarta (y se cuenta) sin perder el resto.
+        Devuelve cuántas filas se escribieron.
+        """
+        encoded = []
+        for row in rows:
+            try:
+                encoded.append(self._encode(row))
+            except (TypeError, ValueError) as e:
+                self.rejected_rows += 1
+                logger.error(f"❌ [Spool] Fila de {row.get('device_uid')} no serializable, se descarta: {e}")
+        if not encoded:
+            return 0
+        payload = ("[" + ",".join(encoded) + "]").encode("utf-8")
+        if self.segments[self.write_seq] and self.segments[self.write_seq] + len(payload) > self.segment_bytes:
+            self._rotate()
+        self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+        # Al SO en cada lote (lectura inmediata); al disco según la política de fsync
+        self._file.flush()
+        self.segments[self.write_seq] += _HEADER.size + len(payload)
+        self.rows_spooled += len(encoded)
+        self._dirty = True
+        self._sync()
+        self._enforce_limit()
+        return len(encoded)
+
+    def _rotate(self):
+        self._sync(force=True)
+        self._file.close()
+        self.write_seq += 1
+        self._open_segment()
+
+    def _open_segment(self):
+        self._file = open(self._path(self.write_seq), "ab")
+        self.segments.setdefault(self.write_seq, 0)
+        if self.read_seq is None or self.read_seq not in self.segments:
+            self.read_seq, self.read_pos = min(self.segments), 0
+
+    def _sync(self, force=False):
+        if not self._dirty:
+            return
+        now = time.monotonic()
+        if force or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+            self._dirty = False
+
+    def _enforce_limit(self):
+        while self.total_bytes > self.max_bytes and len(self.segments) > 1:
+            oldest = min(self.segments)
+            size = self.segments[oldest]
+            self.dropped_segments += 1
+            self.dropped_bytes += size
+            logger.error(
+                f"❌ [Spool] Límite de {self.max_bytes / 1e6:.0f} MB superado: "
+                f"se descarta el segmento {oldest} ({size / 1e6:.1f} MB de históricos)"
+            )
+            self._remove(oldest)
+            if self.read_seq == oldest:
+                self.read_seq, self.read_pos = min(self.segments), 0
+                self._save_cursor()
+
+    # --- REPRODUCCIÓN ---
+    def peek(self):
+        """
+        Siguiente lote pendiente como filas listas para insertar, o None.
+        No avanza el cursor: se confirma con `commit()` una vez escrito.
+        """
+        while self.pending_bytes:
+            if self.read_pos >= self.segments[self.read_seq]:
+                self._advance_segment()
+                continue
+            with open(self._path(self.read_seq), "rb") as fh:
+                fh.seek(self.read_pos)
+                header = fh.read(_HEADER.size)
+                length, crc = _HEADER.unpack(header) if len(header) == _HEADER.size else (0, None)
+                payload = fh.read(length) if crc is not None else b""
+            if crc is None or len(payload) != length or zlib.crc32(payload) != crc:
+                # Cola cortada por un corte de energía: el resto del segmento no es legible
+                self.corrupt_records += 1
+                logger.error(f"❌ [Spool] Registro corrupto en el segmento {self.read_seq} (offset {self.read_pos}); se salta")
+                self.read_pos = self.segments[self.read_seq]
+                continue
+            rows = [
+                {
+                    "device_uid": device_uid,
+                    "timestamp": datetime.fromtimestamp(ts, timezone.utc),
+                    "data": data,
+                    "path": path
+                }
+                for device_uid, ts, data, path in json.loads(payload)
+            ]
+            return rows, self.read_pos + _HEADER.size + length
+        return None
+
+    def commit(self, position, rows):
+        """El lote de `peek()` ya está en la base: se avanza y persiste el cursor."""
+        self.read_pos = position
+        self.rows_replayed += rows
+        if self.read_pos >= self.segments[self.read_seq] and self.read_seq != self.write_seq:
+            self._advance_segment()
+        else:
+            self._save_cursor()
+
+    def _advance_segment(self):
+        """Segmento leído completo: se borra (salvo el activo) y se pasa al siguiente."""
+        if self.read_seq == self.write_seq:
+            return
+        self._remove(self.read_seq)
+        self.read_seq, self.read_pos = min(self.segments), 0
+        self._save_cursor()
+
+    # --- CURSOR ---
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, _CURSOR)) as fh:
+                seq, pos = json.load(fh)
+            if seq in self.segments:
+                return seq, pos
+        except (OSError, ValueError, TypeError):
+            pass
+        return (min(self.segments), 0) if self.segments else (None, 0)
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, _CURSOR)
+        with open(path + ".tmp", "w") as fh:
+            json.dump([self.read_seq, self.read_pos], fh)
+        os.replace(path + ".tmp", path)
+
+    # --- UTILIDADES ---
+    def _path(self, seq):
+        return os.path.join(self.directory, f"seg-{seq:012d}.wal")
+
+    def _remove(self, seq):
+        self.segments.pop(seq, None)
+        try:
+            os.remove(self._path(seq))
+        except OSError:
+            pass
+
+    @property
+    def total_bytes(self):
+        return sum(list(self.segments.values()))
+
+    @property
+    def pending_bytes(self):
+        if self._file is None or self.read_seq is None:
+            return 0
+        return sum(size for seq, size in list(self.segments.items()) if seq >= self.read_seq) - self.read_pos
+
+    def stats(self):
+        return {
+            "segments": len(self.segments),
+            "disk_bytes": self.total_bytes,
+            "pending_bytes": self.pending_bytes,
+            "rows_spooled": self.rows_spooled,
+            "rows_replayed": self.rows_replayed,
+            "dropped_segments": self.dropped_segments,
+            "dropped_bytes": self.dropped_bytes,
+            "corrupt_records": self.corrupt_records,
+            "rejected_rows": self.rejected_rows
+        }
@@ -0,0 +1,391 @@
+import csv
+import io
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, DataError, DBAPIError, StatementError
+from app.database import engine
+from app import models
+from app.config import settings
+from app.services.telemetry_spool import TelemetrySpool
+
+# COPY va por la conexión psycopg2 cruda: sus errores no llegan envueltos por SQLAlchemy
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+# Errores que se repiten con las mismas filas (FK, tipos, valores fuera de rango, JSON inválido):
+# reintentarlos no sirve, se aíslan las filas culpables
+PERMANENT_ERRORS = (IntegrityError, DataError, TypeError, ValueError)
+if psycopg2 is not None:
+    PERMANENT_ERRORS += (psycopg2.IntegrityError, psycopg2.DataError)
+
+
+def is_permanent(exc):
+    """¿Repetir el lote daría el mismo error? (también un JSON inválido envuelto por SQLAlchemy)"""
+    if isinstance(exc, PERMANENT_ERRORS):
+        return True
+    return (
+        isinstance(exc, StatementError) and not isinstance(exc, DBAPIError)
+        and isinstance(exc.orig, (TypeError, ValueError))
+    )
+
+
+class WriteInterrupted(Exception):
+    """La base falló (error transitorio) a mitad de un lote; `rows` son las filas aún sin escribir."""
+    def __init__(self, rows, cause):
+        super().__init__(str(cause))
+        self.rows = rows
+        self.cause = cause
+
+
+class TelemetryWriter:
+    """
+    Escritor por lotes (group commit) para `telemetry_logs`.
+
+    Los workers de ingesta solo agregan filas a un buffer en memoria; un hilo
+    dedicado las vuelca en UNA transacción cuando el lote llega a
+    `batch_size` filas o cuando la fila más vieja supera `max_age` segundos.
+    En PostgreSQL se usa COPY; en otros motores un INSERT multi-fila
+    (executemany).
+
+    Con `spool` (WAL local) un lote que la base rechaza, o cuyas filas
+    esperaron más de `spool_lag` segundos en memoria, se escribe en disco
+    en vez de perderse. Tras un error la base se reintenta cada
+    `retry_interval` segundos; cuando responde, el spool se reproduce en
+    orden, un lote completo por vuelta, intercalado con los lotes en vivo
+    (que tienen prioridad).
+
+    Un lote que falla por un error permanente (`PERMANENT_ERRORS`) no
+    marca la base como caída: se bisecta hasta aislar las filas culpables,
+    que se descartan y cuentan en `rejected_rows`; el resto se escribe.
+
+    El spool es uno por host y solo lo tiene el proceso que ingesta:
+    `enable_spool()` / `disable_spool()` se llaman al ganar o perder el
+    liderazgo y el hilo de escritura lo abre o cierra en su propia vuelta.
+    Si el lock del directorio lo tiene todavía otro worker (el líder
+    anterior apagándose) se reintenta cada `retry_interval` segundos.
+    """
+    COLUMNS = ("device_uid", "timestamp", "data", "path")
+
+    def __init__(self, batch_size=5000, max_age=0.25, spool=None, spool_lag=10.0, retry_interval=5.0):
+        self.batch_size = max(1, batch_size)
+        self.max_age = max_age
+        self.spool_store = spool   # Spool configurado (None = deshabilitado)
+        self.spool = None          # Spool abierto por este proceso
+        self.spool_lag = spool_lag
+        self.retry_interval = retry_interval
+        self._buffer = []
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._db_down_until = 0.0
+        self._spool_wanted = False
+        self._spool_retry_at = 0.0
+
+        # Contadores
+        self.rows_written = 0
+        self.batches = 0
+        self.failed_rows = 0
+        self.rejected_rows = 0
+        self.spooled_rows = 0
+        self.last_flush_ms = 0.0
+
+    # --- CICLO DE VIDA ---
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """Detiene el hilo vaciando primero todo lo pendiente."""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify()
+        thread, self._thread = self._thread, None
+        thread.join(timeout)
+        if self.spool is not None and not thread.is_alive():
+            # Lo que quede pendiente lo reproduce el próximo proceso que tome el spool
+            self.spool.close()
+            self.spool = None
+
+    def enable_spool(self):
+        """Este proceso pasa a ingestar: el hilo de escritura toma el spool."""
+        if self.spool_store is None:
+            return
+        with self._cond:
+            self._spool_wanted = True
+            self._spool_retry_at = 0.0
+            self._cond.notify()
+        if not self._running:
+            self.start()
+
+    def disable_spool(self):
+        """Se perdió el liderazgo: se suelta el spool para el nuevo líder."""
+        with self._cond:
+            self._spool_wanted = False
+            self._cond.notify()
+
+    # --- ENTRADA ---
+    def add(self, device_uid, data, path, ts=None):
+        """Encola una fila. `ts` es epoch en segundos (por defecto: ahora)."""
+        row = {
+            "device_uid": device_uid,
+            "timestamp": datetime.fromtimestamp(ts if ts is not None else time.time(), timezone.utc),
+            "data": data,
+            "path": path
+        }
+        with self._cond:
+            if not self._buffer:
+                # Primera fila del lote: el hilo (dormido sin plazo) arma el de `max_age`
+                self._oldest = time.monotonic()
+                self._cond.notify()
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        if not self._running:
+            self.start()
+
+    # --- HILO DE ESCRITURA ---
+    def _run(self):
+        while True:
+            self._sync_spool()
+            with self._cond:
+                while self._running:
+                    if len(self._buffer) >= self.batch_size or self._spool_pending():
+                        break
+                    timeout = self._replay_in()
+                    if self._spool_wanted and self.spool is None:
+                        retry = max(0.0, self._spool_retry_at - time.monotonic())
+                        timeout = retry if timeout is None else min(timeout, retry)
+                    if timeout == 0:
+                        break
+                    if self._buffer:
+                        remaining = self.max_age - (time.monotonic() - self._oldest)
+                        if remaining <= 0:
+                            break
+                        timeout = remaining if timeout is None else min(timeout, remaining)
+                    self._cond.wait(timeout)
+                age = time.monotonic() - self._oldest if self._buffer else 0.0
+                running = self._running
+                # Puede haber despertado solo para reproducir el spool: el lote en vivo espera su turno
+                if not running or len(self._buffer) >= self.batch_size or age >= self.max_age:
+                    batch, self._buffer = self._buffer, []
+                else:
+                    batch = []
+
+            if batch:
+                self._flush(batch, lagging=age > self.spool_lag)
+            if not running:
+                # Apagado: vaciar lo que haya llegado mientras escribíamos
+                with self._cond:
+                    batch, self._buffer = self._buffer, []
+                if batch:
+                    self._flush(batch)
+                return
+            self._replay()
+
+    def _flush(self, rows, lagging=False):
+        if self.spool is not None and (lagging or time.monotonic() < self._db_down_until):
+            # Base caída (en espera de reintento) o atrasada: directo al disco
+            self._spool(rows)
+            return
+        try:
+            self._write_checked(rows)
+        except WriteInterrupted as interrupted:
+            rows, db_err = interrupted.rows, interrupted.cause
+            if self.spool is None:
+                self.failed_rows += len(rows)
+                logger.error(f"❌ [DB ERROR] No se pudo guardar histórico ({len(rows)} filas): {db_err}")
+                return
+            self._db_down_until = time.monotonic() + self.retry_interval
+            logger.warning(f"⚠️ [DB ERROR] No se pudo guardar histórico ({len(rows)} filas), van al spool local: {db_err}")
+            self._spool(rows)
+
+    def _write_checked(self, rows):
+        """
+        Escribe el lote; ante un error permanente lo parte en mitades hasta
+        dejar solo las filas malas (se descartan). Un error transitorio
+        corta con `WriteInterrupted` y las filas que faltaban.
+        """
+        stack = [rows]
+        while stack:
+            part = stack.pop()
+            try:
+                self._write(part)
+            except Exception as db_err:
+                if not is_permanent(db_err):
+                    raise WriteInterrupted(part + [row for pending in reversed(stack) for row in pending], db_err)
+                if len(part) == 1:
+                    self.rejected_rows += 1
+                    logger.error(
+                        f"❌ [DB ERROR] Fila de histórico rechazada ({part[0].get('device_uid')}, "
+                        f"{part[0].get('path')}), se descarta: {db_err}"
+                    )
+                    continue
+                middle = len(part) // 2
+                stack.append(part[middle:])
+                stack.append(part[:middle])
+
+    def _write(self, rows):
+        started = time.perf_counter()
+        try:
+            if engine.dialect.name == "postgresql":
+                self._copy_rows(rows)
+            else:
+                with engine.begin() as conn:
+                    conn.execute(insert(models.TelemetryLog.__table__), rows)
+            self.rows_written += len(rows)
+            self.batches += 1
+        finally:
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    # --- SPOOL (WAL LOCAL) ---
+    def _spool_pending(self):
+        """¿Hay que abrir o cerrar el spool? (con `_cond` tomado)"""
+        if self.spool is not None:
+            return not self._spool_wanted
+        return self._spool_wanted and time.monotonic() >= self._spool_retry_at
+
+    def _sync_spool(self):
+        """Abre o cierra el spool según el rol del proceso (solo en el hilo de escritura)."""
+        with self._cond:
+            wanted = self._spool_wanted and self._running
+            if self.spool is None and (not wanted or time.monotonic() < self._spool_retry_at):
+                return
+            if self.spool is not None and wanted:
+                return
+            if not wanted:
+                # Lo que estaba en memoria sale con el spool todavía abierto
+                batch, self._buffer = self._buffer, []
+        if wanted:
+            try:
+                self.spool_store.open()
+            except OSError as e:
+                self._spool_retry_at = time.monotonic() + self.retry_interval
+                logger.warning(
+                    f"⚠️ [Spool] No se pudo tomar {self.spool_store.directory} ({e}); "
+                    f"se reintenta en {self.retry_interval:g}s"
+                )
+                return
+            self.spool = self.spool_store
+            logger.info(f"💾 [Spool] Spool local activo en {self.spool.directory}")
+            return
+        if batch:
+            self._flush(batch)
+        spool, self.spool = self.spool, None
+        try:
+            spool.close()
+        except OSError as e:
+            logger.error(f"❌ [Spool] Error cerrando {spool.directory}: {e}")
+        logger.info(f"💾 [Spool] Spool local liberado ({spool.directory})")
+
+    def _spool(self, rows):
+        try:
+            spooled = self.spool.append(rows)
+            self.spooled_rows += spooled
+            self.failed_rows += len(rows) - spooled
+        except OSError as e:
+            self.failed_rows += len(rows)
+            logger.error(f"❌ [Spool] No se pudo escribir en disco ({len(rows)} filas perdidas): {e}")
+
+    def _replay_in(self):
+        """Segundos hasta poder reproducir el spool (0 = ya; None = nada pendiente)."""
+        if self.spool is None or not self.spool.pending_bytes:
+            return None
+        return max(0.0, self._db_down_until - time.monotonic())
+
+    def _replay(self):
+        """Reproduce un lote del spool si la base está disponible."""
+        if self._replay_in() != 0:
+            return
+        try:
+            item = self.spool.peek()
+        except OSError as e:
+            self._db_down_until = time.monotonic() + self.retry_interval
+            logger.error(f"❌ [Spool] No se pudo leer el spool: {e}")
+            return
+        if item is None:
+            return
+        rows, position = item
+        try:
+            self._write_checked(rows)
+        except WriteInterrupted as interrupted:
+            db_err = interrupted.cause
+            # El cursor no avanza: el lote se repite entero (entrega al menos una vez)
+            self._db_down_until = time.monotonic() + self.retry_interval
+            logger.warning(f"⚠️ [Spool] La base aún no responde, se reintenta en {self.retry_interval:g}s: {db_err}")
+            return
+        self.spool.commit(position, len(rows))
+        if not self.spool.pending_bytes:
+            logger.info(f"✅ [Spool] Reproducción completa ({self.spool.rows_replayed} filas recuperadas)")
+
+    def _copy_rows(self, rows):
+        """Volcado con COPY ... FROM STDIN (CSV) sobre la conexión psycopg2."""
+        buf = io.StringIO()
+        writer = csv.writer(buf, quoting=csv.QUOTE_ALL)
+        for row in rows:
+            writer.writerow((
+                row["device_uid"],
+                row["timestamp"].isoformat(),
+                json.dumps(row["data"]),
+                row["path"]
+            ))
+        buf.seek(0)
+
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            cursor.copy_expert(
+                f"COPY {models.TelemetryLog.__tablename__} ({', '.join(self.COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buf
+            )
+            raw.commit()
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.close()
+
+    # --- MÉTRICAS ---
+    def stats(self):
+        with self._cond:
+            buffered = len(self._buffer)
+        return {
+            "buffered": buffered,
+            "rows_written": self.rows_written,
+            "batches": self.batches,
+            "failed_rows": self.failed_rows,
+            "rejected_rows": self.rejected_rows,
+            "spooled_rows": self.spooled_rows,
+            "db_down": time.monotonic() < self._db_down_until,
+            "spool": self.spool.stats() if self.spool is not None else None,
+            "last_flush_ms": round(self.last_flush_ms, 2)
+        }
+
+
+# Instancia única del escritor
+telemetry_writer = TelemetryWriter(
+    batch_size=settings.telemetry_batch_size,
+    max_age=settings.telemetry_flush_interval_ms / 1000,
+    spool=TelemetrySpool(
+        settings.telemetry_spool_dir,
+        segment_bytes=settings.telemetry_spool_segment_mb * 1024 * 1024,
+        max_bytes=settings.telemetry_spool_max_mb * 1024 * 1024,
+        fsync_interval=settings.telemetry_spool_fsync_s
+    ) if settings.telemetry_spool_enabled else None,
+    spool_lag=settings.telemetry_spool_lag_s,
+    retry_interval=settings.telemetry_spool_retry_s
+)
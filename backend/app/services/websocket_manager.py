@@ -1,31 +1,282 @@
+import asyncio
+import json
+import logging
 from fastapi import WebSocket
 from typing import Dict, List
+from app.config import settings
+from app.services.alarm_rules import normalize_path
+from app.services.last_values import last_values
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+
+
+def encode_message(message: dict, encoding: str = ENCODING_JSON):
+    """
+    Serializa una sola vez el mensaje que se reparte a los sockets: texto
+    JSON o bytes msgpack según lo negociado.
+    """
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.packb(message, use_bin_type=True)
+    if orjson is not None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def negotiate_encoding(websocket: WebSocket):
+    """
+    Codificación pedida por el cliente: subprotocolo `msgpack` en
+    Sec-WebSocket-Protocol o `?encoding=msgpack`. Devuelve
+    `(encoding, subprotocol_a_aceptar)`; sin msgpack instalado cae a JSON.
+    """
+    subprotocols = websocket.scope.get("subprotocols") or []
+    requested = websocket.query_params.get("encoding", ENCODING_JSON).lower()
+    subprotocol = ENCODING_MSGPACK if ENCODING_MSGPACK in subprotocols else None
+    if subprotocol or requested == ENCODING_MSGPACK:
+        if msgpack is not None:
+            return ENCODING_MSGPACK, subprotocol
+        logger.warning("⚠️ [WS] Cliente pidió msgpack pero no está instalado; se usa JSON")
+    return ENCODING_JSON, None
+
+
+class ClientConnection:
+    """
+    Un socket suscrito con su cola de salida acotada y su propia tarea de
+    envío: un navegador lento solo se atrasa a sí mismo.
+    """
+    def __init__(self, websocket: WebSocket, device_id: str, queue_size: int, encoding: str = ENCODING_JSON):
+        self.websocket = websocket
+        self.device_id = device_id
+        self.encoding = encoding
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+        self.sent = 0
+        # Filtro de suscripción (None = todo): ramas normalizadas y mqtt_keys
+        self.paths = None
+        self.keys = None
+        # Protocolo delta (opt-in): número de frame y último valor enviado por rama/llave
+        self.delta = False
+        self.seq = 0
+        self.last_sent = {}
+
+    def set_filter(self, paths=None, keys=None):
+        self.paths = frozenset(normalize_path(str(p)) for p in paths) if paths else None
+        self.keys = frozenset(str(k) for k in keys) if keys else None
+
+    @property
+    def filter_key(self):
+        return (self.paths, self.keys, self.encoding)
+
+    def project(self, message: dict):
+        """Recorta el mensaje a lo suscrito; None si no hay nada que enviarle."""
+        if self.paths is None and self.keys is None:
+            return message
+        metadata = message.get("metadata") or {}
+        if self.paths is not None and normalize_path(metadata.get("subtopic")) not in self.paths:
+            return None
+        telemetry = message.get("telemetry")
+        if self.keys is not None and type(telemetry) is dict:
+            telemetry = {k: v for k, v in telemetry.items() if k in self.keys}
+            if not telemetry:
+                return None
+            return {**message, "telemetry": telemetry}
+        return message
+
+    def delta_frame(self, message: dict):
+        """Frame con solo las llaves que cambiaron desde el último enviado a este socket."""
+        projected = self.project(message)
+        if projected is None:
+            return None
+        metadata = projected.get("metadata") or {}
+        telemetry = projected.get("telemetry")
+        if type(telemetry) is dict:
+            previous = self.last_sent.setdefault(metadata.get("subtopic"), {})
+            changed = {k: v for k, v in telemetry.items() if k not in previous or previous[k] != v}
+            if not changed:
+                return None
+            previous.update(changed)
+            telemetry = changed
+        self.seq += 1
+        return {"type": "delta", "seq": self.seq, "telemetry": telemetry, "metadata": metadata}
+
+    def snapshot_frame(self, values: dict, server_ts):
+        """Estado completo (filtrado) desde la caché de últimos valores; reinicia la base del delta."""
+        paths = {}
+        for path, entries in values.items():
+            if self.paths is not None and normalize_path(path) not in self.paths:
+                continue
+            branch = {k: e["value"] for k, e in entries.items() if self.keys is None or k in self.keys}
+            if branch:
+                paths[path] = branch
+        self.last_sent = {path: dict(branch) for path, branch in paths.items()}
+        self.seq += 1
+        return {
+            "type": "snapshot", "seq": self.seq, "device_id": self.device_id,
+            "server_ts": server_ts, "paths": paths
+        }
+
 
 class ConnectionManager:
-    def __init__(self):
-        # { "device_id": [ws1, ws2] }
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    def __init__(self, queue_size=32, send_timeout=5.0):
+        # { "device_id": [ClientConnection, ...] }
+        self.active_connections: Dict[str, List[ClientConnection]] = {}
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.evicted = 0
+        self.snapshots = 0
 
     async def connect(self, websocket: WebSocket, device_id: str):
-        await websocket.accept()
-        if device_id not in self.active_connections:
-            self.active_connections[device_id] = []
-        self.active_connections[device_id].append(websocket)
+        encoding, subprotocol = negotiate_encoding(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        conn = ClientConnection(websocket, device_id, self.queue_size, encoding)
+        conn.task = asyncio.create_task(self._sender(conn))
+        self.active_connections.setdefault(device_id, []).append(conn)
 
     def disconnect(self, websocket: WebSocket, device_id: str):
-        if device_id in self.active_connections:
-            if websocket in self.active_connections[device_id]:
-                self.active_connections[device_id].remove(websocket)
+        conns = self.active_connections.get(device_id)
+        if not conns:
+            return
+        for conn in conns[:]:
+            if conn.websocket is websocket:
+                self._remove(conn)
 
-    async def send_personal_message(self, message: dict, device_id: str):
-        if device_id in self.active_connections:
-            # Iteramos sobre una copia para evitar errores si alguien se desconecta
-            for connection in self.active_connections[device_id][:]:
+    def _find(self, websocket: WebSocket, device_id: str):
+        for conn in self.active_connections.get(device_id, []):
+            if conn.websocket is websocket:
+                return conn
+        return None
+
+    def subscribe(self, websocket: WebSocket, device_id: str, paths=None, keys=None, delta=False):
+        """
+        Cambia el filtro del socket; sin ramas ni llaves vuelve a recibir todo.
+        Con `delta` el socket recibe primero un snapshot y luego solo cambios.
+        """
+        conn = self._find(websocket, device_id)
+        if conn is None:
+            return None
+        conn.set_filter(paths, keys)
+        conn.delta = bool(delta)
+        conn.last_sent = {}
+        if conn.delta:
+            self.resync(websocket, device_id)
+        return conn
+
+    def resync(self, websocket: WebSocket, device_id: str):
+        """Reenvía el snapshot completo (el cliente detectó un hueco en `seq`)."""
+        conn = self._find(websocket, device_id)
+        if conn is None or not conn.delta:
+            return
+        values, updated_at = last_values.get(device_id)
+        self.snapshots += 1
+        self._enqueue(conn, encode_message(conn.snapshot_frame(values, updated_at), conn.encoding))
+
+    def _enqueue(self, conn: ClientConnection, frame):
+        try:
+            conn.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Cola llena: el navegador no consume al ritmo del envío
+            self.frames_dropped += 1
+            self._evict(conn, "cola de salida llena")
+
+    def _remove(self, conn: ClientConnection):
+        conns = self.active_connections.get(conn.device_id)
+        if conns and conn in conns:
+            conns.remove(conn)
+            if not conns:
+                del self.active_connections[conn.device_id]
+        if conn.task is not None and conn.task is not asyncio.current_task():
+            conn.task.cancel()
+
+    def _evict(self, conn: ClientConnection, reason: str):
+        """Saca al consumidor lento/muerto; el endpoint recibe el disconnect y limpia su estado."""
+        self.evicted += 1
+        logger.warning(f"⚠️ [WS] Socket desalojado ({reason}) en {conn.device_id}")
+        self._remove(conn)
+        asyncio.create_task(self._close(conn))
+
+    @staticmethod
+    async def _close(conn: ClientConnection):
+        try:
+            await asyncio.wait_for(conn.websocket.close(code=1013), timeout=1.0)
+        except Exception:
+            pass
+
+    async def _sender(self, conn: ClientConnection):
+        try:
+            while True:
+                frame = await conn.queue.get()
+                send = conn.websocket.send_bytes(frame) if type(frame) is bytes else conn.websocket.send_text(frame)
                 try:
-                    await connection.send_json(message)
+                    await asyncio.wait_for(send, timeout=self.send_timeout)
+                except asyncio.TimeoutError:
+                    self._evict(conn, "timeout de envío")
+                    return
                 except Exception:
-                    # Si falla, la conexión probablemente ya no es válida
-                    pass
+                    # La conexión ya no es válida
+                    self._evict(conn, "socket cerrado")
+                    return
+                conn.sent += 1
+                self.frames_sent += 1
+        except asyncio.CancelledError:
+            pass
+
+    async def send_personal_message(self, message: dict, device_id: str):
+        """
+        Encola el mensaje en cada suscriptor; nunca espera a un socket. Se
+        proyecta y serializa una sola vez por filtro y codificación, así que
+        los dashboards con la misma suscripción comparten el frame. Los sockets
+        en modo delta arman su propio frame (solo llaves cambiadas).
+        """
+        conns = self.active_connections.get(device_id)
+        if not conns:
+            return
+        encoded = {}
+        for conn in conns[:]:
+            if conn.delta:
+                frame = conn.delta_frame(message)
+                if frame is not None:
+                    self._enqueue(conn, encode_message(frame, conn.encoding))
+                continue
+            key = conn.filter_key
+            if key not in encoded:
+                projected = conn.project(message)
+                encoded[key] = encode_message(projected, conn.encoding) if projected is not None else None
+            frame = encoded[key]
+            if frame is not None:
+                self._enqueue(conn, frame)
+
+    def stats(self):
+        return {
+            "subscribers": {device_id: len(conns) for device_id, conns in self.active_connections.items()},
+            "connections": sum(len(conns) for conns in self.active_connections.values()),
+            "filtered": sum(
+                1 for conns in self.active_connections.values() for c in conns
+                if c.paths is not None or c.keys is not None
+            ),
+            "delta": sum(1 for conns in self.active_connections.values() for c in conns if c.delta),
+            "msgpack": sum(
+                1 for conns in self.active_connections.values() for c in conns
+                if c.encoding == ENCODING_MSGPACK
+            ),
+            "snapshots": self.snapshots,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "evicted": self.evicted
+        }
 
 # Instancia única global
-ws_manager = ConnectionManager()
\ No newline at end of file
+ws_manager = ConnectionManager(queue_size=settings.ws_send_queue_size, send_timeout=settings.ws_send_timeout_s)
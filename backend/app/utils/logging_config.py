@@ -0,0 +1,143 @@
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from app.config import settings
+
+SQL_LOGGER = "sqlalchemy.engine"
+
+# Atributos estándar de LogRecord (todo lo demás viene de `extra=`)
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por evento: campos base + los pasados en `extra=`."""
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legible para consola; agrega los campos de `extra=` como k=v."""
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = [
+            f"{k}={v}" for k, v in record.__dict__.items()
+            if k not in _RESERVED and not k.startswith("_")
+        ]
+        return f"{line} | {' '.join(fields)}" if fields else line
+
+
+class LogSampler:
+    """
+    Deja pasar 1 de cada `every` eventos (por llave) para los logs de
+    depuración del camino caliente. `every <= 1` no muestrea.
+    """
+    def __init__(self, every):
+        self.every = max(1, int(every))
+        self._counters = {}
+
+    def allow(self, key=None):
+        if self.every == 1:
+            return True
+        counter = self._counters.get(key)
+        if counter is None:
+            # Cada llave arranca dejando pasar su primer evento
+            counter = self._counters.setdefault(key, itertools.count())
+        return next(counter) % self.every == 0
+
+
+def parse_levels(spec):
+    """'app.services.mqtt_bridge=DEBUG,sqlalchemy.engine=INFO' -> dict."""
+    levels = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def set_level(name, level):
+    logging.getLogger(name or None).setLevel(level.upper() if isinstance(level, str) else level)
+
+
+def set_sql_echo(enabled):
+    """Equivalente a `echo=True` del engine, pero conmutable en caliente."""
+    logging.getLogger(SQL_LOGGER).setLevel(logging.INFO if enabled else logging.WARNING)
+
+
+def sql_echo_enabled():
+    return logging.getLogger(SQL_LOGGER).isEnabledFor(logging.INFO)
+
+
+def current_levels():
+    """Niveles efectivos de los loggers configurados explícitamente."""
+    names = set(parse_levels(settings.log_levels)) | {SQL_LOGGER}
+    manager = logging.Logger.manager.loggerDict
+    names |= {n for n, lg in manager.items() if isinstance(lg, logging.Logger) and lg.level != logging.NOTSET}
+    return {
+        "root": logging.getLevelName(logging.getLogger().level),
+        **{n: logging.getLevelName(logging.getLogger(n).getEffectiveLevel()) for n in sorted(names)}
+    }
+
+
+def setup_logging():
+    """
+    Configura el logging del proceso (idempotente):
+    - Los handlers de la app solo encolan (QueueHandler); un hilo
+      QueueListener hace el formateo y la escritura a stdout, así los
+      callbacks MQTT y los workers nunca bloquean en I/O.
+    - Nivel raíz `LOG_LEVEL` y niveles por subsistema `LOG_LEVELS`.
+    - SQL echo apagado salvo `SQL_ECHO=true` (conmutable en caliente).
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if settings.log_format == "json" else TextFormatter()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(settings.log_level.upper())
+
+    # Librerías ruidosas en DEBUG
+    for name in ("botocore", "boto3", "urllib3", "s3transfer", "awscrt"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    set_sql_echo(settings.sql_echo)
+    for name, level in parse_levels(settings.log_levels).items():
+        set_level(name, level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Vacía la cola de logs pendientes (apagado del servidor)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,5 +1,4 @@
 import logging
-import sys
 import os
 from dotenv import load_dotenv
 from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
@@ -8,11 +7,8 @@ from pydantic import EmailStr
 # Cargar variables de entorno
 load_dotenv()
 
-# 1. Configuración de logging ultra detallada
-logging.basicConfig(level=logging.DEBUG)
+# 1. Logging: usa la configuración central (app.utils.logging_config); nivel vía LOG_LEVELS
 logger = logging.getLogger("fastapi_mail")
-handler = logging.StreamHandler(sys.stdout)
-logger.addHandler(handler)
 
 # 2. Detectar ambiente
 ENV_TYPE = os.getenv("ENV_TYPE", "local")
@@ -0,0 +1,87 @@
+"""
+Microbenchmark del evaluador de alarmas: camino escalar vs vectorizado (NumPy).
+
+Uso (desde backend/):
+    python test/bench_alarm_eval.py
+    python test/bench_alarm_eval.py --sizes 16,64,256,1024,4096 --rounds 200
+
+Imprime el costo por payload de cada camino y el tamaño a partir del cual
+conviene el vectorizado (valor sugerido para ALARM_VECTOR_THRESHOLD).
+No toca la base de datos.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+# Permite ejecutar el script directamente desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.alarm_rules import AlarmRule, RuleBlock
+from app.services.alarm_engine import AlarmEngine
+from app.services.alert_state import alert_state
+
+
+def build_block(n_tags):
+    rules = {}
+    for i in range(n_tags):
+        tag = SimpleNamespace(
+            id=i + 1, device_id=1, path="root", mqtt_key=f"tag_{i}",
+            min_value=10.0 if i % 3 else None, max_value=90.0,
+            hysteresis=2.0, alert_delay=3600, display_name=None, unit="°C"
+        )
+        rules[tag.mqtt_key] = AlarmRule(tag)
+    return RuleBlock(rules)
+
+
+def build_payload(n_tags, out_ratio=0.01):
+    payload = {}
+    for i in range(n_tags):
+        # La gran mayoría en rango; una fracción fuera para ejercitar transiciones
+        payload[f"tag_{i}"] = 95.0 if random.random() < out_ratio else round(random.uniform(20, 80), 2)
+    return payload
+
+
+def time_path(fn, block, payloads, rounds):
+    started = time.perf_counter()
+    for r in range(rounds):
+        fn(1, block, payloads[r % len(payloads)], 1000.0 + r)
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="4,8,16,32,64,128,256,512,1024,2048,5000")
+    parser.add_argument("--rounds", type=int, default=300)
+    args = parser.parse_args()
+
+    # Estado en memoria sin cargar desde la DB; alert_delay alto => sin escrituras
+    alert_state.loaded = True
+    engine = AlarmEngine()
+    random.seed(7)
+
+    print(f"{'tags':>6} | {'escalar µs':>11} | {'vector µs':>10} | {'speedup':>7}")
+    print("-" * 44)
+    crossover = None
+    for n in [int(s) for s in args.sizes.split(",")]:
+        block = build_block(n)
+        payloads = [build_payload(n) for _ in range(16)]
+        scalar = time_path(engine.evaluate_scalar, block, payloads, args.rounds)
+        alert_state.breach_start.clear(); alert_state.by_device.clear()
+        vector = time_path(engine.evaluate_vector, block, payloads, args.rounds)
+        alert_state.breach_start.clear(); alert_state.by_device.clear()
+        if crossover is None and vector < scalar:
+            crossover = n
+        print(f"{n:>6} | {scalar:>11.1f} | {vector:>10.1f} | {scalar / vector:>6.2f}x")
+
+    print("-" * 44)
+    if crossover:
+        print(f"Cruce: el vectorizado gana desde ~{crossover} tags por payload")
+    else:
+        print("El camino escalar fue más rápido en todos los tamaños probados")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark de la compresión del historian (deadband + swinging door):
+almacenamiento ahorrado vs. error de reconstrucción.
+
+Uso (desde backend/):
+    python test/bench_compression.py
+    python test/bench_compression.py --deviations 0.05,0.1,0.5 --exception 0
+    python test/bench_compression.py --recorded --device SN-XXXX --hours 24
+
+Con --recorded lee las series numéricas grabadas en telemetry_logs (base
+configurada en .env / DATABASE_URL); sin él usa señales sintéticas típicas
+de planta. El error se mide reconstruyendo por interpolación lineal (igual
+que /historical) en los timestamps originales. La desviación se expresa
+como % del rango de cada serie.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Permite ejecutar el script directamente desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.compression import TagCompressor
+
+
+def synthetic_series(n=86400, seed=7):
+    """Un día a 1 Hz de señales con comportamientos distintos."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n, dtype=np.float64)
+    steps = np.repeat(rng.choice([0.0, 50.0, 80.0], size=n // 3600 + 1), 3600)[:n]
+    return {
+        "temperatura_lenta": 60 + 5 * np.sin(2 * np.pi * t / 86400) + rng.normal(0, 0.02, n),
+        "presion_ruidosa": 6 + rng.normal(0, 0.05, n),
+        "nivel_random_walk": 50 + np.cumsum(rng.normal(0, 0.01, n)),
+        "setpoint_escalones": steps + rng.normal(0, 0.01, n),
+        "flujo_ciclico": 120 + 30 * np.sin(2 * np.pi * t / 900) + rng.normal(0, 0.3, n),
+    }, t
+
+
+def recorded_series(device_uid, hours):
+    from app.database import SessionLocal
+    from app import models
+
+    db = SessionLocal()
+    try:
+        query = db.query(models.TelemetryLog.timestamp, models.TelemetryLog.data)
+        if device_uid:
+            query = query.filter(models.TelemetryLog.device_uid == device_uid)
+        since = datetime.utcnow() - timedelta(hours=hours)
+        rows = query.filter(models.TelemetryLog.timestamp >= since)\
+            .order_by(models.TelemetryLog.timestamp.asc()).all()
+    finally:
+        db.close()
+
+    points = {}
+    for ts, data in rows:
+        if not isinstance(data, dict):
+            continue
+        for key, value in data.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                points.setdefault(key, ([], []))
+                points[key][0].append(ts.timestamp())
+                points[key][1].append(float(value))
+    return {k: (np.asarray(t), np.asarray(v)) for k, (t, v) in points.items() if len(t) > 10}
+
+
+def run(times, values, deviation, exception):
+    comp = TagCompressor(deviation, exception)
+    archived = []
+    for ts, value in zip(times.tolist(), values.tolist()):
+        archived.extend(comp.offer(ts, value))
+    archived.extend(comp.drain())
+    a_t = np.array([p[0] for p in archived])
+    a_v = np.array([p[1] for p in archived])
+    err = np.abs(np.interp(times, a_t, a_v) - values)
+    return len(archived), float(err.max()), float(np.sqrt((err ** 2).mean()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--deviations", default="0.1,0.5,1,2", help="% del rango de cada serie")
+    parser.add_argument("--exception", type=float, default=None,
+                        help="banda de excepción en % del rango (por defecto: deviation/4, tope deviation/2)")
+    parser.add_argument("--recorded", action="store_true", help="usar telemetry_logs en vez de señales sintéticas")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--hours", type=float, default=24)
+    args = parser.parse_args()
+
+    if args.recorded:
+        data = recorded_series(args.device, args.hours)
+        if not data:
+            print("No hay series numéricas grabadas en el rango pedido.")
+            return
+    else:
+        series, t = synthetic_series()
+        data = {k: (t, v) for k, v in series.items()}
+
+    deviations = [float(d) for d in args.deviations.split(",")]
+    print(f"{'serie':<22} {'dev %':>6} {'puntos':>8} {'archiv.':>8} {'ahorro':>8} {'err máx':>10} {'rmse':>10} {'err máx/dev':>11}")
+    total_in = {d: 0 for d in deviations}
+    total_out = {d: 0 for d in deviations}
+    for name, (times, values) in data.items():
+        span = float(values.max() - values.min()) or 1.0
+        for pct in deviations:
+            deviation = span * pct / 100.0
+            exception = span * args.exception / 100.0 if args.exception is not None else None
+            kept, max_err, rmse = run(times, values, deviation, exception)
+            total_in[pct] += len(values)
+            total_out[pct] += kept
+            print(f"{name:<22} {pct:>6} {len(values):>8} {kept:>8} {100 * (1 - kept / len(values)):>7.2f}% "
+                  f"{max_err:>10.4f} {rmse:>10.4f} {max_err / deviation:>11.2f}")
+    print()
+    for pct in deviations:
+        print(f"Total dev {pct}%: {total_in[pct]} -> {total_out[pct]} puntos "
+              f"({100 * (1 - total_out[pct] / total_in[pct]):.2f}% menos)")
+
+
+if __name__ == "__main__":
+    main()
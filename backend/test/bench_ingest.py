@@ -0,0 +1,296 @@
+"""
+Benchmark del camino caliente de la ingesta, sin AWS ni red: un publicador
+falso entrega paquetes sintéticos al callback MQTT del servicio de ingesta
+(`_on_publish_received`) y todo lo demás es el código real (pipeline,
+parseo, dedup, last_values, compresión, alarmas, telemetry writer,
+conflación y WebSocket manager con sockets falsos).
+
+Uso (desde backend/):
+    python test/bench_ingest.py
+    python test/bench_ingest.py --devices 200 --tags 100 --nesting 2 --messages 50000
+    python test/bench_ingest.py --rate 2000 --seconds 20 --viewers 50
+    python test/bench_ingest.py --postgres      # base de .env (DB_*), filas BENCH-* se borran al final
+
+Reporta msgs/s procesados, latencia p50/p99 de punta a punta (recepción
+del paquete -> frame entregado al socket, incluye la conflación del vivo),
+filas/s escritas en telemetry_logs (con el escritor en marcha y
+tras el vuelco final del stop) y CPU por mensaje (total del proceso y
+descontando al publicador). Por defecto usa una SQLite temporal.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+# Permite ejecutar el script directamente desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEVICE_PREFIX = "BENCH-"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--tags", type=int, default=50, help="tags por payload")
+    parser.add_argument("--nesting", type=int, default=0, help="niveles de anidamiento de los tags")
+    parser.add_argument("--messages", type=int, default=20000, help="total de mensajes (si no se da --seconds)")
+    parser.add_argument("--seconds", type=float, default=0, help="duración en vez de un total de mensajes")
+    parser.add_argument("--rate", type=float, default=0, help="mensajes/s del publicador (0 = lo más rápido posible)")
+    parser.add_argument("--viewers", type=int, default=10, help="equipos con un WebSocket abierto")
+    parser.add_argument("--no-history", action="store_true", help="equipos sin history_enabled (sin filas en la base)")
+    parser.add_argument("--postgres", action="store_true", help="usar la base configurada en .env en vez de SQLite temporal")
+    parser.add_argument("--seed", type=int, default=11)
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+WORKDIR = tempfile.mkdtemp(prefix="bench_ingest_")
+if not ARGS.postgres:
+    # SQLite temporal: sin credenciales de Postgres database.py usa DATABASE_URL
+    os.environ["DB_HOST"] = ""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+# El benchmark es de un solo proceso: bus local y spool fuera del repo
+os.environ["LIVE_BUS_BACKEND"] = "local"
+os.environ["TELEMETRY_SPOOL_DIR"] = os.path.join(WORKDIR, "spool")
+
+from sqlalchemy import delete
+from app.database import engine, Base, SessionLocal
+from app import models
+from app.services.device_registry import device_registry
+from app.services.alarm_rules import alarm_rules
+from app.services.compression import historian_compressor
+from app.services.mqtt_bridge import ingest_service
+from app.services.live_bus import live_bus
+from app.services.live_conflator import live_conflator
+from app.services.telemetry_writer import telemetry_writer
+from app.services.websocket_manager import ws_manager
+
+
+class FakeWebSocket:
+    """Lo mínimo de starlette.WebSocket que usa el ConnectionManager; mide la latencia por frame."""
+    def __init__(self, latencies):
+        self.scope = {"subprotocols": []}
+        self.query_params = {}
+        self.latencies = latencies
+        self.frames = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, frame):
+        now = time.time()
+        message = json.loads(frame)
+        self.latencies.append(now - message["metadata"]["server_ts"])
+        self.frames += 1
+
+    async def send_bytes(self, frame):
+        raise NotImplementedError
+
+    async def close(self, code=1000):
+        pass
+
+
+# --- DATOS SINTÉTICOS ---
+def seed_devices(n_devices, history):
+    """Partner/cliente/planta y equipos BENCH-* (se reutilizan si ya existen)."""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        plant = db.query(models.Plant).filter(models.Plant.name == "Bench Plant").first()
+        if plant is None:
+            partner = models.Partner(name="Bench Partner", email=f"bench-{os.getpid()}@example.com")
+            db.add(partner)
+            db.flush()
+            client = models.Client(name="Bench Client", partner_id=partner.id, tax_id=f"BENCH-{os.getpid()}")
+            db.add(client)
+            db.flush()
+            plant = models.Plant(name="Bench Plant", client_id=client.id)
+            db.add(plant)
+            db.flush()
+        existing = {uid for (uid,) in db.query(models.Device.aws_iot_uid)
+                    .filter(models.Device.aws_iot_uid.like(f"{DEVICE_PREFIX}%"))}
+        for i in range(n_devices):
+            uid = f"{DEVICE_PREFIX}{i:05d}"
+            if uid not in existing:
+                db.add(models.Device(name=f"Equipo {i}", aws_iot_uid=uid, plant_id=plant.id,
+                                     is_active=True, history_enabled=history, payload_format="json"))
+        db.query(models.Device).filter(models.Device.aws_iot_uid.like(f"{DEVICE_PREFIX}%")) \
+            .update({"history_enabled": history, "is_active": True}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    return [f"{DEVICE_PREFIX}{i:05d}" for i in range(n_devices)]
+
+
+def build_values(n_tags, nesting, rng):
+    """Tags de planta (floats, enteros, booleanos) repartidos en `nesting` niveles de grupos."""
+    values = {}
+    for i in range(n_tags):
+        r = i % 10
+        value = round(rng.uniform(0, 500), 3) if r < 7 else rng.randint(0, 65535) if r < 9 else rng.random() > 0.5
+        node = values
+        for level in range(nesting):
+            node = node.setdefault(f"g{level}_{i % (level + 2)}", {})
+        node[f"tag_{i:04d}"] = value
+    return values
+
+
+class Publisher(threading.Thread):
+    """Hace de hilo de awscrt: entrega paquetes al callback de la ingesta al ritmo pedido."""
+    def __init__(self, topics, payloads, total, seconds, rate):
+        super().__init__(name="bench-publisher", daemon=True)
+        self.topics = topics
+        self.payloads = payloads
+        self.total = total
+        self.seconds = seconds
+        self.rate = rate
+        self.published = 0
+        self.cpu = 0.0
+
+    def run(self):
+        cpu_start = time.thread_time()
+        started = time.perf_counter()
+        seq = 0
+        n_topics, n_payloads = len(self.topics), len(self.payloads)
+        while True:
+            elapsed = time.perf_counter() - started
+            if self.seconds:
+                if elapsed >= self.seconds:
+                    break
+            elif self.published >= self.total:
+                break
+            if self.rate and self.published >= self.rate * elapsed:
+                time.sleep(0.0005)
+                continue
+            topic = self.topics[seq % n_topics]
+            # `seq` distinto por mensaje: la deduplicación QoS 1 no descarta nada
+            payload = b'{"seq":%d,%s' % (seq, self.payloads[seq % n_payloads])
+            ingest_service._on_publish_received(
+                SimpleNamespace(publish_packet=SimpleNamespace(topic=topic, payload=payload))
+            )
+            seq += 1
+            self.published += 1
+        self.cpu = time.thread_time() - cpu_start
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+# --- CORRIDA ---
+async def run():
+    rng = random.Random(ARGS.seed)
+    uids = seed_devices(ARGS.devices, not ARGS.no_history)
+    device_registry.load_all()
+    alarm_rules.load_all()
+    historian_compressor.load_all()
+
+    # Pool de ingesta sin clientes MQTT: solo rutas, pipeline, vivo y escritor
+    loop = asyncio.get_running_loop()
+    ingest_service.ws_manager = ws_manager
+    ingest_service.main_loop = loop
+    live_bus.start(loop, ws_manager)
+    live_conflator.start(live_bus, loop)
+    ingest_service.pipeline.start()
+    telemetry_writer.start()
+    telemetry_writer.enable_spool()
+    ingest_service.subscribe_devices([device_registry.get(uid).bridge_spec() for uid in uids])
+
+    latencies = []
+    sockets = []
+    for uid in uids[:ARGS.viewers]:
+        websocket = FakeWebSocket(latencies)
+        await ws_manager.connect(websocket, uid)
+        sockets.append((websocket, uid))
+
+    topics = [ingest_service.routes[uid].topic_filter[:-2] + "/linea1" for uid in uids]
+    # Cuerpos pre-serializados (sin la llave inicial, la pone el publicador con el `seq`)
+    payloads = [
+        json.dumps({"values": build_values(ARGS.tags, ARGS.nesting, rng)}, separators=(",", ":"))[1:].encode()
+        for _ in range(16)
+    ]
+
+    pipeline = ingest_service.pipeline
+    rows_before = telemetry_writer.rows_written
+    processed_before = pipeline.processed + pipeline.errors
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+
+    publisher = Publisher(topics, payloads, ARGS.messages, ARGS.seconds, ARGS.rate)
+    publisher.start()
+    while publisher.is_alive():
+        await asyncio.sleep(0.05)
+    # Esperar a que los workers vacíen la cola
+    while pipeline.processed + pipeline.errors - processed_before < publisher.published:
+        await asyncio.sleep(0.01)
+    processed_at = time.perf_counter()
+    cpu_processed = time.process_time() - cpu_before
+    # Último ciclo de conflación hacia los sockets y vuelco por antigüedad del escritor
+    await asyncio.sleep(max(2 * live_conflator.interval, telemetry_writer.max_age) + 0.05)
+    # Filas en la base con el escritor en marcha (el vuelco por `max_age` no espera al stop)
+    rows_live = telemetry_writer.rows_written - rows_before
+    live_at = time.perf_counter()
+
+    # El escritor vuelca lo pendiente al detenerse
+    await loop.run_in_executor(None, telemetry_writer.stop)
+    written_at = time.perf_counter()
+
+    for websocket, uid in sockets:
+        ws_manager.disconnect(websocket, uid)
+    pipeline.stop()
+    live_conflator.stop()
+    await live_bus.stop()
+
+    messages = publisher.published
+    process_s = processed_at - started
+    rows = telemetry_writer.rows_written - rows_before
+    print(f"Base: {engine.dialect.name} | equipos: {ARGS.devices} | tags: {ARGS.tags} | "
+          f"anidamiento: {ARGS.nesting} | sockets: {len(sockets)} | ritmo: {ARGS.rate or 'máximo'}")
+    print(f"Workers: {pipeline.workers} | política de cola: {pipeline.policy} | "
+          f"vivo: {1 / live_conflator.interval if live_conflator.interval else 'sin tope'} Hz")
+    print()
+    print(f"{'mensajes':<26} {messages:>12}")
+    print(f"{'errores':<26} {pipeline.errors:>12}")
+    print(f"{'msgs/s procesados':<26} {messages / process_s:>12.0f}")
+    print(f"{'frames WebSocket':<26} {len(latencies):>12}")
+    print(f"{'latencia p50 (ms)':<26} {percentile(latencies, 50) * 1000:>12.1f}")
+    print(f"{'latencia p99 (ms)':<26} {percentile(latencies, 99) * 1000:>12.1f}")
+    print(f"{'filas en la base':<26} {rows:>12}")
+    print(f"{'filas antes del stop':<26} {rows_live:>12}")
+    print(f"{'filas/s en marcha':<26} {rows_live / (live_at - started):>12.0f}")
+    print(f"{'filas/s con el stop':<26} {rows / (written_at - started):>12.0f}")
+    print(f"{'CPU/msg total (µs)':<26} {cpu_processed / max(1, messages) * 1e6:>12.1f}")
+    print(f"{'CPU/msg sin publicador':<26} {(cpu_processed - publisher.cpu) / max(1, messages) * 1e6:>12.1f}")
+
+
+def cleanup():
+    if ARGS.postgres:
+        db = SessionLocal()
+        try:
+            db.execute(delete(models.TelemetryLog).where(models.TelemetryLog.device_uid.like(f"{DEVICE_PREFIX}%")))
+            db.commit()
+        finally:
+            db.close()
+    engine.dispose()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+def main():
+    try:
+        asyncio.run(run())
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
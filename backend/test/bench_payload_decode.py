@@ -0,0 +1,101 @@
+"""
+Microbenchmark del parseo de payloads: camino anterior (decode utf-8 +
+json.loads + limpieza recursiva en dos pasadas) vs. payload_codec
+(orjson/msgpack/CBOR directo desde bytes + normalización en una pasada).
+
+Uso (desde backend/):
+    python test/bench_payload_decode.py
+    python test/bench_payload_decode.py --tags 200 --rounds 20000
+
+No toca la base de datos ni AWS.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# Permite ejecutar el script directamente desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import payload_codec
+from app.services.payload_codec import decode_payload, normalize_telemetry
+
+
+# --- CAMINO ANTERIOR (copiado de mqtt_bridge antes del cambio) ---
+def legacy_clean(data):
+    if isinstance(data, list):
+        return legacy_clean(data[0]) if len(data) > 0 else None
+    if isinstance(data, dict):
+        return {k: legacy_clean(v) for k, v in data.items()}
+    return data
+
+
+def legacy_round(data):
+    if isinstance(data, dict):
+        return {k: legacy_round(v) for k, v in data.items()}
+    if isinstance(data, float):
+        return round(data, 2)
+    return data
+
+
+def legacy_parse(payload_bytes):
+    payload = json.loads(bytes(payload_bytes).decode('utf-8'))
+    raw = payload.get('values', payload.get('d', payload))
+    return legacy_round(legacy_clean(raw))
+
+
+def build_payload(n_tags):
+    values = {}
+    for i in range(n_tags):
+        r = i % 4
+        if r == 0:
+            values[f"tag_{i}"] = random.uniform(0, 100)
+        elif r == 1:
+            values[f"tag_{i}"] = [random.uniform(0, 100)]
+        elif r == 2:
+            values[f"tag_{i}"] = random.randint(0, 1000)
+        else:
+            values[f"tag_{i}"] = bool(i % 2)
+    return {"values": values}
+
+
+def timed(fn, data, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(data)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tags", type=int, default=120, help="tags por payload (~3 KB con 120)")
+    parser.add_argument("--rounds", type=int, default=10000)
+    args = parser.parse_args()
+
+    payload = build_payload(args.tags)
+    as_json = json.dumps(payload).encode()
+    print(f"Payload: {args.tags} tags, {len(as_json)} bytes JSON")
+    print(f"Backends: orjson={'sí' if payload_codec.orjson else 'no'} "
+          f"msgpack={'sí' if payload_codec.msgpack else 'no'} cbor2={'sí' if payload_codec.cbor2 else 'no'}")
+
+    # memoryview simula el buffer que entrega awscrt
+    view = memoryview(as_json)
+    assert legacy_parse(view) == normalize_telemetry(decode_payload(view, "json"))
+
+    base = timed(legacy_parse, view, args.rounds)
+    print(f"{'legacy json':<14} {base:8.1f} µs/msg")
+
+    cases = [("json", view)]
+    if payload_codec.msgpack:
+        cases.append(("msgpack", memoryview(payload_codec.msgpack.packb(payload))))
+    if payload_codec.cbor2:
+        cases.append(("cbor", memoryview(payload_codec.cbor2.dumps(payload))))
+    for fmt, data in cases:
+        cost = timed(lambda d: normalize_telemetry(decode_payload(d, fmt)), data, args.rounds)
+        print(f"{fmt:<14} {cost:8.1f} µs/msg  ({base / cost:4.1f}x)  {len(data)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark de la codificación de frames del WebSocket de monitoreo:
+JSON (json estándar y orjson) vs. msgpack, en tamaño y tiempo.
+
+Uso (desde backend/):
+    python test/bench_ws_encoding.py
+    python test/bench_ws_encoding.py --tags 800 --rounds 5000
+
+Arma mensajes con la misma forma que `enriched_data` del bridge (telemetría
+numérica de planta + metadata) y mide el costo de serializarlos una vez y
+de decodificarlos (aprox. del lado del navegador). No toca la base de datos.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# Permite ejecutar el script directamente desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import websocket_manager
+from app.services.websocket_manager import encode_message, ENCODING_JSON, ENCODING_MSGPACK
+
+
+def build_message(n_tags, seed=3):
+    """Mezcla típica: mayoría float con 2 decimales, algunos enteros, booleanos y estados."""
+    rng = random.Random(seed)
+    telemetry = {}
+    for i in range(n_tags):
+        r = i % 10
+        if r < 7:
+            telemetry[f"tag_{i:04d}"] = round(rng.uniform(0, 500), 2)
+        elif r < 9:
+            telemetry[f"tag_{i:04d}"] = rng.randint(0, 65535)
+        else:
+            telemetry[f"tag_{i:04d}"] = rng.random() > 0.5
+    telemetry["estado"] = "RUN"
+    return {
+        "telemetry": telemetry,
+        "metadata": {
+            "subtopic": "linea1/caldera",
+            "server_ts": time.time(),
+            "samples": 1,
+            "device_id": "SN-000123",
+            "client": "Cliente Demo",
+            "plant": "Planta Norte"
+        }
+    }
+
+
+def timed(fn, data, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(data)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tags", default="10,100,800", help="tags por mensaje (lista separada por comas)")
+    parser.add_argument("--rounds", type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"Backends: orjson={'sí' if websocket_manager.orjson else 'no'} "
+          f"msgpack={'sí' if websocket_manager.msgpack else 'no'}")
+    print(f"{'tags':>5} {'codificación':<14} {'bytes':>8} {'encode µs':>10} {'decode µs':>10}")
+    for n_tags in [int(n) for n in args.tags.split(",")]:
+        message = build_message(n_tags)
+        cases = [
+            ("json stdlib", lambda m: json.dumps(m, separators=(",", ":")), json.loads),
+            ("json (actual)", lambda m: encode_message(m, ENCODING_JSON), json.loads),
+        ]
+        if websocket_manager.msgpack:
+            unpack = websocket_manager.msgpack.unpackb
+            cases.append(("msgpack", lambda m: encode_message(m, ENCODING_MSGPACK), unpack))
+        for name, encode, decode in cases:
+            frame = encode(message)
+            assert decode(frame)["telemetry"] == message["telemetry"]
+            size = len(frame.encode() if isinstance(frame, str) else frame)
+            enc = timed(encode, message, args.rounds)
+            dec = timed(decode, frame, args.rounds)
+            print(f"{n_tags:>5} {name:<14} {size:>8} {enc:>10.1f} {dec:>10.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Chequeo de varios workers en un solo proceso, sin AWS ni servicios
+externos: dos `LeaseElection` contra una SQLite temporal (un solo líder,
+relevo al soltar el lease y al vencer sin heartbeat, base caída sin
+degradar al líder) y dos buses
+`UnixSocketBus` con su propio ConnectionManager y sockets falsos (fan-out
+del vivo, anuncio de interés y pedido de estado al que ingesta).
+
+Uso (desde backend/):
+    python test/check_failover.py
+    python test/check_failover.py --ttl 2 --heartbeat 0.5
+
+Imprime OK/FAIL por chequeo y sale con código 1 si alguno falla.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Permite ejecutar el script directamente desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ttl", type=float, default=1.0, help="segundos de vida del lease")
+    parser.add_argument("--heartbeat", type=float, default=0.2, help="segundos entre renovaciones")
+    parser.add_argument("--timeout", type=float, default=5.0, help="espera máxima por chequeo")
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+WORKDIR = tempfile.mkdtemp(prefix="check_failover_")
+os.environ["DB_HOST"] = ""
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'check.db')}"
+os.environ["LIVE_BUS_BACKEND"] = "local"
+
+from app.database import engine, Base
+from app import models  # noqa: F401 (registra las tablas para create_all)
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from app.database import SessionLocal
+from app.services import leader as leader_module
+from app.services.leader import LeaseElection
+from app.services.live_bus import UnixSocketBus
+from app.services.websocket_manager import ConnectionManager
+
+FAILURES = []
+
+
+def check(name, ok, detail=""):
+    print(f"{'OK  ' if ok else 'FAIL'} {name}{f' ({detail})' if detail else ''}")
+    if not ok:
+        FAILURES.append(name)
+
+
+def wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+async def wait_for_async(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.02)
+    return predicate()
+
+
+class FakeWebSocket:
+    """Lo mínimo de starlette.WebSocket que usa el ConnectionManager; guarda los frames."""
+    def __init__(self):
+        self.scope = {"subprotocols": []}
+        self.query_params = {}
+        self.frames = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, frame):
+        self.frames.append(json.loads(frame))
+
+    async def send_bytes(self, frame):
+        raise NotImplementedError
+
+    async def close(self, code=1000):
+        pass
+
+
+# --- LIDERAZGO ---
+def check_leases():
+    Base.metadata.create_all(bind=engine)
+    events = []
+
+    def election(holder):
+        lease = LeaseElection("check", ttl=ARGS.ttl, heartbeat=ARGS.heartbeat)
+        lease.holder = holder  # Mismo PID: cada "worker" se identifica aparte
+        lease.start(
+            on_elected=lambda: events.append((holder, "elected")),
+            on_demoted=lambda: events.append((holder, "demoted"))
+        )
+        return lease
+
+    a = election("worker-a")
+    b = election("worker-b")
+    time.sleep(ARGS.heartbeat * 3)
+    leaders = [lease.holder for lease in (a, b) if lease.is_leader]
+    check("un solo líder", leaders == ["worker-a"], f"líderes: {leaders}")
+
+    # Relevo ordenado: el líder suelta el lease al apagarse
+    started = time.monotonic()
+    a.stop()
+    took_over = wait_for(lambda: b.is_leader, ARGS.timeout)
+    check("relevo al soltar el lease", took_over, f"{time.monotonic() - started:.2f}s")
+
+    # Caída: el líder deja de renovar sin soltar; el standby espera a que venza
+    c = election("worker-c")
+    with b._cond:
+        b._running = False
+        b._cond.notify()
+    b._thread.join()
+    started = time.monotonic()
+    took_over = wait_for(lambda: c.is_leader, ARGS.timeout)
+    elapsed = time.monotonic() - started
+    check("relevo al vencer el lease", took_over, f"{elapsed:.2f}s")
+    check("sin relevo antes del ttl", not took_over or elapsed >= ARGS.ttl - 2 * ARGS.heartbeat, f"{elapsed:.2f}s")
+    current = c.current()
+    check("fila del lease", current is not None and current["holder"] == "worker-c", str(current))
+    check("callbacks de elección", ("worker-b", "elected") in events and ("worker-c", "elected") in events)
+
+    # Base caída (mantenimiento): nadie puede renovar; el líder no se degrada ni el standby sube
+    d = election("worker-d")
+    time.sleep(ARGS.heartbeat * 2)
+
+    def down():
+        raise OperationalError("SELECT 1", {}, ConnectionRefusedError("base en mantenimiento"))
+    leader_module.SessionLocal = down
+    try:
+        time.sleep(max(ARGS.ttl * 2, ARGS.heartbeat * 5))
+        check("base caída: el líder conserva el rol", c.is_leader and ("worker-c", "demoted") not in events,
+              f"errores: {c.errors}")
+        check("base caída: el standby no sube", not d.is_leader)
+    finally:
+        leader_module.SessionLocal = SessionLocal
+    time.sleep(ARGS.heartbeat * 3)
+    check("base de vuelta: mismo líder", c.is_leader and not d.is_leader, str(c.current()))
+
+    # Al volver la base el líder ve otro holder en la fila (lo tomó otra réplica): recién ahí se degrada
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(models.ServiceLease).where(models.ServiceLease.name == "check")
+            .values(holder="worker-x", expires_at=time.time() + 60)
+        )
+        db.commit()
+    finally:
+        db.close()
+    demoted = wait_for(lambda: not c.is_leader, ARGS.timeout)
+    check("otro holder visto: el líder se degrada", demoted and ("worker-c", "demoted") in events)
+    c.stop()
+    d.stop()
+
+
+# --- BUS ENTRE WORKERS ---
+async def check_bus():
+    loop = asyncio.get_running_loop()
+    path = os.path.join(WORKDIR, "live.sock")
+    interest = []
+    workers = []
+    for name, ingesting in (("worker-a", True), ("worker-b", False)):
+        bus = UnixSocketBus(path, channel="check", interest_interval=0.5)
+        bus.worker_id = name
+        manager = ConnectionManager()
+        bus.start(
+            loop, manager,
+            on_interest=(lambda uid, watching: interest.append((uid, watching))) if ingesting else None,
+            ingesting=lambda ingesting=ingesting: ingesting
+        )
+        workers.append((bus, manager))
+    (bus_a, manager_a), (bus_b, manager_b) = workers
+    connected = await wait_for_async(lambda: bus_a.connected and bus_b.connected, ARGS.timeout)
+    check("ambos workers conectados al broker", connected,
+          f"broker: {'a' if bus_a.is_broker else 'b' if bus_b.is_broker else '-'}")
+
+    socket_a, socket_b = FakeWebSocket(), FakeWebSocket()
+    await manager_a.connect(socket_a, "DEV-1")
+    await manager_b.connect(socket_b, "DEV-1")
+    bus_b.announce_interest()
+    announced = await wait_for_async(lambda: "DEV-1" in bus_a.watched, ARGS.timeout)
+    check("interés anunciado por el worker sin ingesta", announced and ("DEV-1", True) in interest)
+
+    message = {"telemetry": {"t": 21.5}, "metadata": {"subtopic": "linea1", "server_ts": time.time()}}
+    await bus_a.publish("DEV-1", message)
+    delivered = await wait_for_async(lambda: socket_a.frames and socket_b.frames, ARGS.timeout)
+    check("fan-out del vivo a los dos workers", bool(delivered),
+          f"frames a={len(socket_a.frames)} b={len(socket_b.frames)}")
+
+    replied = await bus_b.request_state(["DEV-1"], timeout=ARGS.timeout)
+    check("estado pedido al worker que ingesta", replied, f"timeouts: {bus_b.state_timeouts}")
+
+    manager_b.disconnect(socket_b, "DEV-1")
+    bus_b.announce_interest()
+    withdrawn = await wait_for_async(lambda: "DEV-1" not in bus_a.watched, ARGS.timeout)
+    check("interés retirado al cerrar el socket", withdrawn and ("DEV-1", False) in interest)
+
+    manager_a.disconnect(socket_a, "DEV-1")
+    await bus_b.stop()
+    await bus_a.stop()
+
+
+def main():
+    try:
+        check_leases()
+        asyncio.run(check_bus())
+    finally:
+        engine.dispose()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+    print()
+    print(f"FAIL ({len(FAILURES)} chequeo(s) fallidos)" if FAILURES else "OK")
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Chequeo de los timestamps de muestra en `expand_samples`: ts válidos (s, ms,
+ISO-8601) se respetan, y los negativos, lejanos al futuro, NaN o años
+como 9999 caen a la hora de recepción sin tirar el resto de las muestras
+del mensaje. También la muestra única con `ts` escalar en la raíz.
+
+Uso (desde backend/):
+    python test/check_payload_codec.py
+    python test/check_payload_codec.py --max-skew 3600
+
+Imprime OK/FAIL por chequeo y sale con código 1 si alguno falla.
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+# Permite ejecutar el script directamente desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.payload_codec import expand_samples
+
+FAILURES = []
+
+
+def check(name, ok, detail=""):
+    print(f"{'OK  ' if ok else 'FAIL'} {name}{f' ({detail})' if detail else ''}")
+    if not ok:
+        FAILURES.append(name)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--max-skew", type=float, default=7 * 86400, help="segundos aceptados entre ts del equipo y recepción")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    recv_ts = time.time()
+    past = recv_ts - min(600, args.max_skew / 2)
+    past_iso = datetime.fromtimestamp(past, tz=timezone.utc).isoformat()
+
+    # --- TS VÁLIDOS ---
+    for label, raw in (("epoch s", past), ("epoch ms", past * 1000), ("ISO-8601", past_iso)):
+        samples = expand_samples([{"ts": raw, "t": 1.0}], recv_ts, args.max_skew)
+        check(f"ts válido respetado ({label})", abs(samples[0][0] - past) < 0.01, str(samples[0][0]))
+
+    # --- TS FUERA DE RANGO ---
+    bad = {
+        "negativo": -86400,
+        "futuro lejano": recv_ts + args.max_skew + 86400,
+        "ms lejano": (recv_ts + args.max_skew + 86400) * 1000,
+        "año 9999": "9999-12-31T23:59:59",
+        "año 1": "0001-01-01T00:00:00+14:00",
+        "NaN": math.nan,
+        "infinito": math.inf,
+        "ilegible": "ayer",
+    }
+    for label, raw in bad.items():
+        samples = expand_samples([{"ts": raw, "t": 1.0}, {"ts": past, "t": 2.0}], recv_ts, args.max_skew)
+        stamps = {s[1]["t"]: s[0] for s in samples}
+        check(f"ts {label} -> recepción", stamps.get(1.0) == recv_ts and len(samples) == 2, str(stamps.get(1.0)))
+        try:
+            for ts, _ in samples:
+                datetime.fromtimestamp(ts, tz=timezone.utc)
+            converted = True
+        except (ValueError, OverflowError, OSError) as e:
+            converted = f"{type(e).__name__}: {e}"
+        check(f"ts {label}: todas las muestras convertibles", converted is True, "" if converted is True else converted)
+
+    columnar = expand_samples({"ts": [past, "9999-01-01"], "values": {"t": [1.0, 2.0]}}, recv_ts, args.max_skew)
+    check("columnar con un ts malo", [s[0] for s in columnar] == [past, recv_ts], str([s[0] for s in columnar]))
+
+    # --- MUESTRA ÚNICA CON TS ESCALAR ---
+    single = expand_samples({"ts": past, "values": {"t": 1.0}}, recv_ts, args.max_skew)
+    check("ts escalar con 'values'", single == [(past, {"t": 1.0})], str(single))
+    single = expand_samples({"ts": past_iso, "t": 1.0, "p": 2}, recv_ts, args.max_skew)
+    check("ts escalar en la raíz (no queda como medición)",
+          len(single) == 1 and abs(single[0][0] - past) < 0.01 and single[0][1] == {"t": 1.0, "p": 2}, str(single))
+    single = expand_samples({"ts": -1, "values": {"t": 1.0}}, recv_ts, args.max_skew)
+    check("ts escalar fuera de rango -> recepción", single == [(recv_ts, {"t": 1.0})], str(single))
+    plain = expand_samples({"values": {"t": 1.0}}, recv_ts, args.max_skew)
+    check("sin ts: hora del servidor", plain == [(recv_ts, {"t": 1.0})], str(plain))
+
+    print()
+    print(f"FAIL ({len(FAILURES)} chequeo(s) fallidos)" if FAILURES else "OK")
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
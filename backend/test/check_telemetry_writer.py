@@ -0,0 +1,169 @@
+"""
+Chequeo del escritor por lotes de `telemetry_logs` contra una SQLite
+temporal, sin ingesta: vuelco por antigüedad (`max_age`) con el escritor
+en marcha, sin esperar a completar el lote ni al stop, y filas no
+serializables a JSON en el spool (se descartan sin matar el hilo) y
+lotes con filas que la base rechaza siempre (en vivo y al reproducir el
+spool: se aíslan las filas malas sin dar la base por caída).
+
+Uso (desde backend/):
+    python test/check_telemetry_writer.py
+    python test/check_telemetry_writer.py --max-age 0.5
+
+Imprime OK/FAIL por chequeo y sale con código 1 si alguno falla.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# Permite ejecutar el script directamente desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--max-age", type=float, default=0.25, help="segundos máximos de una fila en memoria")
+    parser.add_argument("--timeout", type=float, default=5.0, help="espera máxima por chequeo")
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+WORKDIR = tempfile.mkdtemp(prefix="check_writer_")
+os.environ["DB_HOST"] = ""
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'check.db')}"
+
+from app.database import engine, Base, SessionLocal
+from app import models
+from app.services.telemetry_spool import TelemetrySpool
+from app.services.telemetry_writer import TelemetryWriter
+
+FAILURES = []
+
+
+def check(name, ok, detail=""):
+    print(f"{'OK  ' if ok else 'FAIL'} {name}{f' ({detail})' if detail else ''}")
+    if not ok:
+        FAILURES.append(name)
+
+
+def wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def count_rows(device_uid):
+    db = SessionLocal()
+    try:
+        return db.query(models.TelemetryLog).filter(models.TelemetryLog.device_uid == device_uid).count()
+    finally:
+        db.close()
+
+
+# --- VUELCO POR ANTIGÜEDAD ---
+def check_age_flush():
+    writer = TelemetryWriter(batch_size=5000, max_age=ARGS.max_age)
+    writer.start()
+    try:
+        # Con el hilo ya dormido sin nada pendiente
+        time.sleep(0.1)
+        started = time.monotonic()
+        writer.add("AGE-1", {"t": 1.0}, "linea1")
+        written = wait_for(lambda: writer.rows_written == 1, ARGS.timeout)
+        elapsed = time.monotonic() - started
+        check("fila suelta escrita sin stop", written, f"{elapsed:.2f}s")
+        check("dentro de ~max_age", written and elapsed < ARGS.max_age + 0.5, f"max_age {ARGS.max_age:g}s")
+
+        # Goteo: filas de a una, más espaciadas que max_age
+        for i in range(5):
+            writer.add("AGE-2", {"t": float(i)}, "linea1")
+            time.sleep(ARGS.max_age / 2)
+        written = wait_for(lambda: count_rows("AGE-2") == 5, ARGS.timeout)
+        check("goteo a baja frecuencia en la base", written, f"buffered={writer.stats()['buffered']}")
+    finally:
+        writer.stop()
+
+
+# --- FILAS NO SERIALIZABLES EN EL SPOOL ---
+def check_unserializable():
+    spool = TelemetrySpool(os.path.join(WORKDIR, "spool"))
+    writer = TelemetryWriter(batch_size=5000, max_age=ARGS.max_age, spool=spool, retry_interval=60.0)
+    writer.start()
+    writer.enable_spool()
+    try:
+        wait_for(lambda: writer.spool is not None, ARGS.timeout)
+        # Base "caída": los lotes van directo al spool
+        writer._db_down_until = time.monotonic() + 60.0
+        writer.add("BAD-1", {"a": b"\x01"}, "linea1")
+        writer.add("BAD-1", {"a": 1.0}, "linea1")
+        spooled = wait_for(lambda: writer.spooled_rows == 1, ARGS.timeout)
+        check("fila válida del lote en el spool", spooled, f"spool: {spool.stats()}")
+        check("fila no serializable descartada y contada", spool.rejected_rows == 1 and writer.failed_rows == 1)
+        check("hilo del escritor vivo", writer._thread is not None and writer._thread.is_alive())
+
+        writer.add("BAD-1", {"a": 2.0}, "linea1")
+        spooled = wait_for(lambda: writer.spooled_rows == 2, ARGS.timeout)
+        check("filas siguientes no quedan en memoria", spooled, f"buffered={writer.stats()['buffered']}")
+    finally:
+        writer.stop()
+
+
+# --- LOTES ENVENENADOS ---
+def check_poison():
+    # device_uid NULL viola el NOT NULL: IntegrityError en cualquier motor
+    def row(device_uid, value):
+        return {"device_uid": device_uid, "timestamp": datetime.now(timezone.utc),
+                "data": {"t": value}, "path": "linea1"}
+
+    directory = os.path.join(WORKDIR, "spool-poison")
+    seeded = TelemetrySpool(directory)
+    seeded.open()
+    seeded.append([row("POISON-1", 1.0), row(None, 2.0), row("POISON-1", 3.0), row("POISON-1", 4.0)])
+    seeded.close()
+
+    writer = TelemetryWriter(batch_size=5000, max_age=ARGS.max_age, spool=TelemetrySpool(directory))
+    writer.start()
+    writer.enable_spool()
+    try:
+        replayed = wait_for(
+            lambda: writer.spool is not None and not writer.spool.pending_bytes and count_rows("POISON-1") == 3,
+            ARGS.timeout
+        )
+        check("spool con una fila mala se reproduce", replayed, f"filas: {count_rows('POISON-1')}")
+        check("fila mala del spool descartada", writer.rejected_rows == 1, f"rejected={writer.rejected_rows}")
+        check("la base no queda marcada como caída", not writer.stats()["db_down"])
+
+        writer.add("POISON-2", {"t": 1.0}, "linea1")
+        writer.add(None, {"t": 2.0}, "linea1")
+        writer.add("POISON-2", {"t": 3.0}, "linea1")
+        written = wait_for(lambda: count_rows("POISON-2") == 2, ARGS.timeout)
+        check("lote en vivo con una fila mala", written and writer.rejected_rows == 2,
+              f"rejected={writer.rejected_rows} spooled={writer.spooled_rows}")
+        check("nada desviado al spool", writer.spooled_rows == 0 and not writer.stats()["db_down"])
+    finally:
+        writer.stop()
+
+
+def main():
+    try:
+        Base.metadata.create_all(bind=engine)
+        check_age_flush()
+        check_unserializable()
+        check_poison()
+    finally:
+        engine.dispose()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+    print()
+    print(f"FAIL ({len(FAILURES)} chequeo(s) fallidos)" if FAILURES else "OK")
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()